@@ -1,9 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
 box_points = []
 button_down = False
 
+MATCH_METHODS = {
+    "TM_CCOEFF": cv2.TM_CCOEFF,
+    "TM_CCOEFF_NORMED": cv2.TM_CCOEFF_NORMED,
+    "TM_CCORR": cv2.TM_CCORR,
+    "TM_CCORR_NORMED": cv2.TM_CCORR_NORMED,
+    "TM_SQDIFF": cv2.TM_SQDIFF,
+    "TM_SQDIFF_NORMED": cv2.TM_SQDIFF_NORMED,
+}
+SQDIFF_METHODS = ("TM_SQDIFF", "TM_SQDIFF_NORMED")
+
+_executors = {}
+
+
+class MethodError(ValueError):
+    pass
+
+
 def rotate_image(image, angle):
     image_center = tuple(np.array(image.shape[1::-1]) / 2)
     rot_mat = cv2.getRotationMatrix2D(image_center, -angle, 1.0)
@@ -27,8 +46,210 @@ def scale_image(image, percent, maxwh):
     result = cv2.resize(image, (width, height), interpolation = cv2.INTER_AREA)
     return result, percent
 
+def pyramid_down(image, levels):
+    for _ in range(levels):
+        image = cv2.pyrDown(image)
+    return image
+
+
+class TemplateBank:
+    """
+    Rotated and scaled grayscale variants of a template, built once and reused across frames.
+
+    rgbtemplate: RGB template the variants are generated from.
+    rot_range, rot_interval, scale_range, scale_interval: Same meaning as in invariant_match_template.
+
+    max_shape: (height, width) of the largest variant.
+    """
+    def __init__(self, rgbtemplate, rot_range, rot_interval, scale_range, scale_interval):
+        self.rgbtemplate = rgbtemplate
+        self.template_gray = cv2.cvtColor(rgbtemplate, cv2.COLOR_RGB2GRAY)
+        self.rot_range = rot_range
+        self.rot_interval = rot_interval
+        self.scale_range = scale_range
+        self.scale_interval = scale_interval
+        self.__variants = {}
+        self.__coarse_variants = {}
+
+        height, width = self.template_gray.shape
+        for next_scale in range(scale_range[0], scale_range[1], scale_interval):
+            scaled_width = int(width * next_scale / 100)
+            scaled_height = int(height * next_scale / 100)
+            scaled_template_gray = cv2.resize(self.template_gray, (scaled_width, scaled_height), interpolation=cv2.INTER_AREA)
+            for next_angle in range(rot_range[0], rot_range[1], rot_interval):
+                if next_angle == 0:
+                    rotated_template = scaled_template_gray
+                else:
+                    rotated_template = rotate_image(scaled_template_gray, next_angle)
+                self.__variants[(next_angle, next_scale)] = rotated_template
+
+        self.max_shape = (max((t.shape[0] for t in self.__variants.values()), default=0),
+                          max((t.shape[1] for t in self.__variants.values()), default=0))
+
+    def matches(self, rgbtemplate, rot_range, rot_interval, scale_range, scale_interval):
+        """Check whether the bank was built for the given template and search ranges."""
+        return (self.rgbtemplate is rgbtemplate
+                and list(self.rot_range) == list(rot_range) and self.rot_interval == rot_interval
+                and list(self.scale_range) == list(scale_range) and self.scale_interval == scale_interval)
+
+    def get(self, angle, scale, maxwh):
+        """
+        Returns: Rotated template and actual scale, same as scale_image followed by rotate_image.
+        Variants that would not fit into maxwh are generated on the fly with the clamped scale.
+        """
+        rotated_template = self.__variants.get((angle, scale))
+        height, width = self.template_gray.shape
+        max_percent = min(maxwh[1] / width * 100, maxwh[0] / height * 100)
+        if rotated_template is None or scale > max_percent:
+            scaled_template_gray, actual_scale = scale_image(self.template_gray, scale, maxwh)
+            if angle == 0:
+                return scaled_template_gray, actual_scale
+            return rotate_image(scaled_template_gray, angle), actual_scale
+        return rotated_template, scale
+
+    def get_coarse(self, angle, scale, maxwh, levels):
+        """
+        Returns: Rotated template, its copy downsampled by levels pyramid steps and actual scale.
+        """
+        rotated_template, actual_scale = self.get(angle, scale, maxwh)
+        if actual_scale != scale:
+            return rotated_template, pyramid_down(rotated_template, levels), actual_scale
+        coarse_template = self.__coarse_variants.get((angle, scale, levels))
+        if coarse_template is None:
+            coarse_template = pyramid_down(rotated_template, levels)
+            self.__coarse_variants[(angle, scale, levels)] = coarse_template
+        return rotated_template, coarse_template, actual_scale
+
 
-def invariant_match_template(rgbimage, rgbtemplate, method, matched_thresh, rot_range, rot_interval, scale_range, scale_interval, rm_redundant, minmax, rgbdiff_thresh=float("inf")):
+def warped_template(template_gray, angle, scale, maxwh, template_bank=None):
+    """
+    Returns: Template scaled and rotated for the angle/scale pair and actual scale, taken from template_bank if given.
+    """
+    if template_bank is not None:
+        return template_bank.get(angle, scale, maxwh)
+    scaled_template_gray, actual_scale = scale_image(template_gray, scale, maxwh)
+    if angle == 0:
+        return scaled_template_gray, actual_scale
+    return rotate_image(scaled_template_gray, angle), actual_scale
+
+
+def get_executor(workers):
+    """Returns: Shared thread pool with given number of workers, created on first use."""
+    executor = _executors.get(workers)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"invariant_tm_{workers}")
+        _executors[workers] = executor
+    return executor
+
+
+def map_pairs(function, pairs, workers=1):
+    """
+    Applies function to every angle/scale pair, on a thread pool if workers > 1.
+
+    Returns: List of function results in the order of pairs.
+    """
+    if workers > 1 and len(pairs) > 1:
+        return list(get_executor(workers).map(function, pairs))
+    return [function(pair) for pair in pairs]
+
+
+def suppress_redundant(points, width, height):
+    """
+    Greedy removal of points closer than the scaled template size to an already kept point, in list order.
+    Every kept point suppresses all later points at once, so the work is vectorized over the remaining points.
+
+    Returns: Kept elements of points, in the same order and format.
+    """
+    if len(points) == 0:
+        return []
+    xy = np.array([point_info[0] for point_info in points], dtype=np.float64).reshape(-1, 2)
+    scales = np.array([point_info[2] for point_info in points], dtype=np.float64)
+    max_dx = width * scales / 100
+    max_dy = height * scales / 100
+    suppressed = np.zeros(len(points), dtype=bool)
+
+    lone_points_list = []
+    i = 0
+    while True:
+        lone_points_list.append(points[i])
+        rest = slice(i + 1, None)
+        suppressed[rest] |= ((np.abs(xy[rest, 0] - xy[i, 0]) < max_dx[rest]) &
+                             (np.abs(xy[rest, 1] - xy[i, 1]) < max_dy[rest]))
+        remaining = np.flatnonzero(~suppressed[rest])
+        if len(remaining) == 0:
+            return lone_points_list
+        i = i + 1 + int(remaining[0])
+
+
+def coarse_to_fine_match(img_gray, template_gray, method, matched_thresh, rot_range, rot_interval, scale_range, scale_interval, pyramid_levels, coarse_candidates, template_bank=None, workers=1):
+    """
+    Hierarchical variant of the minmax search in invariant_match_template.
+    Every angle/scale pair is matched on the image downsampled by pyramid_levels pyramid steps, then only
+    coarse_candidates best pairs are matched again at full resolution in a small window around the coarse location.
+
+    Returns: List of satisfied matched points in format [[point.x, point.y], angle, scale, value], best first.
+    """
+    if method not in MATCH_METHODS:
+        raise MethodError("There's no such comparison method for template matching.")
+    cv_method = MATCH_METHODS[method]
+    sqdiff = method in SQDIFF_METHODS
+    image_maxwh = img_gray.shape
+    img_coarse = pyramid_down(img_gray, pyramid_levels)
+    factor = 2 ** pyramid_levels
+    margin = 2 * factor
+
+    def match_coarse(pair):
+        next_angle, next_scale = pair
+        if template_bank is not None:
+            rotated_template, coarse_template, actual_scale = template_bank.get_coarse(next_angle, next_scale, image_maxwh, pyramid_levels)
+        else:
+            rotated_template, actual_scale = warped_template(template_gray, next_angle, next_scale, image_maxwh)
+            coarse_template = pyramid_down(rotated_template, pyramid_levels)
+        if (coarse_template.shape[0] > img_coarse.shape[0] or coarse_template.shape[1] > img_coarse.shape[1]
+                or min(coarse_template.shape) < 1):
+            # no score would rank it correctly against real ones, SQDIFF and CCOEFF scores can be negative
+            return None
+        matched_points = cv2.matchTemplate(img_coarse, coarse_template, cv_method)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
+        if sqdiff:
+            return [min_loc, next_angle, actual_scale, -min_val, rotated_template]
+        return [max_loc, next_angle, actual_scale, max_val, rotated_template]
+
+    def match_fine(coarse_point):
+        coarse_loc, next_angle, actual_scale, _, rotated_template = coarse_point
+        img_height, img_width = image_maxwh
+        template_height, template_width = rotated_template.shape
+        if template_height > img_height or template_width > img_width or min(rotated_template.shape) < 1:
+            return []
+        x0 = min(max(coarse_loc[0] * factor - margin, 0), img_width - template_width)
+        y0 = min(max(coarse_loc[1] * factor - margin, 0), img_height - template_height)
+        x1 = min(coarse_loc[0] * factor + margin + template_width, img_width)
+        y1 = min(coarse_loc[1] * factor + margin + template_height, img_height)
+        matched_points = cv2.matchTemplate(img_gray[y0:y1, x0:x1], rotated_template, cv_method)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
+        if sqdiff:
+            if min_val <= matched_thresh:
+                return [[(x0 + min_loc[0], y0 + min_loc[1]), next_angle, actual_scale, min_val]]
+        elif max_val >= matched_thresh:
+            return [[(x0 + max_loc[0], y0 + max_loc[1]), next_angle, actual_scale, max_val]]
+        return []
+
+    pairs = [(next_angle, next_scale)
+             for next_angle in range(rot_range[0], rot_range[1], rot_interval)
+             for next_scale in range(scale_range[0], scale_range[1], scale_interval)]
+    coarse_points = [point for point in map_pairs(match_coarse, pairs, workers) if point is not None]
+    coarse_points = sorted(coarse_points, key=lambda x: -x[3])[:coarse_candidates]
+
+    all_points = []
+    for points in map_pairs(match_fine, coarse_points, workers):
+        all_points.extend(points)
+
+    if sqdiff:
+        return sorted(all_points, key=lambda x: x[3])
+    return sorted(all_points, key=lambda x: -x[3])
+
+
+def invariant_match_template(rgbimage, rgbtemplate, method, matched_thresh, rot_range, rot_interval, scale_range, scale_interval, rm_redundant, minmax, rgbdiff_thresh=float("inf"), template_bank=None, pyramid_levels=0, coarse_candidates=5, workers=1):
     """
     rgbimage: RGB image where the search is running.
     rgbtemplate: RGB searched template. It must be not greater than the source image and have the same data type.
@@ -41,114 +262,60 @@ def invariant_match_template(rgbimage, rgbtemplate, method, matched_thresh, rot_
     rm_redundant: [Boolean] Option for removing redundant matched results based on the width and height of the template.
     minmax:[Boolean] Option for finding points with minimum/maximum value.
     rgbdiff_thresh: [Float] Setting threshold of average RGB difference between template and source image. Default: +inf threshold (no rgbdiff)
+    template_bank: [TemplateBank] Precomputed template variants for rgbtemplate and the same ranges. Default: None (variants are generated on every call)
+    pyramid_levels: [Integer] Number of pyramid steps for coarse-to-fine search, used only with minmax. Default: 0 (exhaustive full resolution search)
+    coarse_candidates: [Integer] Number of best coarse angle/scale candidates refined at full resolution. Default: 5
+    workers: [Integer] Number of threads matching angle/scale pairs in parallel. Results are the same as with one worker. Default: 1 (sequential)
 
     Returns: List of satisfied matched points in format [[point.x, point.y], angle, scale].
     """
+    if method not in MATCH_METHODS:
+        raise MethodError("There's no such comparison method for template matching.")
+    if template_bank is None or not template_bank.matches(rgbtemplate, rot_range, rot_interval, scale_range, scale_interval):
+        template_bank = None
+    cv_method = MATCH_METHODS[method]
+    sqdiff = method in SQDIFF_METHODS
     img_gray = cv2.cvtColor(rgbimage, cv2.COLOR_RGB2GRAY)
-    template_gray = cv2.cvtColor(rgbtemplate, cv2.COLOR_RGB2GRAY)
+    template_gray = template_bank.template_gray if template_bank is not None else cv2.cvtColor(rgbtemplate, cv2.COLOR_RGB2GRAY)
     image_maxwh = img_gray.shape
     height, width = template_gray.shape
+
+    def match_pair(pair):
+        next_angle, next_scale = pair
+        rotated_template, actual_scale = warped_template(template_gray, next_angle, next_scale, image_maxwh, template_bank)
+        matched_points = cv2.matchTemplate(img_gray, rotated_template, cv_method)
+        if minmax == False:
+            if sqdiff:
+                satisfied_points = np.where(matched_points <= matched_thresh)
+            else:
+                satisfied_points = np.where(matched_points >= matched_thresh)
+            return [[pt, next_angle, actual_scale] for pt in zip(*satisfied_points[::-1])]
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
+        if sqdiff:
+            if min_val <= matched_thresh:
+                return [[min_loc, next_angle, actual_scale, min_val]]
+        elif max_val >= matched_thresh:
+            return [[max_loc, next_angle, actual_scale, max_val]]
+        return []
+
     all_points = []
-    if minmax == False:
-        for next_angle in range(rot_range[0], rot_range[1], rot_interval):
-            for next_scale in range(scale_range[0], scale_range[1], scale_interval):
-                scaled_template_gray, actual_scale = scale_image(template_gray, next_scale, image_maxwh)
-                if next_angle == 0:
-                    rotated_template = scaled_template_gray
-                else:
-                    rotated_template = rotate_image(scaled_template_gray, next_angle)
-                if method == "TM_CCOEFF":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCOEFF)
-                    satisfied_points = np.where(matched_points >= matched_thresh)
-                elif method == "TM_CCOEFF_NORMED":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCOEFF_NORMED)
-                    satisfied_points = np.where(matched_points >= matched_thresh)
-                elif method == "TM_CCORR":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCORR)
-                    satisfied_points = np.where(matched_points >= matched_thresh)
-                elif method == "TM_CCORR_NORMED":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCORR_NORMED)
-                    satisfied_points = np.where(matched_points >= matched_thresh)
-                elif method == "TM_SQDIFF":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_SQDIFF)
-                    satisfied_points = np.where(matched_points <= matched_thresh)
-                elif method == "TM_SQDIFF_NORMED":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_SQDIFF_NORMED)
-                    satisfied_points = np.where(matched_points <= matched_thresh)
-                else:
-                    raise MethodError("There's no such comparison method for template matching.")
-                for pt in zip(*satisfied_points[::-1]):
-                    all_points.append([pt, next_angle, actual_scale])
+    if minmax == True and pyramid_levels > 0:
+        all_points = coarse_to_fine_match(img_gray, template_gray, method, matched_thresh, rot_range, rot_interval,
+                                          scale_range, scale_interval, pyramid_levels, coarse_candidates, template_bank,
+                                          workers)
     else:
-        for next_angle in range(rot_range[0], rot_range[1], rot_interval):
-            for next_scale in range(scale_range[0], scale_range[1], scale_interval):
-                scaled_template_gray, actual_scale = scale_image(template_gray, next_scale, image_maxwh)
-                if next_angle == 0:
-                    rotated_template = scaled_template_gray
-                else:
-                    rotated_template = rotate_image(scaled_template_gray, next_angle)
-                if method == "TM_CCOEFF":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCOEFF)
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
-                    if max_val >= matched_thresh:
-                        all_points.append([max_loc, next_angle, actual_scale, max_val])
-                elif method == "TM_CCOEFF_NORMED":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCOEFF_NORMED)
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
-                    if max_val >= matched_thresh:
-                        all_points.append([max_loc, next_angle, actual_scale, max_val])
-                elif method == "TM_CCORR":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCORR)
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
-                    if max_val >= matched_thresh:
-                        all_points.append([max_loc, next_angle, actual_scale, max_val])
-                elif method == "TM_CCORR_NORMED":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_CCORR_NORMED)
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
-                    if max_val >= matched_thresh:
-                        all_points.append([max_loc, next_angle, actual_scale, max_val])
-                elif method == "TM_SQDIFF":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_SQDIFF)
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
-                    if min_val <= matched_thresh:
-                        all_points.append([min_loc, next_angle, actual_scale, min_val])
-                elif method == "TM_SQDIFF_NORMED":
-                    matched_points = cv2.matchTemplate(img_gray,rotated_template,cv2.TM_SQDIFF_NORMED)
-                    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(matched_points)
-                    if min_val <= matched_thresh:
-                        all_points.append([min_loc, next_angle, actual_scale, min_val])
-                else:
-                    raise MethodError("There's no such comparison method for template matching.")
-        if method == "TM_CCOEFF":
-            all_points = sorted(all_points, key=lambda x: -x[3])
-        elif method == "TM_CCOEFF_NORMED":
-            all_points = sorted(all_points, key=lambda x: -x[3])
-        elif method == "TM_CCORR":
-            all_points = sorted(all_points, key=lambda x: -x[3])
-        elif method == "TM_CCORR_NORMED":
-            all_points = sorted(all_points, key=lambda x: -x[3])
-        elif method == "TM_SQDIFF":
-            all_points = sorted(all_points, key=lambda x: x[3])
-        elif method == "TM_SQDIFF_NORMED":
-            all_points = sorted(all_points, key=lambda x: x[3])
-    if rm_redundant == True:
-        lone_points_list = []
-        visited_points_list = []
-        for point_info in all_points:
-            point = point_info[0]
-            scale = point_info[2]
-            all_visited_points_not_close = True
-            if len(visited_points_list) != 0:
-                for visited_point in visited_points_list:
-                    if ((abs(visited_point[0] - point[0]) < (width * scale / 100)) and (abs(visited_point[1] - point[1]) < (height * scale / 100))):
-                        all_visited_points_not_close = False
-                if all_visited_points_not_close == True:
-                    lone_points_list.append(point_info)
-                    visited_points_list.append(point)
+        pairs = [(next_angle, next_scale)
+                 for next_angle in range(rot_range[0], rot_range[1], rot_interval)
+                 for next_scale in range(scale_range[0], scale_range[1], scale_interval)]
+        for points in map_pairs(match_pair, pairs, workers):
+            all_points.extend(points)
+        if minmax == True:
+            if sqdiff:
+                all_points = sorted(all_points, key=lambda x: x[3])
             else:
-                lone_points_list.append(point_info)
-                visited_points_list.append(point)
-        points_list = lone_points_list
+                all_points = sorted(all_points, key=lambda x: -x[3])
+    if rm_redundant == True:
+        points_list = suppress_redundant(all_points, width, height)
     else:
         points_list = all_points
     if rgbdiff_thresh != float("inf"):
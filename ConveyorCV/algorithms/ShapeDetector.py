@@ -5,33 +5,209 @@ from backend.settings import get_settings
 from model.model import DetectionContext
 from utils.downscale import downscale
 
+BACKGROUND_UPDATE_INTERVAL = 4
+
+# "full" segments the color frame, "fast" a grayscale frame downsampled by detection.fast_detection_scale
+FULL_DETECTION = "full"
+FAST_DETECTION = "fast"
+DETECTION_MODES = (FULL_DETECTION, FAST_DETECTION)
+
+# line gate: the band around the detection line is compared with the background as a small gray thumbnail
+GATE_BAND_HEIGHT = 0.02  # half height of the band, fraction of frame height
+GATE_THUMBNAIL_SIZE = (64, 4)
+GATE_PIXEL_THRESHOLD = 30
+
+
+def odd_size(size: float) -> int:
+    """Kernels scaled for the fast path are kept odd, even kernels shift the mask by half a pixel per iteration"""
+    size = max(int(round(size)), 1)
+    return size if size % 2 else size + 1
+
 
 class ShapeDetector:
     def __init__(self, settings=None):
         # todo: четко определить размер ядра
         self.kernel = np.ones((12, 12), np.uint8)
+        # todo: четко определить размер ядра
+        self.shape_kernel = np.ones((15, 15), np.uint8)
+        # scratch images of the detection steps, reused across frames of the same size
+        self.__buffers = {}
         self.settings = settings or get_settings()
+        self.load_background()
+
+    def __background_key(self) -> tuple:
+        processing, detection = self.settings.processing, self.settings.detection
+        return (self.settings.bg_photo_path, processing.downscale_width, processing.downscale_height,
+                detection.detection_mode, detection.fast_detection_scale)
+
+    def __init_fast_path(self):
+        """Frame size and kernels of the fast path, sizes of the full path scaled down"""
+        detection = self.settings.detection
+        if detection.detection_mode not in DETECTION_MODES:
+            raise ValueError(f"Unknown detection mode: {detection.detection_mode}")
+
+        self.__fast_size = None
+        if detection.detection_mode != FAST_DETECTION:
+            return
+
+        scale = detection.fast_detection_scale
+        width, height = self.settings.processing.downscale_width, self.settings.processing.downscale_height
+        self.__fast_size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        self.__fast_upscale = np.array([width / self.__fast_size[0], height / self.__fast_size[1]])
+        self.__fast_kernel = np.ones((odd_size(12 * scale),) * 2, np.uint8)
+        self.__fast_shape_kernel = np.ones((odd_size(15 * scale),) * 2, np.uint8)
+        self.__fast_blur = odd_size(11 * scale)
+        self.__fast_iterations = max(int(round(7 * scale)), 1)
+
+    def __buffer(self, name: str, shape: tuple) -> np.ndarray:
+        buffer = self.__buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.__buffers[name] = np.empty(shape, np.uint8)
+        return buffer
+
+    def load_background(self):
+        self.__init_fast_path()
         self.image_conveyor_empty = cv2.imread(self.settings.bg_photo_path)
         self.image_conveyor_empty = downscale(self.image_conveyor_empty, self.settings.processing.downscale_width, self.settings.processing.downscale_height)
-        self.image_conveyor_empty = cv2.morphologyEx(self.image_conveyor_empty, cv2.MORPH_CLOSE, self.kernel, iterations=3)
+        # frames are gated before any filtering, so the gate compares with the unfiltered background
+        self.__gate_source = self.image_conveyor_empty
+        self.__gate_model = self.__line_band(self.__gate_source).astype(np.float32)
+        if self.__fast_size is not None:
+            self.image_conveyor_empty = cv2.resize(self.image_conveyor_empty, self.__fast_size, interpolation=cv2.INTER_AREA)
+            self.image_conveyor_empty = cv2.cvtColor(self.image_conveyor_empty, cv2.COLOR_BGR2GRAY)
+            self.image_conveyor_empty = cv2.morphologyEx(self.image_conveyor_empty, cv2.MORPH_CLOSE, self.__fast_kernel, iterations=3)
+        else:
+            self.image_conveyor_empty = cv2.morphologyEx(self.image_conveyor_empty, cv2.MORPH_CLOSE, self.kernel, iterations=3)
+        self.__loaded_background = self.__background_key()
+        # running average of conveyor pixels, image_conveyor_empty is its 8-bit copy used for diffs
+        self.__background_model = self.image_conveyor_empty.astype(np.float32)
+        self.__foreground = np.empty(self.image_conveyor_empty.shape[:2], np.uint8)
+        self.__frames_since_update = 0
+
+    def apply_settings(self, settings):
+        """Use new settings, the background is reloaded only if its file or frame size changed"""
+        self.settings = settings
+        if self.__background_key() != self.__loaded_background:
+            self.load_background()
+        else:
+            # the detection line may have moved
+            self.__gate_model = self.__line_band(self.__gate_source).astype(np.float32)
+
+    def update_background(self, image: np.ndarray, image_thresh: np.ndarray, shape: np.ndarray):
+        """
+        Blend the frame into the background model where nothing is detected, so lighting drift is followed
+        without re-uploading the background. Pixels of the shape or over the diff threshold are left as is.
+        """
+        learning_rate = self.settings.detection.background_learning_rate
+        if learning_rate <= 0:
+            return
+
+        # blending every few frames with the compounded rate adapts as fast at a fraction of the cost,
+        # frames that skipped detection are compounded in as well, so the rate stays per frame
+        self.__frames_since_update += 1
+        if self.__frames_since_update < BACKGROUND_UPDATE_INTERVAL:
+            return
+        learning_rate = 1 - (1 - learning_rate) ** self.__frames_since_update
+        self.__frames_since_update = 0
+
+        cv2.bitwise_or(image_thresh, shape, dst=self.__foreground)
+        cv2.bitwise_not(self.__foreground, dst=self.__foreground)
+        cv2.accumulateWeighted(image, self.__background_model, learning_rate, mask=self.__foreground)
+        cv2.convertScaleAbs(self.__background_model, dst=self.image_conveyor_empty)
+
+    def skip_frame(self):
+        """Count a frame that is not detected, the next background update blends it in with the compounded rate"""
+        if self.settings.detection.background_learning_rate > 0:
+            self.__frames_since_update += 1
+
+    def __line_band(self, image: np.ndarray) -> np.ndarray:
+        """Gray thumbnail of the detection line between the detection borders, for frames of any size"""
+        detection = self.settings.detection
+        height, width = image.shape[:2]
+        band = max(int(height * GATE_BAND_HEIGHT), 1)
+        line = int(height * detection.detection_line_height)
+        x0, x1 = int(width * detection.detection_border_left), int(width * detection.detection_border_right)
+        y0, y1 = max(line - band, 0), min(line + band, height)
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros(GATE_THUMBNAIL_SIZE[::-1], np.uint8)
+
+        image = image[y0:y1, x0:x1]
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(image, GATE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+    def is_line_occupied(self, image: np.ndarray) -> bool:
+        """
+        Cheap check whether something covers the detection line. ShapeProcessor only accepts shapes spanning
+        the line between both borders, so frames failing this check can skip detection and processing.
+        """
+        coverage = self.settings.detection.line_gate_coverage
+        if coverage <= 0:
+            return True
+
+        band = self.__line_band(image).astype(np.float32)
+        diff = cv2.absdiff(band, self.__gate_model)
+        occupied = np.count_nonzero(diff > GATE_PIXEL_THRESHOLD) >= coverage * diff.size
+
+        # the gate thumbnail follows lighting drift like the background model, learning from empty lines only
+        learning_rate = self.settings.detection.background_learning_rate
+        if not occupied and learning_rate > 0:
+            cv2.accumulateWeighted(band, self.__gate_model, learning_rate)
+        return occupied
+
+    def __detect_fast(self, context: DetectionContext) -> DetectionContext:
+        """Same steps as the full path on a small grayscale frame, only the found contours are scaled back"""
+        width, height = self.__fast_size
+        size = (height, width)
+        image_small = cv2.resize(context.image, self.__fast_size, dst=self.__buffer("small", (height, width, 3)),
+                                 interpolation=cv2.INTER_AREA)
+        image_gray = cv2.cvtColor(image_small, cv2.COLOR_BGR2GRAY, dst=self.__buffer("gray", size))
+        image = cv2.morphologyEx(image_gray, cv2.MORPH_CLOSE, self.__fast_kernel, dst=self.__buffer("closed", size),
+                                 iterations=3)
+
+        image_diff = cv2.absdiff(image, self.image_conveyor_empty, dst=self.__buffer("diff", size))
+        image_blurred = cv2.GaussianBlur(image_diff, (self.__fast_blur, self.__fast_blur), 0,
+                                         dst=self.__buffer("blurred", size))
+
+        _, image_thresh = cv2.threshold(image_blurred, 50, 255, cv2.THRESH_BINARY, dst=self.__buffer("thresh", size))
+        image_eroded = cv2.erode(image_thresh, None, dst=self.__buffer("eroded", size), iterations=self.__fast_iterations)
+        canny = cv2.Canny(image_eroded, 0, 200, edges=self.__buffer("canny", size))
+        image_dilated = cv2.dilate(canny, None, dst=self.__buffer("dilated", size), iterations=self.__fast_iterations)
+        image_dilated = cv2.morphologyEx(image_dilated, cv2.MORPH_CLOSE, self.__fast_shape_kernel,
+                                         dst=self.__buffer("shape", size), iterations=7)
+
+        contours, _ = cv2.findContours(image_dilated, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        shape = np.zeros(context.image.shape[:2], np.uint8)
+        cv2.drawContours(shape, [np.round((c + 0.5) * self.__fast_upscale - 0.5).astype(np.int32) for c in contours],
+                         -1, 255, cv2.FILLED)
+
+        context.shape = shape
+        self.update_background(image, image_thresh, image_dilated)
+        return context
 
     def detect(self, context: DetectionContext) -> DetectionContext:
+        if self.__fast_size is not None:
+            return self.__detect_fast(context)
+
         image = context.image
-        image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, self.kernel, iterations=3)
+        size = image.shape[:2]
+        image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, self.kernel, dst=self.__buffer("closed", image.shape),
+                                 iterations=3)
 
-        image_diff = cv2.absdiff(image, self.image_conveyor_empty)
-        image_gray = cv2.cvtColor(image_diff, cv2.COLOR_BGR2GRAY)
-        image_blurred = cv2.GaussianBlur(image_gray, (11, 11), 0)
+        image_diff = cv2.absdiff(image, self.image_conveyor_empty, dst=self.__buffer("diff", image.shape))
+        image_gray = cv2.cvtColor(image_diff, cv2.COLOR_BGR2GRAY, dst=self.__buffer("gray", size))
+        image_blurred = cv2.GaussianBlur(image_gray, (11, 11), 0, dst=self.__buffer("blurred", size))
 
         # todo: четко определить порог
-        _, image_thresh = cv2.threshold(image_blurred, 50, 255, cv2.THRESH_BINARY)
-        image_eroded = cv2.erode(image_thresh, None, iterations=7)
-        canny = cv2.Canny(image_eroded, 0, 200)
-        image_dilated = cv2.dilate(canny, None, iterations=7)
+        _, image_thresh = cv2.threshold(image_blurred, 50, 255, cv2.THRESH_BINARY, dst=self.__buffer("thresh", size))
+        image_eroded = cv2.erode(image_thresh, None, dst=self.__buffer("eroded", size), iterations=7)
+        canny = cv2.Canny(image_eroded, 0, 200, edges=self.__buffer("canny", size))
+        image_dilated = cv2.dilate(canny, None, dst=self.__buffer("dilated", size), iterations=7)
 
-        # todo: четко определить размер ядра
-        image_dilated_kernel = np.ones((15, 15), np.uint8)
-        image_dilated = cv2.morphologyEx(image_dilated, cv2.MORPH_CLOSE, image_dilated_kernel, iterations=7)
+        # the shape is handed on with the frame and may still be queued when the next frame comes,
+        # so unlike the scratch images it is a new array every frame
+        image_dilated = cv2.morphologyEx(image_dilated, cv2.MORPH_CLOSE, self.shape_kernel, iterations=7)
 
         context.shape = image_dilated
+        self.update_background(image, image_thresh, image_dilated)
         return context
\ No newline at end of file
@@ -14,6 +14,10 @@ class ShapeProcessor:
         self.last_contour_center_x = 0
         self.last_detected_at = datetime.now()
 
+    def apply_settings(self, settings):
+        """Detection borders and line height are read from settings for every frame"""
+        self.settings = settings
+
     def __on_contour_valid(self, context, contour):
         now = datetime.now()
         M = cv2.moments(contour)
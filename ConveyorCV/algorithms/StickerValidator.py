@@ -7,13 +7,23 @@ import numpy as np
 from numpy import median
 from sqlalchemy.dialects.mssql.information_schema import sequences
 
-from algorithms.InvariantTM import invariant_match_template
+from algorithms.InvariantTM import invariant_match_template, TemplateBank, MATCH_METHODS
 from backend.settings import get_settings
 from model.model import StickerValidationParams, DetectionContext, StickerValidationResult
 
 logger = logging.getLogger(__name__)
 combined_validation_results = Queue()
 
+# todo parametric scale_range!!!
+ROT_RANGE = [-10, 10]
+ROT_INTERVAL = 1
+SCALE_RANGE = [10, 25]
+SCALE_INTERVAL = 4
+MATCH_METHOD = "TM_CCORR_NORMED"
+MATCH_THRESH = 0.5
+# window matches scoring this much below the same template elsewhere in the image are not confirmed
+CONFIRM_TOLERANCE = 1e-4
+
 
 def vignette(img, level=4):
     img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
@@ -49,13 +59,23 @@ def is_sticker_present(img: np.ndarray, threshold) -> bool:
     return bool(med > threshold)
 
 
+def fit_window(start, end, min_size, limit):
+    """Grow [start, end) to at least min_size without leaving [0, limit)"""
+    if end - start < min_size:
+        start = max(0, min(start, limit - min_size))
+        end = min(limit, start + min_size)
+    return start, end
+
+
 class StickerValidator:
     def __init__(self, params: StickerValidationParams = None):
-        self.__last_processed_acc_number: int = 1
+        self.last_processed_acc_number: int = 1
         self.__last_processed_acc_detections: list[DetectionContext] = []
         self.__expected_ratio_w: float = 0
         self.__expected_ratio_h: float = 0
         self.__params: StickerValidationParams | None = None
+        self.__template_rgb: np.ndarray | None = None
+        self.__template_bank: TemplateBank | None = None
 
         if params is None:
             from utils.param_persistence import get_sticker_parameters
@@ -67,15 +87,115 @@ class StickerValidator:
         self.__params = sticker_params
         self.__expected_ratio_w = self.__params.sticker_size[0] / self.__params.acc_size[0]
         self.__expected_ratio_h = self.__params.sticker_size[1] / self.__params.acc_size[1]
+        self.__template_rgb = cv2.cvtColor(self.__params.sticker_design, cv2.COLOR_BGR2RGB)
+        self.__template_bank = TemplateBank(self.__template_rgb, rot_range=ROT_RANGE, rot_interval=ROT_INTERVAL,
+                                            scale_range=SCALE_RANGE, scale_interval=SCALE_INTERVAL)
 
     def get_parameters(self) -> StickerValidationParams:
         return self.__params
 
+    def search_window(self, img_width: int, img_height: int, position_tolerance_percent: float) -> tuple[int, int, int, int]:
+        """
+        Area of the image where a sticker passing position validation can be found:
+        expected center plus position tolerance plus half of the largest template.
+        Returns (x0, y0, x1, y1).
+        """
+        expected_center_x = self.__params.sticker_center[0] / self.__params.acc_size[0] * img_width
+        expected_center_y = self.__params.sticker_center[1] / self.__params.acc_size[1] * img_height
+        margin_x = img_width * position_tolerance_percent / 100 + self.__template_bank.max_shape[1] / 2
+        margin_y = img_height * position_tolerance_percent / 100 + self.__template_bank.max_shape[0] / 2
+
+        x0 = max(int(expected_center_x - margin_x), 0)
+        y0 = max(int(expected_center_y - margin_y), 0)
+        x1 = min(int(np.ceil(expected_center_x + margin_x)) + 1, img_width)
+        y1 = min(int(np.ceil(expected_center_y + margin_y)) + 1, img_height)
+
+        # keep the window at least as large as the largest template, otherwise templates get clamped
+        x0, x1 = fit_window(x0, x1, self.__template_bank.max_shape[1], img_width)
+        y0, y1 = fit_window(y0, y1, self.__template_bank.max_shape[0], img_height)
+        return x0, y0, x1, y1
+
+    def __find_sticker(self, img_rgb: np.ndarray, settings, window: tuple[int, int, int, int] = None):
+        """
+        Best match of the sticker design in the image, or in window (x0, y0, x1, y1) of it.
+        Returns ((center x, center y), rotation, scale, confidence, (width, height)) in image coordinates, or None.
+        """
+        search_x, search_y = 0, 0
+        search_rgb = img_rgb
+        if window is not None:
+            search_x, search_y, search_x1, search_y1 = window
+            search_rgb = img_rgb[search_y:search_y1, search_x:search_x1]
+
+        # "TM_CCOEFF":
+        # "TM_CCOEFF_NORMED":
+        # "TM_CCORR":
+        # "TM_CCORR_NORMED":
+        # "TM_SQDIFF":
+        # "TM_SQDIFF_NORMED":
+        points_list = invariant_match_template(rgbimage=search_rgb, rgbtemplate=self.__template_rgb, method=MATCH_METHOD,
+                                               matched_thresh=MATCH_THRESH, rot_range=ROT_RANGE, rot_interval=ROT_INTERVAL,
+                                               scale_range=SCALE_RANGE, scale_interval=SCALE_INTERVAL,
+                                               rm_redundant=True, minmax=True, template_bank=self.__template_bank,
+                                               pyramid_levels=settings.validation.match_pyramid_levels,
+                                               workers=settings.processing.match_workers)
+
+        if len(points_list) > 1:
+            logger.error(f"more than 2 stickers? len(points_list) == {len(points_list)}")
+        if len(points_list) == 0:
+            return None
+
+        (x, y), rotation, scale, confidence = points_list[0]
+        sticker_size = (self.__template_rgb.shape[1] * scale / 100, self.__template_rgb.shape[0] * scale / 100)
+        center = (search_x + x + sticker_size[0] / 2, search_y + y + sticker_size[1] / 2)
+        return center, rotation, scale, confidence, sticker_size
+
+    def __check_sticker(self, match, img_width: int, img_height: int, settings) -> tuple[bool, bool, bool]:
+        """Returns whether position, rotation and size of the match are within tolerance"""
+        (x, y), rotation, scale, confidence, sticker_size = match
+
+        expected_center_x = self.__params.sticker_center[0] / self.__params.acc_size[0] * img_width
+        expected_center_y = self.__params.sticker_center[1] / self.__params.acc_size[1] * img_height
+
+        position_tolerance_x = img_width * settings.validation.position_tolerance_percent / 100
+        position_tolerance_y = img_height * settings.validation.position_tolerance_percent / 100
+
+        position_valid = (
+                abs(x - expected_center_x) <= position_tolerance_x and
+                abs(y - expected_center_y) <= position_tolerance_y
+        )
+
+        rotation_valid = abs(rotation - self.__params.sticker_rotation) <= settings.validation.rotation_tolerance_degrees
+
+        actual_ratio_w = sticker_size[0] / img_width
+        actual_ratio_h = sticker_size[1] / img_height
+
+        size_ratio_tolerance = settings.validation.size_ratio_tolerance
+        size_valid = (
+                abs(actual_ratio_w - self.__expected_ratio_w) <= size_ratio_tolerance and
+                abs(actual_ratio_h - self.__expected_ratio_h) <= size_ratio_tolerance
+        )
+
+        return position_valid, rotation_valid, size_valid
+
+    def __confirm_match(self, img_rgb: np.ndarray, match) -> bool:
+        """Whether the template of a window match scores no higher anywhere else in the whole image"""
+        _, rotation, scale, confidence, _ = match
+        img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
+        template, _ = self.__template_bank.get(rotation, scale, img_gray.shape)
+        _, max_val, _, _ = cv2.minMaxLoc(cv2.matchTemplate(img_gray, template, MATCH_METHODS[MATCH_METHOD]))
+        return max_val <= confidence + CONFIRM_TOLERANCE
+
     def validate(self, context: DetectionContext) -> DetectionContext:
-        if self.__last_processed_acc_number != context.seq_number:
+        if self.last_processed_acc_number != context.seq_number:
             self.process_combined_validation()
-            self.__last_processed_acc_number = context.seq_number
+            self.last_processed_acc_number = context.seq_number
 
+        context = self.validate_frame(context)
+        self.__last_processed_acc_detections.append(context)
+        return context
+
+    def validate_frame(self, context: DetectionContext) -> DetectionContext:
+        """Validate single frame of an accumulator without combining it with other frames"""
         img_bgr = context.processed_image
         img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
         img_height, img_width = img_rgb.shape[:2]
@@ -91,66 +211,29 @@ class StickerValidator:
         )
 
         if sticker_present:
-            template_bgr = self.__params.sticker_design
-            template_rgb = cv2.cvtColor(template_bgr, cv2.COLOR_BGR2RGB)
-
-            # "TM_CCOEFF":
-            # "TM_CCOEFF_NORMED":
-            # "TM_CCORR":
-            # "TM_CCORR_NORMED":
-            # "TM_SQDIFF":
-            # "TM_SQDIFF_NORMED":
-            # todo parametric scale_range!!!
-            points_list = invariant_match_template(rgbimage=img_rgb, rgbtemplate=template_rgb, method="TM_CCORR_NORMED",
-                                                   matched_thresh=0.5, rot_range=[-10, 10], rot_interval=1,
-                                                   scale_range=[10, 25], scale_interval=4, rm_redundant=True, minmax=True)
-
-            if len(points_list) > 1:
-                logger.error(f"more than 2 stickers? len(points_list) == {len(points_list)}")
-
-            if len(points_list) == 0:
+            settings = get_settings()
+            match = None
+            if settings.validation.roi_search:
+                window = self.search_window(img_width, img_height, settings.validation.position_tolerance_percent)
+                match = self.__find_sticker(img_rgb, settings, window)
+                # the window holds the best match inside it, not necessarily the best one in the whole image,
+                # so only matches that pass validation and are confirmed on the whole image are kept
+                if match is not None and not (all(self.__check_sticker(match, img_width, img_height, settings))
+                                              and self.__confirm_match(img_rgb, match)):
+                    match = None
+            if match is None:
+                match = self.__find_sticker(img_rgb, settings)
+
+            if match is None:
                 logger.info(f"SEQ {context.seq_number} wrong design")
                 context.validation_results.sticker_matches_design = False
             else:
-                rotation = points_list[0][1]
-                scale = points_list[0][2]
-                confidence = points_list[0][3]
+                (x, y), rotation, scale, confidence, sticker_size = match
+                position_valid, rotation_valid, size_valid = self.__check_sticker(match, img_width, img_height, settings)
 
-                sticker_size = (template_rgb.shape[1] * scale / 100, template_rgb.shape[0] * scale / 100)
-                x, y = points_list[0][0]
-                x, y = x + sticker_size[0] / 2, y + sticker_size[1] / 2
-                position_tuple = (x, y)
-                size_tuple = (float(sticker_size[0]), float(sticker_size[1]))
-
-                context.validation_results.sticker_position = position_tuple
+                context.validation_results.sticker_position = (x, y)
                 context.validation_results.sticker_rotation = float(rotation)
-                context.validation_results.sticker_size = size_tuple
-
-                settings = get_settings()
-                position_tolerance_percent = settings.validation.position_tolerance_percent
-                rotation_tolerance_degrees = settings.validation.rotation_tolerance_degrees
-                size_ratio_tolerance = settings.validation.size_ratio_tolerance
-
-                expected_center_x = self.__params.sticker_center[0] / self.__params.acc_size[0] * img_width
-                expected_center_y = self.__params.sticker_center[1] / self.__params.acc_size[1] * img_height
-
-                position_tolerance_x = img_width * position_tolerance_percent / 100
-                position_tolerance_y = img_height * position_tolerance_percent / 100
-
-                position_valid = (
-                        abs(x - expected_center_x) <= position_tolerance_x and
-                        abs(y - expected_center_y) <= position_tolerance_y
-                )
-
-                rotation_valid = abs(rotation - self.__params.sticker_rotation) <= rotation_tolerance_degrees
-
-                actual_ratio_w = sticker_size[0] / img_width
-                actual_ratio_h = sticker_size[1] / img_height
-
-                size_valid = (
-                        abs(actual_ratio_w - self.__expected_ratio_w) <= size_ratio_tolerance and
-                        abs(actual_ratio_h - self.__expected_ratio_h) <= size_ratio_tolerance
-                )
+                context.validation_results.sticker_size = (float(sticker_size[0]), float(sticker_size[1]))
 
                 sticker_matches_design = position_valid and rotation_valid and size_valid
                 context.validation_results.sticker_matches_design = sticker_matches_design
@@ -158,6 +241,13 @@ class StickerValidator:
                 # if rotation > 1 or rotation < -1:
                     # cv2.imwrite(f'data/{context.seq_number}_{time.thread_time()}.png', img_bgr)
 
+                expected_center_x = self.__params.sticker_center[0] / self.__params.acc_size[0] * img_width
+                expected_center_y = self.__params.sticker_center[1] / self.__params.acc_size[1] * img_height
+                position_tolerance_x = img_width * settings.validation.position_tolerance_percent / 100
+                position_tolerance_y = img_height * settings.validation.position_tolerance_percent / 100
+                actual_ratio_w = sticker_size[0] / img_width
+                actual_ratio_h = sticker_size[1] / img_height
+
                 logger.info(f"#{context.seq_number} "
                             f"scale {scale} "
                             f"total: {'OK' if sticker_matches_design else 'ERROR'} "
@@ -171,7 +261,6 @@ class StickerValidator:
         else:
             logger.info(f"SEQ {context.seq_number} sticker NOT present")
 
-        self.__last_processed_acc_detections.append(context)
         return context
 
     def process_combined_validation(self):
@@ -179,69 +268,154 @@ class StickerValidator:
             return
 
         current_results = [ctx.validation_results for ctx in self.__last_processed_acc_detections
-                           if ctx and ctx.validation_results and ctx.seq_number == self.__last_processed_acc_number]
+                           if ctx and ctx.validation_results and ctx.seq_number == self.last_processed_acc_number]
 
-        if not current_results:
+        result = combine_validation_results(self.last_processed_acc_number, current_results)
+        if result is None:
             return
 
-        present_values = [r.sticker_present for r in current_results]
-        sticker_present = Counter(present_values).most_common(1)[0][0] if present_values else False
+        combined_validation_results.put(result)
+        self.__last_processed_acc_detections = []
 
-        for i, test in enumerate(current_results):
-            assert test.seq_number == self.__last_processed_acc_number, 'Wrong seq_number in combined validation!'
-            # logger.info(f'{test.seq_number}')
-            # cv2.imwrite(f'data/{test.seq_number}_{i}.jpg', test.sticker_image)
 
-        sticker_matches_design = None
-        median_position = None
-        median_size = None
-        median_rotation = None
-        best_image = None
+def combine_validation_results(seq_number: int, current_results: list[StickerValidationResult]) -> StickerValidationResult | None:
+    """Combine validation results of all frames of one accumulator by majority vote and medians"""
+    if not current_results:
+        return None
 
-        if sticker_present:
-            positions = [r.sticker_position for r in current_results if r.sticker_position is not None]
-            sizes = [r.sticker_size for r in current_results if r.sticker_size is not None]
-            rotations = [r.sticker_rotation for r in current_results if r.sticker_rotation is not None]
+    present_values = [r.sticker_present for r in current_results]
+    sticker_present = Counter(present_values).most_common(1)[0][0] if present_values else False
 
-            if positions:
-                median_position = tuple(median([pos[i] for pos in positions]) for i in range(2))
+    for i, test in enumerate(current_results):
+        assert test.seq_number == seq_number, 'Wrong seq_number in combined validation!'
+        # logger.info(f'{test.seq_number}')
+        # cv2.imwrite(f'data/{test.seq_number}_{i}.jpg', test.sticker_image)
 
-            if sizes:
-                median_size = tuple(median([size[i] for size in sizes]) for i in range(2))
+    sticker_matches_design = None
+    median_position = None
+    median_size = None
+    median_rotation = None
+    best_image = None
 
-            if rotations:
-                median_rotation = median(rotations)
+    if sticker_present:
+        positions = [r.sticker_position for r in current_results if r.sticker_position is not None]
+        sizes = [r.sticker_size for r in current_results if r.sticker_size is not None]
+        rotations = [r.sticker_rotation for r in current_results if r.sticker_rotation is not None]
 
-            matches = [r.sticker_matches_design for r in current_results if r.sticker_matches_design is not None]
-            if matches:
-                sticker_matches_design = Counter(matches).most_common(1)[0][0]
+        if positions:
+            median_position = tuple(median([pos[i] for pos in positions]) for i in range(2))
 
-            if median_position and median_rotation:
-                def distance_to_median(result):
-                    if not result.sticker_position or result.sticker_rotation is None:
-                        return float('inf')
+        if sizes:
+            median_size = tuple(median([size[i] for size in sizes]) for i in range(2))
 
-                    pos_distance = sum((result.sticker_position[i] - median_position[i]) ** 2 for i in range(2)) ** 0.5
-                    rot_distance = abs(result.sticker_rotation - median_rotation)
-                    return pos_distance + rot_distance * 5  # Weight rotation differences
+        if rotations:
+            median_rotation = median(rotations)
 
-                best_result = min(current_results, key=distance_to_median)
-                best_image = best_result.sticker_image
-            else:
-                best_image = current_results[0].sticker_image
-        else:
-            best_image = current_results[0].sticker_image
+        matches = [r.sticker_matches_design for r in current_results if r.sticker_matches_design is not None]
+        if matches:
+            sticker_matches_design = Counter(matches).most_common(1)[0][0]
 
-        result = StickerValidationResult(
-            sticker_present=sticker_present,
-            sticker_matches_design=sticker_matches_design,
-            sticker_image=best_image,
-            sticker_position=median_position,
-            sticker_size=median_size,
-            sticker_rotation=median_rotation,
-            seq_number=self.__last_processed_acc_number,
-            detected_at=current_results[0].detected_at
-        )
+        if median_position and median_rotation:
+            def distance_to_median(result):
+                if not result.sticker_position or result.sticker_rotation is None:
+                    return float('inf')
 
-        combined_validation_results.put(result)
-        self.__last_processed_acc_detections = []
\ No newline at end of file
+                pos_distance = sum((result.sticker_position[i] - median_position[i]) ** 2 for i in range(2)) ** 0.5
+                rot_distance = abs(result.sticker_rotation - median_rotation)
+                return pos_distance + rot_distance * 5  # Weight rotation differences
+
+            best_result = min(current_results, key=distance_to_median)
+            best_image = best_result.sticker_image
+        else:
+            best_image = current_results[0].sticker_image
+    else:
+        best_image = current_results[0].sticker_image
+
+    return StickerValidationResult(
+        sticker_present=sticker_present,
+        sticker_matches_design=sticker_matches_design,
+        sticker_image=best_image,
+        sticker_position=median_position,
+        sticker_size=median_size,
+        sticker_rotation=median_rotation,
+        seq_number=seq_number,
+        detected_at=current_results[0].detected_at
+    )
+
+
+class ValidationAggregator:
+    """
+    Combines per-frame results of several validator workers into one result per accumulator.
+    Workers number frames in the order they take them from the queue and finish them in any order,
+    so results are buffered and released by frame index; the accumulator is combined when seq_number changes,
+    same as StickerValidator.validate does for a single worker.
+    """
+
+    def __init__(self, frame_timeout: float = 5.0):
+        self.frame_timeout = frame_timeout
+        self.next_frame_index = 0
+        self.skipped_frames = 0
+        self.late_frames = 0
+        self.__pending: dict[int, StickerValidationResult | None] = {}
+        self.__waiting_since: float | None = None
+        self.last_processed_acc_number: int = 1
+        self.__last_processed_acc_results: list[StickerValidationResult] = []
+
+    def add(self, frame_index: int, result: StickerValidationResult | None) -> list[StickerValidationResult]:
+        """
+        Add result of a frame, None if the worker failed to validate it.
+        Returns combined results of accumulators completed by this frame.
+        """
+        if frame_index < self.next_frame_index:
+            if (result is not None and self.__last_processed_acc_results
+                    and result.seq_number == self.last_processed_acc_number):
+                # its accumulator is not combined yet, the frame still counts
+                self.__last_processed_acc_results.append(result)
+                return []
+            self.late_frames += 1
+            logger.warning(f"Frame {frame_index} arrived after it was skipped and its accumulator was combined, "
+                           f"dropping it ({self.late_frames} late frames so far)")
+            return []
+
+        self.__pending[frame_index] = result
+        return self.__release()
+
+    def expire(self) -> list[StickerValidationResult]:
+        """Skip the missing frame if later frames have been waiting for it longer than frame_timeout"""
+        if not self.__pending or self.__waiting_since is None:
+            return []
+        if time.monotonic() - self.__waiting_since < self.frame_timeout:
+            return []
+
+        skip_to = min(self.__pending)
+        logger.warning(f"Frames {self.next_frame_index}..{skip_to - 1} were not validated in "
+                       f"{self.frame_timeout}s, skipping them")
+        self.skipped_frames += skip_to - self.next_frame_index
+        self.next_frame_index = skip_to
+        return self.__release()
+
+    def flush(self) -> list[StickerValidationResult]:
+        """Combine current accumulator, called when no frames are left in flight"""
+        result = combine_validation_results(self.last_processed_acc_number, self.__last_processed_acc_results)
+        self.__last_processed_acc_results = []
+        return [result] if result is not None else []
+
+    def __release(self) -> list[StickerValidationResult]:
+        combined = []
+        first_frame_index = self.next_frame_index
+        while self.next_frame_index in self.__pending:
+            result = self.__pending.pop(self.next_frame_index)
+            self.next_frame_index += 1
+            if result is None:
+                continue
+
+            if self.last_processed_acc_number != result.seq_number:
+                combined += self.flush()
+                self.last_processed_acc_number = result.seq_number
+            self.__last_processed_acc_results.append(result)
+
+        if not self.__pending:
+            self.__waiting_since = None
+        elif self.__waiting_since is None or self.next_frame_index != first_frame_index:
+            self.__waiting_since = time.monotonic()
+        return combined
@@ -2,14 +2,15 @@ import asyncio
 import datetime
 import logging
 import queue
+import threading
 import time
 from contextlib import asynccontextmanager
-from multiprocessing import Queue, Pipe
-from fastapi import Query, APIRouter
+from multiprocessing import Queue, Pipe, Value
+from fastapi import Query, APIRouter, HTTPException
 from typing import Optional
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from starlette.middleware.cors import CORSMiddleware
 
 from Camera.CameraInterface import CameraInterface
@@ -19,20 +20,27 @@ from algorithms.ShapeDetector import ShapeDetector
 from algorithms.ShapeProcessor import ShapeProcessor
 from algorithms.StickerValidator import StickerValidator
 from backend.context_manager import ContextManager
-from backend.db import paginate_validation_logs, delete_validation_log_by_id, delete_all_validation_logs
+from backend.db import paginate_validation_logs, delete_validation_log_by_id, delete_all_validation_logs, \
+    get_validation_log_image
 from model.model import StickerValidationParams, StreamingMessage, StreamingMessageType, IPCMessageType, IPCMessage
-from processes import ShapeDetectorProcess, ShapeProcessorProcess, StickerValidatorProcess, ValidationResultsLogger
-from settings import get_settings, Settings, save_settings
+from processes import ShapeDetectorProcess, ShapeProcessorProcess, StickerValidatorProcess, ValidationResultsLogger, \
+    ValidationAggregatorProcess, validator_process_name
+from backend.settings import get_settings, Settings, save_settings, settings_requiring_restart
 from utils.bg_capture import save_and_set_empty_conveyor_background
+from utils.bounded_queue import BoundedQueue
+from utils.frame_ring import FrameRing
 from utils.param_persistence import save_sticker_parameters
-from websocket_manager import WebSocketManager
+from utils.stream_demand import StreamDemand
+from websocket_manager import WebSocketManager, JSON_PROTOCOL, PROTOCOLS
 
 
 # todo start/stop processes in production (with IP camera) here
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup
-    # ...
+    from backend.db import ensure_stats_rollups
+    if ensure_stats_rollups():
+        logger.info("Statistics rollups rebuilt from existing validation logs")
 
     yield
 
@@ -59,7 +67,8 @@ logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
-manager = WebSocketManager()
+stream_demand = StreamDemand()
+manager = WebSocketManager(stream_demand, settings.queues.client_deadline_seconds)
 context_manager = ContextManager()
 
 camera: CameraInterface
@@ -69,22 +78,23 @@ processor = ShapeProcessor()
 validator = StickerValidator()
 
 exit_queue: Queue
-shape_queue: Queue
-processed_shape_queue: Queue
-results_queue: Queue
-websocket_queue: Queue
+shape_queue: BoundedQueue
+processed_shape_queue: BoundedQueue
+results_queue: BoundedQueue
+websocket_queue: BoundedQueue
+validated_queue: BoundedQueue
 ipc_queue: Queue
+frame_ring: FrameRing | None = None
 
 detector_parent_pipe = None
 detector_child_pipe = None
 processor_parent_pipe = None
 processor_child_pipe = None
-validator_parent_pipe = None
-validator_child_pipe = None
 
 shape_detector_process: ShapeDetectorProcess
 shape_processor_process: ShapeProcessorProcess
-sticker_validator_process: StickerValidatorProcess
+sticker_validator_processes: list[StickerValidatorProcess]
+validation_aggregator_process: ValidationAggregatorProcess
 validation_logger_process: ValidationResultsLogger
 processes: list
 queues: list
@@ -93,46 +103,106 @@ def is_system_running() -> bool:
     """Check if any system process is currently running"""
     return any(process.is_alive() for process in processes)
 
-def init_processes():
-    global shape_detector_process, shape_processor_process, sticker_validator_process, validation_logger_process, processes
+def create_frame_ring() -> FrameRing | None:
+    """Replace the shared memory frame ring with a new one sized for current settings"""
+    global frame_ring
+    release_frame_ring()
+
+    if settings.processing.frame_ring_slots > 0:
+        frame_ring = FrameRing(settings.processing.downscale_width, settings.processing.downscale_height,
+                               settings.processing.frame_ring_slots)
+    return frame_ring
+
+
+def release_frame_ring():
+    global frame_ring
+    if frame_ring is not None:
+        frame_ring.close()
+        frame_ring = None
+
+
+def create_pipeline_queues() -> tuple[BoundedQueue, BoundedQueue, BoundedQueue, BoundedQueue]:
+    """Create queues between pipeline stages with size limits and overflow policies from settings"""
+    queue_settings = settings.queues
+    return (
+        BoundedQueue("shape_queue", queue_settings.shape_queue_size, queue_settings.shape_queue_policy),
+        BoundedQueue("processed_shape_queue", queue_settings.processed_shape_queue_size,
+                     queue_settings.processed_shape_queue_policy),
+        BoundedQueue("results_queue", queue_settings.results_queue_size, queue_settings.results_queue_policy),
+        BoundedQueue("websocket_queue", queue_settings.websocket_queue_size, queue_settings.websocket_queue_policy),
+    )
+
+
+def get_queue_stats() -> list[dict]:
+    return [q.stats() for q in [shape_queue, processed_shape_queue, validated_queue, results_queue, websocket_queue]]
+
+
+def create_validation_processes() -> tuple[list[StickerValidatorProcess], ValidationAggregatorProcess]:
+    """
+    Create validator workers sharing processed_shape_queue and the aggregator combining their results.
+    Every worker gets its own pipe registered under its process name.
+    """
+    global validated_queue
+    # never dropped: the aggregator waits for every frame index handed out by the workers
+    validated_queue = BoundedQueue("validated_queue")
+    frame_counter = Value('q', 0)
+
+    for process in globals().get('sticker_validator_processes', []):
+        context_manager.unregister_process(process.process_name)
+
+    workers = []
+    for worker_index in range(max(settings.processing.validator_workers, 1)):
+        parent_pipe, child_pipe = Pipe()
+        workers.append(StickerValidatorProcess(processed_shape_queue, validated_queue, validator, child_pipe,
+                                               frame_counter, worker_index))
+        context_manager.register_process(validator_process_name(worker_index), parent_pipe)
+
+    parent_pipe, child_pipe = Pipe()
+    aggregator = ValidationAggregatorProcess(validated_queue, results_queue, websocket_queue, frame_counter,
+                                             child_pipe, settings.processing.validation_frame_timeout, stream_demand)
+    context_manager.register_process(aggregator.process_name, parent_pipe)
+    return workers, aggregator
+
+
+def init_processes(ring: FrameRing | None = None):
+    global shape_detector_process, shape_processor_process, sticker_validator_processes, validation_aggregator_process
+    global validation_logger_process, processes
     global exit_queue, shape_queue, processed_shape_queue, websocket_queue, results_queue, queues
-    global detector_parent_pipe, detector_child_pipe, processor_parent_pipe, processor_child_pipe, validator_parent_pipe, validator_child_pipe
+    global detector_parent_pipe, detector_child_pipe, processor_parent_pipe, processor_child_pipe
     exit_queue = Queue()
-    shape_queue = Queue()
-    processed_shape_queue = Queue()
-    results_queue = Queue()
-    websocket_queue = Queue()
+    shape_queue, processed_shape_queue, results_queue, websocket_queue = create_pipeline_queues()
 
     detector_parent_pipe, detector_child_pipe = Pipe()
     processor_parent_pipe, processor_child_pipe = Pipe()
-    validator_parent_pipe, validator_child_pipe = Pipe()
 
-    shape_detector_process = ShapeDetectorProcess(exit_queue, shape_queue, websocket_queue, settings.camera_type, detector, settings, detector_child_pipe)
-    shape_processor_process = ShapeProcessorProcess(shape_queue, processed_shape_queue, websocket_queue, processor, processor_child_pipe)
-    sticker_validator_process = StickerValidatorProcess(processed_shape_queue, results_queue, websocket_queue, validator, validator_child_pipe)
-    validation_logger_process = ValidationResultsLogger(results_queue)
+    shape_detector_process = ShapeDetectorProcess(exit_queue, shape_queue, websocket_queue, settings.camera_type, detector, settings, detector_child_pipe, ring, stream_demand)
+    shape_processor_process = ShapeProcessorProcess(shape_queue, processed_shape_queue, websocket_queue, processor, processor_child_pipe, ring, stream_demand)
+    sticker_validator_processes, validation_aggregator_process = create_validation_processes()
+    validation_logger_process = ValidationResultsLogger(results_queue, settings.database.log_batch_size,
+                                                        settings.database.log_flush_interval)
 
     context_manager.register_process("detector", detector_parent_pipe)
     context_manager.register_process("processor", processor_parent_pipe)
-    context_manager.register_process("validator", validator_parent_pipe)
 
-    processes = [shape_detector_process, shape_processor_process, sticker_validator_process, validation_logger_process]
-    queues = [exit_queue, shape_queue, processed_shape_queue, results_queue, websocket_queue]
+    processes = [shape_detector_process, shape_processor_process, *sticker_validator_processes,
+                 validation_aggregator_process, validation_logger_process]
+    queues = [exit_queue, shape_queue, processed_shape_queue, validated_queue, results_queue, websocket_queue]
 
 
 def restart_processes(background_tasks: BackgroundTasks):
     """Stop all processes and restart them with new settings while preserving queue content"""
-    global settings, camera, detector, processor, validator, processes
+    global settings, camera, detector, processor, validator, processes, queues
     global shape_queue, processed_shape_queue, results_queue, websocket_queue, exit_queue
-    global shape_detector_process, shape_processor_process, sticker_validator_process, validation_logger_process
-    global detector_parent_pipe, detector_child_pipe, processor_parent_pipe, processor_child_pipe, validator_parent_pipe, validator_child_pipe
+    global shape_detector_process, shape_processor_process, sticker_validator_processes, validation_aggregator_process
+    global validation_logger_process
+    global detector_parent_pipe, detector_child_pipe, processor_parent_pipe, processor_child_pipe
     start_time = time.time()
     logger.info("Starting complete system restart - saving queue content and terminating all processes")
 
     context_manager.save_contexts(
         shape_detector_process if 'shape_detector_process' in globals() else None,
         shape_processor_process if 'shape_processor_process' in globals() else None,
-        sticker_validator_process if 'sticker_validator_process' in globals() else None,
+        sticker_validator_processes[0] if 'sticker_validator_processes' in globals() else None,
     )
 
     saved_queue_content = {
@@ -150,7 +220,11 @@ def restart_processes(background_tasks: BackgroundTasks):
     ]:
         while not q.empty():
             try:
-                saved_queue_content[name].append(q.get_nowait())
+                item = q.get_nowait()
+                # frames referencing the old frame ring are copied out before it is released
+                if name == 'shape_queue' and frame_ring is not None and item is not None and not frame_ring.materialize(item):
+                    continue
+                saved_queue_content[name].append(item)
             except:
                 pass
         logger.info(f"Saved {len(saved_queue_content[name])} items from {name}")
@@ -167,33 +241,42 @@ def restart_processes(background_tasks: BackgroundTasks):
             logger.info(f"Process {process.name} was not running")
 
     settings = get_settings()
+    manager.client_deadline_seconds = settings.queues.client_deadline_seconds
     logger.info("Settings reloaded, recreating all components")
 
+    ring = create_frame_ring()
+
     detector = ShapeDetector()
     processor = ShapeProcessor()
     validator = StickerValidator()
     logger.info("Created new components")
 
     exit_queue = Queue()
-    shape_queue = Queue()
-    processed_shape_queue = Queue()
-    results_queue = Queue()
-    websocket_queue = Queue()
+    shape_queue, processed_shape_queue, results_queue, websocket_queue = create_pipeline_queues()
 
-    shape_detector_process = ShapeDetectorProcess(exit_queue, shape_queue, websocket_queue, settings.camera_type, detector, settings, detector_child_pipe)
-    shape_processor_process = ShapeProcessorProcess(shape_queue, processed_shape_queue, websocket_queue, processor, processor_child_pipe)
-    sticker_validator_process = StickerValidatorProcess(processed_shape_queue, results_queue, websocket_queue, validator, validator_child_pipe)
-    validation_logger_process = ValidationResultsLogger(results_queue)
+    shape_detector_process = ShapeDetectorProcess(exit_queue, shape_queue, websocket_queue, settings.camera_type, detector, settings, detector_child_pipe, ring, stream_demand)
+    shape_processor_process = ShapeProcessorProcess(shape_queue, processed_shape_queue, websocket_queue, processor, processor_child_pipe, ring, stream_demand)
+    sticker_validator_processes, validation_aggregator_process = create_validation_processes()
+    validation_logger_process = ValidationResultsLogger(results_queue, settings.database.log_batch_size,
+                                                        settings.database.log_flush_interval)
 
     context_manager.register_process("detector", detector_parent_pipe)
     context_manager.register_process("processor", processor_parent_pipe)
-    context_manager.register_process("validator", validator_parent_pipe)
 
     logger.info("Created new process instances")
 
-    processes = [shape_detector_process, shape_processor_process, sticker_validator_process, validation_logger_process]
+    processes = [shape_detector_process, shape_processor_process, *sticker_validator_processes,
+                 validation_aggregator_process, validation_logger_process]
+    queues = [exit_queue, shape_queue, processed_shape_queue, validated_queue, results_queue, websocket_queue]
 
-    context_manager.restore_contexts(shape_detector_process, shape_processor_process, sticker_validator_process)
+    context_manager.restore_contexts(shape_detector_process, shape_processor_process, sticker_validator_processes[0])
+    validator_context = context_manager.get_saved_context("validator")
+    if validator_context:
+        for process in sticker_validator_processes[1:]:
+            process.restore_context(validator_context)
+    aggregator_context = context_manager.get_saved_context(validation_aggregator_process.process_name)
+    if aggregator_context:
+        validation_aggregator_process.restore_context(aggregator_context)
 
     logger.info("Restored process contexts")
     
@@ -218,25 +301,98 @@ def restart_processes(background_tasks: BackgroundTasks):
 
     return {"status": "success", "message": "All processes restarted with updated settings and preserved queue data"}
 
+def apply_settings_in_place(new_settings: Settings) -> bool:
+    """
+    Apply settings to components and running processes without restarting them.
+    Callers check settings_requiring_restart first. Returns False if a running process did not confirm.
+    """
+    global settings
+    settings = new_settings
+    manager.client_deadline_seconds = settings.queues.client_deadline_seconds
+    # used for processes created by the next start
+    detector.apply_settings(settings)
+    processor.apply_settings(settings)
+
+    if not is_system_running():
+        return True
+
+    failed = context_manager.apply_settings(settings.to_dict())
+    if failed:
+        logger.warning(f"Settings were not applied by {failed}")
+        return False
+    return True
+
+
+def apply_new_settings(new_settings: Settings, background_tasks: BackgroundTasks) -> bool:
+    """Apply saved settings in place when possible, otherwise restart processes. Returns True on restart"""
+    if not is_system_running():
+        apply_settings_in_place(new_settings)
+        return False
+
+    restart_required = settings_requiring_restart(settings, new_settings)
+    if not restart_required and apply_settings_in_place(new_settings):
+        logger.info("Settings applied to running processes")
+        return False
+
+    logger.info(f"Restarting processes to apply {restart_required or 'settings'}")
+    restart_processes(background_tasks)
+    return True
+
 init_processes()
 
 
+def read_websocket_queue(loop: asyncio.AbstractEventLoop, messages: asyncio.Queue):
+    """
+    Block on websocket_queue in a thread and hand messages over to the event loop,
+    which then only wakes up when there is something to send.
+    Every message waits until the loop takes it, so the overflow policy of websocket_queue still applies.
+    """
+    while True:
+        try:
+            # global is looked up on every call, restart replaces the queue
+            msg: StreamingMessage = websocket_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+
+        try:
+            asyncio.run_coroutine_threadsafe(messages.put(msg), loop).result()
+        except RuntimeError:
+            # event loop is closed
+            return
+
+        if msg is None:
+            return
+
+
+def log_queue_drops(last_dropped: dict):
+    for stats in get_queue_stats():
+        dropped = stats["Dropped"] - last_dropped.get(stats["Name"], 0)
+        last_dropped[stats["Name"]] = stats["Dropped"]
+        if dropped > 0:
+            logger.warning(f'{stats["Name"]} dropped {dropped} items ({stats["Policy"]}), '
+                           f'size {stats["Size"]}/{stats["MaxSize"]}, high-water mark {stats["HighWaterMark"]}')
+
+
 async def stream_images_async():
     logger.info(f"stream_images starting")
     last_time = datetime.datetime.now()
+    last_dropped = {}
 
-    from utils.env import OS_TYPE
+    messages = asyncio.Queue(maxsize=1)
+    reader = threading.Thread(target=read_websocket_queue, args=(asyncio.get_running_loop(), messages),
+                              name="websocket_queue_reader", daemon=True)
+    reader.start()
 
     while True:
         try:
-            msg: StreamingMessage = websocket_queue.get_nowait()
+            msg: StreamingMessage = await asyncio.wait_for(messages.get(), timeout=5)
 
             if msg is None:
                 raise InterruptedError
 
             await manager.broadcast_message(msg)
 
-        except queue.Empty:
+        except asyncio.TimeoutError:
             pass
         except (KeyboardInterrupt, InterruptedError):
             logger.info(f"stream_images exiting")
@@ -247,14 +403,11 @@ async def stream_images_async():
         current_time = datetime.datetime.now()
         if current_time - last_time > datetime.timedelta(seconds=5):
             last_time = current_time
-            #logger.info(f'shape: {shape_queue.qsize()}, processed_shape: {processed_shape_queue.qsize()}, results: {results_queue.qsize()}, ws: {websocket_queue.qsize()}')
-
-        if OS_TYPE == "MACOS":
-            await asyncio.sleep(0.016)
+            log_queue_drops(last_dropped)
 
 
 def start_processes(background_tasks: BackgroundTasks):
-    init_processes()
+    init_processes(create_frame_ring())
 
     for process in processes:
         if not process.is_alive():
@@ -299,15 +452,30 @@ def stop_processes():
         except Exception as e:
             logger.error(f"Error closing pipe for {name}: {str(e)}")
 
+    release_frame_ring()
+
     logger.info("All processes stopped and pipes closed")
 
 
 @app.websocket("/ws")
-async def websocket_connect(websocket: WebSocket):
+async def websocket_connect(websocket: WebSocket, protocol: str = JSON_PROTOCOL):
+    """
+    Stream of pipeline images and validation results.
+    protocol=json (default) sends {"type", "content"} JSON with base64 images,
+    protocol=binary sends a 13-byte header (type uint8, seq uint32, timestamp ms int64, little-endian)
+    followed by raw JPEG, or by UTF-8 JSON content for validation results.
+    Clients get all streams until they send a subscription:
+    {"Subscriptions": [{"Type": 4}, {"Type": 1, "MaxFps": 5, "MaxWidth": 640}]}
+    """
+    if protocol not in PROTOCOLS:
+        await websocket.close(code=1008, reason=f"Unknown protocol: {protocol}")
+        return
+
     try:
-        await manager.connect(websocket)
+        await manager.connect(websocket, protocol)
         while True:
-            await websocket.receive_text()  # Keep connection alive
+            # subscription changes, anything else only keeps connection alive
+            manager.handle_client_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect as e:
         manager.disconnect(websocket)
         if e.code != 1000:
@@ -330,6 +498,30 @@ async def restart_stream(background_tasks: BackgroundTasks):
     return restart_processes(background_tasks)
 
 
+@app.get("/stream/queues")
+async def get_stream_queues():
+    """Get size, dropped items and high-water mark of every pipeline queue"""
+    return get_queue_stats()
+
+
+@app.get("/stream/detector")
+async def get_stream_detector():
+    """Frames read by the detector and frames skipped because nothing was on the detection line"""
+    frames = shape_detector_process.frames_read.value
+    skipped = shape_detector_process.frames_skipped.value
+    return {
+        "Frames": frames,
+        "SkippedFrames": skipped,
+        "SkippedRatio": round(skipped / frames, 3) if frames else 0.0
+    }
+
+
+@app.get("/stream/clients")
+async def get_stream_clients():
+    """Get subscriptions, lag and dropped messages of every websocket client"""
+    return manager.get_client_stats()
+
+
 @app.get("/sticker/parameters")
 async def get_sticker_parameters():
     """Get sticker validator parameters using pipe communication"""
@@ -337,7 +529,7 @@ async def get_sticker_parameters():
         params_dict = context_manager.get_parameters("validator")
     else:
         logger.warning("Falling back to direct method call for getting parameters")
-        params = sticker_validator_process.get_validator_parameters()
+        params = sticker_validator_processes[0].get_validator_parameters()
         return params.to_dict()
     return params_dict
 
@@ -349,11 +541,13 @@ async def set_sticker_parameters(params_dict: dict):
 
     save_sticker_parameters(sticker_params)
     if is_system_running():
-        if context_manager.set_parameters("validator", params_dict):
+        if all([context_manager.set_parameters(process.process_name, params_dict)
+                for process in sticker_validator_processes]):
             return {"status": "success", "message": "Sticker parameters updated via IPC"}
     else:
         logger.warning("Falling back to direct method call for setting parameters")
-        sticker_validator_process.set_validator_parameters(sticker_params)
+        for process in sticker_validator_processes:
+            process.set_validator_parameters(sticker_params)
         return {"status": "success", "message": "Sticker parameters updated directly"}
 
 
@@ -363,9 +557,28 @@ def get_validation_logs(
         end_date: Optional[datetime.datetime] = None,
         page: int = Query(1, ge=1),
         page_size: int = Query(100, ge=1, le=1000),
+        include_images: bool = False,
+        cursor: Optional[str] = None,
+        total: str = Query("exact", pattern="^(exact|approximate|none)$"),
 ):
-    """Get validation logs with date filtering and pagination"""
-    return paginate_validation_logs(start_date, end_date, page, page_size)
+    """
+    Get validation logs with date filtering and pagination, images are included only on request.
+    Pass NextCursor of the previous response as cursor to page without OFFSET, page is ignored then.
+    """
+    try:
+        return paginate_validation_logs(start_date, end_date, page, page_size, include_images, cursor, total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/validation/logs/{log_id}/image")
+def get_validation_log_image_endpoint(log_id: int):
+    """Get PNG image of a rejected accumulator"""
+    image = get_validation_log_image(log_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail=f"Image of log {log_id} not found")
+    return Response(content=image, media_type="image/png",
+                    headers={"Cache-Control": "max-age=31536000, immutable"})
 
 
 @app.delete("/validation/logs/{log_id}")
@@ -390,28 +603,42 @@ def get_app_settings():
 @app.get("/validation/stats")
 def get_validation_statistics(
     start_date: Optional[datetime.datetime] = None,
-    end_date: Optional[datetime.datetime] = None
+    end_date: Optional[datetime.datetime] = None,
+    bucket: Optional[str] = Query(None, pattern="^(minute|hour|shift|day)$"),
 ):
-    """Get validation statistics for a given time period"""
+    """Get validation statistics for a given time period, optionally as a time series of buckets"""
     from backend.db import get_validation_stats
-    return get_validation_stats(start_date, end_date)
+    try:
+        return get_validation_stats(start_date, end_date, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/validation/stats/rebuild")
+def rebuild_validation_statistics():
+    """Recompute statistics rollups from all validation logs"""
+    from backend.db import rebuild_validation_stats_rollups
+    return rebuild_validation_stats_rollups()
 
 @router.post("/apply")
 def apply_settings(settings_data: dict, background_tasks: BackgroundTasks):
-    """Update settings and restart processes to apply them"""
+    """Update settings, running processes apply them in place unless a changed setting needs a restart"""
     try:
         logger.info(f"new settings: {settings_data}")
         new_settings = Settings.from_dict(settings_data)
         logger.info(f"settings updated: {new_settings}")
         save_settings(new_settings)
 
-        if is_system_running():
-            result = restart_processes(background_tasks)
-            logger.info(f"Settings applied and processes restarted")
-            return {"success": True, "message": "Settings applied and processes restarted"}
-        else:
+        if not is_system_running():
+            apply_new_settings(new_settings, background_tasks)
             logger.info(f"Settings applied (system not running, no restart needed)")
             return {"success": True, "message": "Settings applied (system not running, no restart needed)"}
+
+        if not apply_new_settings(new_settings, background_tasks):
+            return {"success": True, "message": "Settings applied without restart"}
+
+        logger.info(f"Settings applied and processes restarted")
+        return {"success": True, "message": "Settings applied and processes restarted"}
     except Exception as e:
         logger.error(f"Failed to apply settings: {str(e)}", exc_info=True)
         return {"success": False, "message": f"Failed to apply settings: {str(e)}"}
@@ -435,7 +662,7 @@ def set_empty_conveyor_background(
         result = save_and_set_empty_conveyor_background(image_base64)
 
         if result["success"]:
-            restart_processes(background_tasks)
+            apply_new_settings(get_settings(), background_tasks)
 
         return result
     except Exception as e:
@@ -731,9 +958,28 @@ def get_example_html():
         const TYPE_PROCESSED = 3;
         const TYPE_VALIDATION = 4;
 
+        // Binary protocol header: type uint8, seq uint32, timestamp ms int64, little-endian
+        const HEADER_SIZE = 13;
+        const streamElements = {
+            [TYPE_RAW]: 'rawStream',
+            [TYPE_SHAPE]: 'shapeStream',
+            [TYPE_PROCESSED]: 'processedStream'
+        };
+        const textDecoder = new TextDecoder();
+
+        function showFrame(type, payload) {
+            const element = document.getElementById(streamElements[type]);
+            const previousUrl = element.src;
+            element.src = URL.createObjectURL(new Blob([payload], { type: 'image/jpeg' }));
+            if (previousUrl.startsWith('blob:')) {
+                URL.revokeObjectURL(previousUrl);
+            }
+        }
+
         // Connect to WebSocket
         function connectWebSocket() {
-            ws = new WebSocket(`ws://${host}/ws`);
+            ws = new WebSocket(`ws://${host}/ws?protocol=binary`);
+            ws.binaryType = 'arraybuffer';
 
             ws.onopen = () => {
                 console.log('WebSocket connected');
@@ -753,17 +999,15 @@ def get_example_html():
             };
 
             ws.onmessage = function(event) {
-            const data = JSON.parse(event.data);
+            const header = new DataView(event.data, 0, HEADER_SIZE);
+            const type = header.getUint8(0);
+            const payload = new Uint8Array(event.data, HEADER_SIZE);
 
             // Process different message types
-            if (data.type === 1) { // RAW
-                document.getElementById('rawStream').src = 'data:image/jpeg;base64,' + JSON.parse(data.content).image;
-            } else if (data.type === 2) { // SHAPE
-                document.getElementById('shapeStream').src = 'data:image/jpeg;base64,' + JSON.parse(data.content).image;
-            } else if (data.type === 3) { // PROCESSED
-                document.getElementById('processedStream').src = 'data:image/jpeg;base64,' + JSON.parse(data.content).image;
-            } else if (data.type === 4) { // VALIDATION
-                const validationData = JSON.parse(data.content).ValidationResult;
+            if (type in streamElements) { // RAW, SHAPE, PROCESSED
+                showFrame(type, payload);
+            } else if (type === TYPE_VALIDATION) {
+                const validationData = JSON.parse(textDecoder.decode(payload)).ValidationResult;
                 updateLatestValidation(validationData);
                 addEvent(`Validation received: Seq#${validationData.SeqNumber}, Present: ${validationData.StickerPresent}, Matches: ${validationData.StickerMatchesDesign}`);
             }
@@ -17,6 +17,11 @@ class ContextManager:
         self.__processes[name] = pipe_connection
         logger.info(f"Process '{name}' registered with ContextManager")
 
+    def unregister_process(self, name: str):
+        """Forget a process that is not going to be started again"""
+        if self.__processes.pop(name, None) is not None:
+            logger.info(f"Process '{name}' unregistered from ContextManager")
+
     def save_contexts(self, shape_detector_process=None, shape_processor_process=None, sticker_validator_process=None):
         """Save contexts from all registered processes"""
         start_time = time.time()
@@ -148,4 +153,39 @@ class ContextManager:
         except Exception as e:
             logger.error(f"Error setting parameters for {process_name}: {str(e)}", exc_info=True)
 
-        return False
\ No newline at end of file
+        return False
+
+    def apply_settings(self, settings_data: dict, timeout: float = 5) -> list[str]:
+        """
+        Send settings to all registered processes and wait until each confirms them.
+        Messages are sent first, so processes apply settings concurrently.
+        Returns names of processes that did not confirm.
+        """
+        pending = {}
+        for name, pipe in self.__processes.items():
+            try:
+                pipe.send(IPCMessage(IPCMessageType.SETTINGS, name, settings_data))
+                pending[name] = pipe
+            except Exception as e:
+                logger.error(f"Error sending settings to {name}: {str(e)}", exc_info=True)
+
+        failed = [name for name in self.__processes if name not in pending]
+        wait_start = time.time()
+        for name, pipe in pending.items():
+            try:
+                while not pipe.poll() and time.time() - wait_start < timeout:
+                    time.sleep(0.05)
+
+                if pipe.poll():
+                    response = pipe.recv()
+                    if response.message_type == IPCMessageType.SETTINGS:
+                        logger.info(f"Settings applied by {name}")
+                        continue
+                    logger.warning(f"Unexpected response type from {name}: {response.message_type}")
+                else:
+                    logger.warning(f"Timeout waiting for settings acknowledgment from {name}")
+            except Exception as e:
+                logger.error(f"Error applying settings to {name}: {str(e)}", exc_info=True)
+            failed.append(name)
+
+        return failed
@@ -1,10 +1,14 @@
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text, func, case, cast, and_, insert, select, Integer, String
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+import base64
 import os
 from pathlib import Path
 
 from backend.settings import get_settings
-from model.model import Base, ValidationLog
+from model.model import Base, ValidationLog, ValidationImage, ValidationStatsMinute, ValidationStatsHour, \
+    STATS_ROLLUPS
 
 
 def get_db_path():
@@ -18,13 +22,130 @@ def get_db_path():
     return db_url
 
 
-def get_db_session():
-    """Create database engine and session"""
-    db_url = get_db_path()
-    engine = create_engine(db_url)
+# engine of the current process, pipeline processes create their own after fork
+_engine = None
+_engine_key = None
+_session_factory = None
+
+
+def configure_sqlite_connection(dbapi_connection, busy_timeout: float):
+    """
+    WAL lets the API read while the logger process writes, and only the writer takes the lock.
+    With WAL, synchronous=NORMAL is still safe against corruption and avoids an fsync per commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")  # 16 MB
+    cursor.close()
+
+
+def init_schema(engine):
+    """Create missing tables and migrate existing ones, done once per engine"""
     Base.metadata.create_all(bind=engine)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    return SessionLocal()
+    migrate_schema(engine)
+
+
+def get_engine():
+    """Engine of this process, created with its schema initialization on first use or when settings change"""
+    global _engine, _engine_key, _session_factory
+
+    db_url = get_db_path()
+    database = get_settings().database
+    key = (os.getpid(), db_url, database.pool_size, database.busy_timeout)
+    if _engine is not None and _engine_key == key:
+        return _engine
+
+    if _engine is not None and _engine_key[0] == os.getpid():
+        _engine.dispose()
+
+    if db_url.startswith('sqlite'):
+        engine = create_engine(db_url, pool_size=database.pool_size, max_overflow=database.pool_size,
+                               connect_args={"check_same_thread": False, "timeout": database.busy_timeout})
+        event.listen(engine, "connect",
+                     lambda dbapi_connection, _: configure_sqlite_connection(dbapi_connection, database.busy_timeout))
+    else:
+        engine = create_engine(db_url, pool_size=database.pool_size, pool_pre_ping=True)
+
+    init_schema(engine)
+    _engine, _engine_key = engine, key
+    _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return engine
+
+
+def get_db_session():
+    """Create session of the process-wide engine"""
+    get_engine()
+    return _session_factory()
+
+
+def migrate_schema(engine):
+    """
+    Add columns and indexes introduced after the table was created,
+    create_all does not alter existing tables
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns(ValidationLog.__tablename__)}
+    if "image_hash" not in columns:
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {ValidationLog.__tablename__} ADD COLUMN image_hash VARCHAR(64)"))
+
+    for index in ValidationLog.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+
+def ensure_stats_rollups() -> bool:
+    """
+    Fill rollup tables that are new to a database with logs, called once at API startup.
+    Returns True if the rollups were rebuilt
+    """
+    db = get_db_session()
+    try:
+        if not stats_rollups_enabled(db) or db.query(ValidationStatsHour.bucket_start).first() is not None \
+                or db.query(ValidationLog.id).first() is None:
+            return False
+        rebuild_stats_rollups(db)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def store_images(db: Session, images: dict[str, bytes]):
+    """Insert images that are not stored yet, keyed by content hash"""
+    if not images:
+        return
+    existing = {image_hash for (image_hash,) in
+                db.query(ValidationImage.hash).filter(ValidationImage.hash.in_(images.keys()))}
+    db.add_all([ValidationImage(hash=image_hash, data=data) for image_hash, data in images.items()
+                if image_hash not in existing])
+
+
+def delete_unreferenced_images(db: Session, hashes: set[str]):
+    referenced = {image_hash for (image_hash,) in
+                  db.query(ValidationLog.image_hash).filter(ValidationLog.image_hash.in_(hashes)).distinct()}
+    orphaned = hashes - referenced
+    if orphaned:
+        db.query(ValidationImage).filter(ValidationImage.hash.in_(orphaned)).delete(synchronize_session=False)
+
+
+def get_validation_log_image(log_id: int) -> bytes | None:
+    """PNG image of a validation log, None if the log does not exist or has no image"""
+    db = get_db_session()
+    try:
+        row = db.query(ValidationLog.image_hash, ValidationLog.acc_image).filter(ValidationLog.id == log_id).first()
+        if row is None:
+            return None
+
+        image_hash, acc_image = row
+        if image_hash is not None:
+            return db.query(ValidationImage.data).filter(ValidationImage.hash == image_hash).scalar()
+        if acc_image is not None:
+            return base64.b64decode(acc_image)
+        return None
+    finally:
+        db.close()
 
 
 def get_db():
@@ -36,11 +157,12 @@ def get_db():
         db.close()
 
 
-def paginate_validation_logs(start_date=None, end_date=None, page=1, page_size=100):
+def paginate_validation_logs(start_date=None, end_date=None, page=1, page_size=100, include_images=False,
+                             cursor=None, total="exact"):
     """Helper function to paginate validation logs with filtering"""
     db = get_db_session()
     try:
-        result = ValidationLog.paginate(db, start_date, end_date, page, page_size)
+        result = ValidationLog.paginate(db, start_date, end_date, page, page_size, include_images, cursor, total)
         return result
     finally:
         db.close()
@@ -52,6 +174,12 @@ def delete_validation_log_by_id(log_id: int):
         log = db.query(ValidationLog).filter(ValidationLog.id == log_id).first()
         if log:
             db.delete(log)
+            if log.timestamp is not None:
+                update_stats_rollups(db, [dict(timestamp=log.timestamp, sticker_present=log.sticker_present,
+                                               sticker_matches_design=log.sticker_matches_design)], sign=-1)
+            if log.image_hash is not None:
+                db.flush()
+                delete_unreferenced_images(db, {log.image_hash})
             db.commit()
             return {"success": True, "message": f"Log with ID {log_id} deleted successfully"}
         return {"success": False, "message": f"Log with ID {log_id} not found"}
@@ -63,34 +191,228 @@ def delete_all_validation_logs():
     db = get_db_session()
     try:
         count = db.query(ValidationLog).delete()
+        db.query(ValidationImage).delete()
+        for rollup in STATS_ROLLUPS:
+            db.query(rollup).delete()
         db.commit()
         return {"success": True, "message": f"{count} logs deleted successfully"}
     finally:
         db.close()
 
 
-def get_validation_stats(start_date=None, end_date=None):
-    """Get validation statistics for a given time period"""
+# SQLite expressions truncating a timestamp to the start of its bucket, shifts are 00-08, 08-16 and 16-24.
+# Results are in the storage format of DateTime columns, so they compare and merge with stored bucket starts
+STATS_BUCKETS = {
+    "minute": lambda ts: func.strftime("%Y-%m-%d %H:%M:00.000000", ts),
+    "hour": lambda ts: func.strftime("%Y-%m-%d %H:00:00.000000", ts),
+    "shift": lambda ts: func.strftime("%Y-%m-%d ", ts, type_=String).concat(
+        func.printf("%02d:00:00.000000", cast(func.strftime("%H", ts), Integer) // 8 * 8)),
+    "day": lambda ts: func.strftime("%Y-%m-%d 00:00:00.000000", ts),
+}
+
+# rollups a bucket can be summed from, a minute bucket can not be taken from hourly counts
+BUCKET_ROLLUPS = {
+    None: STATS_ROLLUPS,
+    "minute": (ValidationStatsMinute,),
+    "hour": STATS_ROLLUPS,
+    "shift": STATS_ROLLUPS,
+    "day": STATS_ROLLUPS,
+}
+
+ROLLUP_BUCKETS = {ValidationStatsMinute: "minute", ValidationStatsHour: "hour"}
+
+
+def validation_counts():
+    """Total, missing sticker and incorrect design counts as aggregate columns of one query"""
+    return (
+        func.count(ValidationLog.id),
+        func.coalesce(func.sum(case((ValidationLog.sticker_present == False, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((and_(ValidationLog.sticker_present == True,
+                                          ValidationLog.sticker_matches_design == False), 1), else_=0)), 0),
+    )
+
+
+def rollup_counts(rollup):
+    return (
+        func.coalesce(func.sum(rollup.total_count), 0),
+        func.coalesce(func.sum(rollup.missing_sticker_count), 0),
+        func.coalesce(func.sum(rollup.incorrect_design_count), 0),
+    )
+
+
+def counts_to_dict(total_count, missing_sticker_count, incorrect_design_count) -> dict:
+    return {
+        "TotalCount": total_count,
+        "MissingStickerCount": missing_sticker_count,
+        "IncorrectDesignCount": incorrect_design_count,
+    }
+
+
+def stats_rollups_enabled(db: Session) -> bool:
+    """
+    Rollups are kept with SQLite upserts and bucketed by SQLite strftime, so only SQLite databases have them.
+    Statistics of other databases are counted from validation_logs.
+    """
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def update_stats_rollups(db: Session, logs: list[dict], sign: int = 1):
+    """
+    Add logs (dicts of ValidationLog columns) to the rollup tables, or subtract them with sign=-1.
+    Runs in the caller's transaction, so rollups are committed together with the logs.
+    """
+    if not stats_rollups_enabled(db):
+        return
+
+    for rollup in STATS_ROLLUPS:
+        counts = {}
+        for log in logs:
+            bucket_counts = counts.setdefault(rollup.bucket_of(log["timestamp"]), [0, 0, 0])
+            bucket_counts[0] += 1
+            if log["sticker_present"] is not None and not log["sticker_present"]:
+                bucket_counts[1] += 1
+            elif log["sticker_present"] and log["sticker_matches_design"] is not None \
+                    and not log["sticker_matches_design"]:
+                bucket_counts[2] += 1
+        if not counts:
+            continue
+
+        statement = sqlite_insert(rollup).values([
+            dict(bucket_start=bucket_start, total_count=sign * total, missing_sticker_count=sign * missing,
+                 incorrect_design_count=sign * incorrect)
+            for bucket_start, (total, missing, incorrect) in counts.items()
+        ])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[rollup.bucket_start],
+            set_={
+                "total_count": rollup.total_count + statement.excluded.total_count,
+                "missing_sticker_count": rollup.missing_sticker_count + statement.excluded.missing_sticker_count,
+                "incorrect_design_count": rollup.incorrect_design_count + statement.excluded.incorrect_design_count,
+            }
+        ))
+
+
+def rebuild_stats_rollups(db: Session):
+    """Recompute rollup tables from validation_logs, e.g. for logs written before rollups existed"""
+    if not stats_rollups_enabled(db):
+        return
+
+    for rollup in STATS_ROLLUPS:
+        db.query(rollup).delete()
+        bucket_start = STATS_BUCKETS[ROLLUP_BUCKETS[rollup]](ValidationLog.timestamp)
+        db.execute(insert(rollup).from_select(
+            ["bucket_start", "total_count", "missing_sticker_count", "incorrect_design_count"],
+            select(bucket_start, *validation_counts())
+            .where(ValidationLog.timestamp.isnot(None))
+            .group_by(bucket_start)
+        ))
+
+
+def rebuild_validation_stats_rollups() -> dict:
+    db = get_db_session()
+    try:
+        if not stats_rollups_enabled(db):
+            return {"success": False, "message": "Statistics rollups are kept only in SQLite databases"}
+        rebuild_stats_rollups(db)
+        db.commit()
+        buckets = {ROLLUP_BUCKETS[rollup]: db.query(func.count(rollup.bucket_start)).scalar()
+                   for rollup in STATS_ROLLUPS}
+        return {"success": True, "message": f"Statistics rebuilt: {buckets}"}
+    finally:
+        db.close()
+
+
+def split_stats_range(start: datetime | None, end: datetime | None, rollups) -> list[tuple]:
+    """
+    Split [start, end) into (source, start, end) parts: whole buckets of the coarsest fitting rollup in the
+    middle, finer rollups and finally validation_logs itself for the unaligned edges. None bounds are open.
+    """
+    parts = []
+    source = ValidationLog
+    for rollup in rollups:
+        inner_start = None if start is None else -(-(start - datetime.min) // rollup.BUCKET_SIZE) \
+            * rollup.BUCKET_SIZE + datetime.min
+        inner_end = None if end is None else rollup.bucket_of(end)
+        if inner_start is not None and inner_end is not None and inner_start >= inner_end:
+            break
+
+        if inner_start != start:
+            parts.append((source, start, inner_start))
+        if inner_end != end:
+            parts.append((source, inner_end, end))
+        source, start, end = rollup, inner_start, inner_end
+
+    parts.append((source, start, end))
+    return parts
+
+
+def query_stats_part(db: Session, source, start, end, bucket=None):
+    if source is ValidationLog:
+        timestamp, counts = ValidationLog.timestamp, validation_counts()
+    else:
+        timestamp, counts = source.bucket_start, rollup_counts(source)
+
+    columns = counts if bucket is None else (STATS_BUCKETS[bucket](timestamp).label("bucket_start"), *counts)
+    query = db.query(*columns)
+    if start is not None:
+        query = query.filter(timestamp >= start)
+    if end is not None:
+        query = query.filter(timestamp < end)
+
+    if bucket is None:
+        return [(None, *query.one())]
+    return [tuple(row) for row in query.group_by("bucket_start")]
+
+
+def storage_time(value: datetime) -> datetime:
+    """Stored timestamps are naive local time (datetime.now), aware values are converted to it first"""
+    if value.tzinfo is not None:
+        value = value.astimezone()
+    return value.replace(tzinfo=None)
+
+
+def get_validation_stats(start_date=None, end_date=None, bucket=None):
+    """
+    Get validation statistics for a given time period.
+    With bucket (one of STATS_BUCKETS) the counts are also returned per bucket, oldest first.
+    Whole minutes and hours of the period are read from rollup tables, only the edges scan validation_logs.
+    Raises ValueError for buckets of databases other than SQLite, the bucket expressions are SQLite functions.
+    """
+    # end_date is inclusive
+    start = storage_time(start_date) if start_date else None
+    end = storage_time(end_date) + timedelta(microseconds=1) if end_date else None
+
     db = get_db_session()
     try:
-        query = db.query(ValidationLog)
-
-        if start_date:
-            query = query.filter(ValidationLog.timestamp >= start_date)
-        if end_date:
-            query = query.filter(ValidationLog.timestamp <= end_date)
-
-        total_count = query.count()
-        missing_sticker_count = query.filter(ValidationLog.sticker_present == False).count()
-        incorrect_design_count = query.filter(ValidationLog.sticker_present == True,
-                                              ValidationLog.sticker_matches_design == False).count()
-
-        return {
-            "TotalCount": total_count,
-            "MissingStickerCount": missing_sticker_count,
-            "IncorrectDesignCount": incorrect_design_count,
+        rollups_enabled = stats_rollups_enabled(db)
+        if bucket and not rollups_enabled:
+            raise ValueError(f"Statistics buckets are available only for SQLite databases, "
+                             f"not {db.get_bind().dialect.name}")
+        counts = [0, 0, 0]
+        buckets = {}
+        for source, part_start, part_end in split_stats_range(start, end, STATS_ROLLUPS if rollups_enabled else ()):
+            for _, *part_counts in query_stats_part(db, source, part_start, part_end):
+                counts = [a + b for a, b in zip(counts, part_counts)]
+
+        stats = {
+            **counts_to_dict(*counts),
             "StartDate": start_date,
             "EndDate": end_date
         }
+
+        if bucket:
+            rollups = BUCKET_ROLLUPS[bucket] if rollups_enabled else ()
+            for source, part_start, part_end in split_stats_range(start, end, rollups):
+                for bucket_start, *part_counts in query_stats_part(db, source, part_start, part_end, bucket):
+                    bucket_counts = buckets.get(bucket_start, [0, 0, 0])
+                    buckets[bucket_start] = [a + b for a, b in zip(bucket_counts, part_counts)]
+            stats["Bucket"] = bucket
+            stats["Buckets"] = [
+                {"Start": datetime.fromisoformat(bucket_start), **counts_to_dict(*bucket_counts)}
+                for bucket_start, bucket_counts in sorted(buckets.items())
+                if bucket_counts[0] > 0
+            ]
+
+        return stats
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -1,8 +1,9 @@
 import json
 import os
+import time
 from functools import lru_cache
-from typing import Optional, Dict, Any
-from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, Literal
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class CameraSettings(BaseModel):
@@ -15,18 +16,67 @@ class ProcessingSettings(BaseModel):
     downscale_width: int = 1280
     downscale_height: int = 720
     fps: int = 20
+    match_workers: int = 1
+    frame_ring_slots: int = 16
+    validator_workers: int = 2
+    # seconds the validation aggregator waits for a missing frame before skipping it
+    validation_frame_timeout: float = 5.0
 
 
 class ValidationSettings(BaseModel):
     position_tolerance_percent: float = 10.0
     rotation_tolerance_degrees: float = 5.0
     size_ratio_tolerance: float = 0.15
+    # pyramid steps of the approximate coarse-to-fine sticker search, 0 searches every pair at full resolution
+    match_pyramid_levels: int = 0
+    roi_search: bool = False
 
 
 class DetectionSettings(BaseModel):
+    # from_dict assigns fields one by one, validated so a bad value fails before it is saved
+    model_config = ConfigDict(validate_assignment=True)
+
     detection_border_left: float = 0.32
     detection_border_right: float = 0.68
     detection_line_height: float = 0.5
+    # weight of each frame in the running average background, 0 keeps the uploaded background unchanged
+    background_learning_rate: float = 0.005
+    # "full" or "fast", fast segments a grayscale frame downsampled by fast_detection_scale
+    detection_mode: Literal["full", "fast"] = "full"
+    fast_detection_scale: float = Field(0.5, gt=0, le=1)
+    # frames where less than this fraction of the detection line differs from the background skip detection,
+    # 0 detects every frame
+    line_gate_coverage: float = 0.25
+
+
+QueuePolicy = Literal["block", "drop_oldest", "drop_newest"]
+
+
+class QueueSettings(BaseModel):
+    # from_dict assigns fields one by one, validated so a bad value fails before it is saved
+    model_config = ConfigDict(validate_assignment=True)
+
+    # maxsize 0 means unbounded
+    shape_queue_size: int = 8
+    shape_queue_policy: QueuePolicy = "drop_oldest"
+    processed_shape_queue_size: int = 32
+    processed_shape_queue_policy: QueuePolicy = "drop_oldest"
+    # one combined result per accumulator, the logger keeps draining it even while database writes fail
+    results_queue_size: int = 256
+    results_queue_policy: QueuePolicy = "block"
+    websocket_queue_size: int = 32
+    websocket_queue_policy: QueuePolicy = "drop_oldest"
+    # websocket clients that stay behind longer than this are disconnected
+    client_deadline_seconds: float = 5.0
+
+
+class DatabaseSettings(BaseModel):
+    # validation logs are inserted in batches of log_batch_size rows, or after log_flush_interval seconds
+    log_batch_size: int = 50
+    log_flush_interval: float = 1.0
+    # connections kept open by the engine of each process, and how long SQLite waits for a writer's lock
+    pool_size: int = 5
+    busy_timeout: float = 5.0
 
 
 class Settings(BaseModel):
@@ -41,6 +91,8 @@ class Settings(BaseModel):
     camera: CameraSettings = Field(default_factory=CameraSettings)
     validation: ValidationSettings = Field(default_factory=ValidationSettings)
     detection: DetectionSettings = Field(default_factory=DetectionSettings)
+    queues: QueueSettings = Field(default_factory=QueueSettings)
+    database: DatabaseSettings = Field(default_factory=DatabaseSettings)
 
     def save_to_file(self, file_path: str = "data/settings/app_settings.json"):
         """Save settings to JSON file"""
@@ -61,22 +113,49 @@ class Settings(BaseModel):
             "Validation": {
                 "PositionTolerancePercent": self.validation.position_tolerance_percent,
                 "RotationToleranceDegrees": self.validation.rotation_tolerance_degrees,
-                "SizeRatioTolerance": self.validation.size_ratio_tolerance
+                "SizeRatioTolerance": self.validation.size_ratio_tolerance,
+                "MatchPyramidLevels": self.validation.match_pyramid_levels,
+                "RoiSearch": self.validation.roi_search
             },
             "Detection": {
                 "DetectionBorderLeft": self.detection.detection_border_left,
                 "DetectionBorderRight": self.detection.detection_border_right,
-                "DetectionLineHeight": self.detection.detection_line_height
+                "DetectionLineHeight": self.detection.detection_line_height,
+                "BackgroundLearningRate": self.detection.background_learning_rate,
+                "DetectionMode": self.detection.detection_mode,
+                "FastDetectionScale": self.detection.fast_detection_scale,
+                "LineGateCoverage": self.detection.line_gate_coverage
             },
             "Processing": {
                 "DownscaleWidth": self.processing.downscale_width,
                 "DownscaleHeight": self.processing.downscale_height,
-                "Fps": self.processing.fps
+                "Fps": self.processing.fps,
+                "MatchWorkers": self.processing.match_workers,
+                "FrameRingSlots": self.processing.frame_ring_slots,
+                "ValidatorWorkers": self.processing.validator_workers,
+                "ValidationFrameTimeout": self.processing.validation_frame_timeout
             },
             "Camera": {
                 "PhoneIp": self.camera.phone_ip,
                 "Port": self.camera.port,
                 "VideoPath": self.camera.video_path
+            },
+            "Queues": {
+                "ShapeQueueSize": self.queues.shape_queue_size,
+                "ShapeQueuePolicy": self.queues.shape_queue_policy,
+                "ProcessedShapeQueueSize": self.queues.processed_shape_queue_size,
+                "ProcessedShapeQueuePolicy": self.queues.processed_shape_queue_policy,
+                "ResultsQueueSize": self.queues.results_queue_size,
+                "ResultsQueuePolicy": self.queues.results_queue_policy,
+                "WebsocketQueueSize": self.queues.websocket_queue_size,
+                "WebsocketQueuePolicy": self.queues.websocket_queue_policy,
+                "ClientDeadlineSeconds": self.queues.client_deadline_seconds
+            },
+            "Database": {
+                "LogBatchSize": self.database.log_batch_size,
+                "LogFlushInterval": self.database.log_flush_interval,
+                "PoolSize": self.database.pool_size,
+                "BusyTimeout": self.database.busy_timeout
             }
         }
 
@@ -106,6 +185,12 @@ class Settings(BaseModel):
             instance.validation.size_ratio_tolerance = validation_data.get(
                 "SizeRatioTolerance", instance.validation.size_ratio_tolerance
             )
+            instance.validation.match_pyramid_levels = validation_data.get(
+                "MatchPyramidLevels", instance.validation.match_pyramid_levels
+            )
+            instance.validation.roi_search = validation_data.get(
+                "RoiSearch", instance.validation.roi_search
+            )
 
         detection_data = data.get("Detection", {})
         if detection_data:
@@ -118,6 +203,18 @@ class Settings(BaseModel):
             instance.detection.detection_line_height = detection_data.get(
                 "DetectionLineHeight", instance.detection.detection_line_height
             )
+            instance.detection.background_learning_rate = detection_data.get(
+                "BackgroundLearningRate", instance.detection.background_learning_rate
+            )
+            instance.detection.detection_mode = detection_data.get(
+                "DetectionMode", instance.detection.detection_mode
+            )
+            instance.detection.fast_detection_scale = detection_data.get(
+                "FastDetectionScale", instance.detection.fast_detection_scale
+            )
+            instance.detection.line_gate_coverage = detection_data.get(
+                "LineGateCoverage", instance.detection.line_gate_coverage
+            )
 
         processing_data = data.get("Processing", {})
         if processing_data:
@@ -128,6 +225,18 @@ class Settings(BaseModel):
                 "DownscaleHeight", instance.processing.downscale_height
             )
             instance.processing.fps = processing_data.get("Fps", instance.processing.fps)
+            instance.processing.match_workers = processing_data.get(
+                "MatchWorkers", instance.processing.match_workers
+            )
+            instance.processing.frame_ring_slots = processing_data.get(
+                "FrameRingSlots", instance.processing.frame_ring_slots
+            )
+            instance.processing.validator_workers = processing_data.get(
+                "ValidatorWorkers", instance.processing.validator_workers
+            )
+            instance.processing.validation_frame_timeout = processing_data.get(
+                "ValidationFrameTimeout", instance.processing.validation_frame_timeout
+            )
 
         camera_data = data.get("Camera", {})
         if camera_data:
@@ -141,16 +250,110 @@ class Settings(BaseModel):
                 "VideoPath", instance.camera.video_path
             )
 
+        queues_data = data.get("Queues", {})
+        if queues_data:
+            for key, field in [
+                ("ShapeQueueSize", "shape_queue_size"),
+                ("ShapeQueuePolicy", "shape_queue_policy"),
+                ("ProcessedShapeQueueSize", "processed_shape_queue_size"),
+                ("ProcessedShapeQueuePolicy", "processed_shape_queue_policy"),
+                ("ResultsQueueSize", "results_queue_size"),
+                ("ResultsQueuePolicy", "results_queue_policy"),
+                ("WebsocketQueueSize", "websocket_queue_size"),
+                ("WebsocketQueuePolicy", "websocket_queue_policy"),
+                ("ClientDeadlineSeconds", "client_deadline_seconds"),
+            ]:
+                setattr(instance.queues, field, queues_data.get(key, getattr(instance.queues, field)))
+
+        database_data = data.get("Database", {})
+        if database_data:
+            instance.database.log_batch_size = database_data.get(
+                "LogBatchSize", instance.database.log_batch_size
+            )
+            instance.database.log_flush_interval = database_data.get(
+                "LogFlushInterval", instance.database.log_flush_interval
+            )
+            instance.database.pool_size = database_data.get(
+                "PoolSize", instance.database.pool_size
+            )
+            instance.database.busy_timeout = database_data.get(
+                "BusyTimeout", instance.database.busy_timeout
+            )
+
         return instance
 
 
+# running pipeline processes apply these in place (prefixes ending with "." cover a whole block),
+# changes of any other field need a restart
+HOT_SETTINGS = (
+    "bg_photo_path",
+    "detection.",
+    "validation.",
+    "processing.fps",
+    "processing.match_workers",
+    "processing.validation_frame_timeout",
+    "queues.client_deadline_seconds",
+)
+
+
+def _flatten(data: dict, prefix: str = "") -> Dict[str, Any]:
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def is_hot_setting(name: str) -> bool:
+    return any(name.startswith(hot) if hot.endswith(".") else name == hot for hot in HOT_SETTINGS)
+
+
+def settings_requiring_restart(old: Settings, new: Settings) -> list[str]:
+    """Names of changed settings (e.g. "queues.shape_queue_size") that can not be applied to running processes"""
+    old_values = _flatten(old.model_dump())
+    return [name for name, value in _flatten(new.model_dump()).items()
+            if old_values.get(name) != value and not is_hot_setting(name)]
+
+
 _settings: Optional[Settings] = None
 _settings_file = os.environ.get("SETTINGS_FILE", "../data/settings/app_settings.json")
+# modification time of the file _settings was loaded from, and when it was last compared
+_settings_mtime: Optional[float] = None
+_settings_checked_at = 0.0
+# get_settings is called per frame, the file is stat'ed at most this often
+SETTINGS_CHECK_INTERVAL = 1.0
+
+
+def _file_mtime(file_path: str) -> Optional[float]:
+    try:
+        return os.stat(file_path).st_mtime
+    except OSError:
+        return None
 
 
 def get_settings() -> Settings:
-    """Get application settings, loading from file every time"""
-    return load_settings(_settings_file)
+    """
+    Get application settings, reloaded from file only when it was modified.
+    Returns a copy, so callers changing it do not change the settings of everyone else.
+    """
+    global _settings, _settings_mtime, _settings_checked_at
+
+    now = time.monotonic()
+    if _settings is None or now - _settings_checked_at >= SETTINGS_CHECK_INTERVAL:
+        _settings_checked_at = now
+        mtime = _file_mtime(_settings_file)
+        if _settings is None or mtime != _settings_mtime:
+            _settings = load_settings(_settings_file)
+            _settings_mtime = mtime
+    return _settings.model_copy(deep=True)
+
+
+def invalidate_settings() -> None:
+    """Reload settings on the next get_settings call, e.g. when another process saved them"""
+    global _settings
+    _settings = None
 
 
 def load_settings(file_path: str = _settings_file) -> Settings:
@@ -170,16 +373,17 @@ def reset_settings() -> Settings:
     """Reset settings to default values"""
     global _settings
     _settings = Settings()
-    return _settings
+    return _settings.model_copy(deep=True)
 
 
 def save_settings(settings: Settings) -> None:
     """Save settings and update global instance"""
-    global _settings
-    _settings = settings
+    global _settings, _settings_mtime
+    _settings = settings.model_copy(deep=True)
 
     os.makedirs(os.path.dirname(_settings_file), exist_ok=True)
 
     with open(_settings_file, 'w') as f:
         json.dump(settings.to_dict(), f, indent=2)
+    _settings_mtime = _file_mtime(_settings_file)
 
@@ -1,44 +1,236 @@
+import asyncio
 import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
 
 from fastapi import WebSocket
 from starlette.websockets import WebSocketDisconnect
 
-from model.model import StreamingMessage, DefaultJsonEncoder
+from model.model import StreamingMessage, StreamingMessageType
+from utils.stream_demand import StreamDemand
+
+logger = logging.getLogger(__name__)
+
+# legacy clients get {"type", "content"} JSON with base64 images, binary clients get header + raw payload
+JSON_PROTOCOL = "json"
+BINARY_PROTOCOL = "binary"
+PROTOCOLS = (JSON_PROTOCOL, BINARY_PROTOCOL)
+
+# validation results are not replaced by newer ones, a slow client keeps up to this many
+VALIDATION_BUFFER_SIZE = 16
+
+
+@dataclass
+class StreamSubscription:
+    max_fps: float = 0  # 0 means every message
+    max_width: int = 0  # 0 means original size
+    last_sent: float = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StreamSubscription":
+        return cls(max_fps=float(data.get("MaxFps") or 0), max_width=int(data.get("MaxWidth") or 0))
+
+    def is_due(self, now: float) -> bool:
+        return self.max_fps <= 0 or now - self.last_sent >= 1 / self.max_fps
+
+
+def all_streams() -> dict[StreamingMessageType, StreamSubscription]:
+    return {message_type: StreamSubscription() for message_type in StreamingMessageType}
+
+
+@dataclass
+class WebSocketClient:
+    protocol: str = JSON_PROTOCOL
+    # clients that never subscribe get every stream, as before subscriptions existed
+    subscriptions: dict[StreamingMessageType, StreamSubscription] = field(default_factory=all_streams)
+    # outbound buffer: latest image per stream type, validation results in order
+    latest_images: dict[StreamingMessageType, StreamingMessage] = field(default_factory=dict)
+    validations: deque = field(default_factory=lambda: deque(maxlen=VALIDATION_BUFFER_SIZE))
+    has_pending: asyncio.Event = field(default_factory=asyncio.Event)
+    pending_since: float | None = None
+    sending_since: float | None = None
+    sent: int = 0
+    dropped: int = 0
+    sender: asyncio.Task | None = None
+
+    def enqueue(self, message: StreamingMessage):
+        if message.type == StreamingMessageType.VALIDATION:
+            if len(self.validations) == self.validations.maxlen:
+                self.dropped += 1
+            self.validations.append(message)
+        else:
+            if message.type in self.latest_images:
+                self.dropped += 1
+            self.latest_images[message.type] = message
+
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        self.has_pending.set()
+
+    def take_pending(self) -> list[StreamingMessage]:
+        messages = [*self.validations, *self.latest_images.values()]
+        self.validations.clear()
+        self.latest_images.clear()
+        self.has_pending.clear()
+        self.sending_since, self.pending_since = self.pending_since, None
+        return sorted(messages, key=lambda m: m.timestamp)
+
+    def lag(self) -> float:
+        """Seconds the oldest message not yet delivered to the client has been waiting"""
+        since = self.sending_since if self.sending_since is not None else self.pending_since
+        return 0.0 if since is None else time.monotonic() - since
+
+
+def parse_subscriptions(message: str) -> dict[StreamingMessageType, StreamSubscription] | None:
+    """
+    Parse subscription message sent by a client:
+    {"Subscriptions": [{"Type": 4}, {"Type": 1, "MaxFps": 5, "MaxWidth": 640}]}
+    Returns None for other messages (e.g. keep-alive).
+    """
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "Subscriptions" not in data:
+        return None
+
+    return {StreamingMessageType(item["Type"]): StreamSubscription.from_dict(item) for item in data["Subscriptions"]}
 
 
 class WebSocketManager:
-    def __init__(self):
+    def __init__(self, stream_demand: StreamDemand | None = None, client_deadline_seconds: float = 5.0):
         self.active_connections: list[WebSocket] = []
+        self.clients: dict[WebSocket, WebSocketClient] = {}
         self.latest_message: StreamingMessage | None = None
+        self.stream_demand = stream_demand
+        self.client_deadline_seconds = client_deadline_seconds
+        # close handshakes of evicted clients, referenced until done so they are not garbage collected
+        self.__closing: set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, protocol: str = JSON_PROTOCOL):
         await websocket.accept()
+        client = WebSocketClient(protocol)
         self.active_connections.append(websocket)
+        self.clients[websocket] = client
+        if self.stream_demand is not None:
+            self.stream_demand.subscribe(client.subscriptions)
 
+        client.sender = asyncio.create_task(self.__send_loop(websocket, client))
         if self.latest_message is not None:
-            await self.__send_message(websocket, self.latest_message)
+            self.__offer(client, self.latest_message)
 
     def disconnect(self, websocket: WebSocket):
+        if websocket not in self.active_connections:
+            return
+
         self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket)
+        if self.stream_demand is not None:
+            self.stream_demand.unsubscribe(client.subscriptions)
+        if client.sender is not None and client.sender is not asyncio.current_task():
+            client.sender.cancel()
 
-    async def __send_message(self, ws: WebSocket, msg: StreamingMessage):
+    def handle_client_message(self, websocket: WebSocket, message: str):
+        """Apply subscription sent by the client, other messages only keep the connection alive"""
         try:
-            msg_json = json.dumps(msg, cls=DefaultJsonEncoder)
-            await ws.send_bytes(msg_json)
-        except WebSocketDisconnect:
+            subscriptions = parse_subscriptions(message)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Invalid subscription message: {message} ({e})")
+            return
+
+        client = self.clients.get(websocket)
+        if subscriptions is None or client is None:
+            return
+
+        if self.stream_demand is not None:
+            self.stream_demand.unsubscribe(client.subscriptions)
+            self.stream_demand.subscribe(subscriptions)
+        client.subscriptions = subscriptions
+        logger.info(f"Websocket client subscribed to {[t.name for t in subscriptions]}")
+
+    def get_client_stats(self) -> list[dict]:
+        return [
+            {
+                "Client": f"{ws.client.host}:{ws.client.port}" if ws.client else None,
+                "Protocol": client.protocol,
+                "Subscriptions": [message_type.name for message_type in client.subscriptions],
+                "LagSeconds": round(client.lag(), 3),
+                "Sent": client.sent,
+                "Dropped": client.dropped
+            }
+            for ws, client in self.clients.items()
+        ]
+
+    @staticmethod
+    def __serialize(msg: StreamingMessage, protocol: str) -> bytes:
+        return msg.serialize_binary() if protocol == BINARY_PROTOCOL else msg.serialize()
+
+    @staticmethod
+    def __offer(client: WebSocketClient, message: StreamingMessage):
+        subscription = client.subscriptions.get(message.type)
+        if subscription is None:
+            return
+
+        now = time.monotonic()
+        if not subscription.is_due(now):
+            return
+        subscription.last_sent = now
+        client.enqueue(message)
+
+    @staticmethod
+    async def __close(ws: WebSocket, reason: str):
+        try:
+            await asyncio.wait_for(ws.close(code=1008, reason=reason), timeout=1)
+        except Exception:
             pass
+
+    def __evict(self, ws: WebSocket, reason: str):
+        """Disconnect the client at once, a dead client may take up to a second to close in the background"""
+        client = self.clients.get(ws)
+        logger.warning(f"Disconnecting websocket client {ws.client}: {reason}"
+                       + (f", lag {client.lag():.1f}s, dropped {client.dropped}" if client else ""))
+        self.disconnect(ws)
+        task = asyncio.create_task(self.__close(ws, reason))
+        self.__closing.add(task)
+        task.add_done_callback(self.__closing.discard)
+
+    async def __send_loop(self, ws: WebSocket, client: WebSocketClient):
+        """Sender task of one client, so a slow client delays nobody but itself"""
+        try:
+            while True:
+                await client.has_pending.wait()
+
+                for message in client.take_pending():
+                    subscription = client.subscriptions.get(message.type)
+                    if subscription is not None and message.needs_resize(subscription.max_width):
+                        # JPEG decode, resize and encode would stall every client, so they run off the event loop.
+                        # Clients with the same limit may both resize a message, the first result is kept
+                        message = await asyncio.to_thread(message.resized, subscription.max_width)
+                    elif subscription is not None:
+                        # resized and serialized variants are cached on the message and shared by all clients
+                        message = message.resized(subscription.max_width)
+                    data = self.__serialize(message, client.protocol)
+                    await asyncio.wait_for(ws.send_bytes(data), timeout=self.client_deadline_seconds)
+                    client.sent += 1
+
+                client.sending_since = None
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self.__evict(ws, "client too slow")
+        except WebSocketDisconnect:
+            self.disconnect(ws)
         except Exception as e:
-            print('FUCK json, ', str(e))
-            await ws.close()
-            self.active_connections.remove(ws)
+            self.__evict(ws, f"send failed: {e}")
 
     async def broadcast_message(self, message: StreamingMessage):
+        """Put message to outbound buffers of subscribed clients, sending is done by their sender tasks"""
         self.latest_message = message
 
-        try:
-            for ws in self.active_connections:
-                await self.__send_message(ws, message)
-        except RuntimeError as re:
-            # todo shit
-            if str(re) == 'Cannot call "send" once a close message has been sent.':
-                raise InterruptedError
+        for ws, client in list(self.clients.items()):
+            if client.lag() > self.client_deadline_seconds:
+                self.__evict(ws, "client too slow")
+                continue
+            self.__offer(client, message)
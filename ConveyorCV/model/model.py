@@ -1,15 +1,17 @@
 from abc import ABC, abstractmethod
 import base64
 import json
+import struct
+import time
 from dataclasses import dataclass
 from typing import Optional, Tuple, Union
 from dataclasses import dataclass, field
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from json import JSONEncoder
-from sqlalchemy import create_engine, Column, Integer, Float, Boolean, DateTime, String
+from sqlalchemy import create_engine, Column, Integer, Float, Boolean, DateTime, String, LargeBinary, Index, func, tuple_
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, defer
 from enum import IntEnum
 
 import cv2
@@ -135,6 +137,8 @@ class DetectionContext:
     processed_image: np.ndarray | None = None  # Aligned and cropped image
     processed_image_corners = None
     validation_results: StickerValidationResult | None = None
+    frame_slot: int | None = None  # FrameRing slot holding image and shape
+    frame_generation: int = 0
 
     def to_dict(self) -> dict:
         """Serialize DetectionContext to dictionary"""
@@ -203,6 +207,7 @@ class IPCMessageType(IntEnum):
     PARAMS = 2
     GET_CONTEXT = 3
     STOP = 4
+    SETTINGS = 5
 
 
 
@@ -212,6 +217,10 @@ class StreamingMessageContent(ABC):
         """Convert to a serializable dictionary format"""
         pass
 
+    def to_bytes(self) -> bytes:
+        """Payload of binary websocket frames"""
+        return json.dumps(self.to_dict(), cls=DefaultJsonEncoder).encode('utf-8')
+
 
 class DefaultJsonEncoder(JSONEncoder):
     def default(self, o):
@@ -222,10 +231,20 @@ class ImageStreamingMessageContent(StreamingMessageContent):
     def __init__(self, image: np.ndarray) -> None:
         encode_params = [cv2.IMWRITE_JPEG_QUALITY, 75]
         _, encoded_img = cv2.imencode('.jpg', image, encode_params)
-        self.image: str = base64.b64encode(encoded_img.tobytes()).decode('utf-8')
+        # raw JPEG crosses the process boundary, base64 is done once when the message is serialized
+        self.jpeg: bytes = encoded_img.tobytes()
+        self.width: int = image.shape[1]
 
     def to_dict(self):
-        return {"image": self.image}
+        return {"image": base64.b64encode(self.jpeg).decode('utf-8')}
+
+    def to_bytes(self) -> bytes:
+        return self.jpeg
+
+    def resized(self, max_width: int) -> "ImageStreamingMessageContent":
+        image = cv2.imdecode(np.frombuffer(self.jpeg, np.uint8), cv2.IMREAD_UNCHANGED)
+        height = max(round(image.shape[0] * max_width / image.shape[1]), 1)
+        return ImageStreamingMessageContent(cv2.resize(image, (max_width, height), interpolation=cv2.INTER_AREA))
 
 
 @dataclass
@@ -238,20 +257,71 @@ class ValidationStreamingMessageContent(StreamingMessageContent):
 
 
 class StreamingMessage:
-    def __init__(self, type: StreamingMessageType, content: StreamingMessageContent) -> None:
+    # binary frame header: message type (uint8), seq number (uint32), timestamp in ms (int64), little-endian
+    BINARY_HEADER = struct.Struct("<BIq")
+
+    def __init__(self, type: StreamingMessageType, content: StreamingMessageContent, seq: int = 0) -> None:
         self.type = type
-        self.content = json.dumps(content.to_dict(), cls=DefaultJsonEncoder)
+        self.content = content
+        self.seq = seq
+        self.timestamp = int(time.time() * 1000)
+        self.__serialized: bytes | None = None
+        self.__serialized_binary: bytes | None = None
+        self.__resized: dict[int, "StreamingMessage"] = {}
+
+    def needs_resize(self, max_width: int) -> bool:
+        """Whether resized(max_width) has to decode, resize and re-encode the image"""
+        return (isinstance(self.content, ImageStreamingMessageContent) and 0 < max_width < self.content.width
+                and max_width not in self.__resized)
+
+    def resized(self, max_width: int) -> "StreamingMessage":
+        """Image message scaled down to max_width, built once and shared by clients with the same limit"""
+        if (not isinstance(self.content, ImageStreamingMessageContent) or max_width <= 0
+                or self.content.width <= max_width):
+            return self
+
+        if max_width not in self.__resized:
+            resized = StreamingMessage(self.type, self.content.resized(max_width), self.seq)
+            resized.timestamp = self.timestamp
+            # resizes of one message may run in parallel threads, all callers get the first one
+            self.__resized.setdefault(max_width, resized)
+        return self.__resized[max_width]
+
+    def serialize(self) -> bytes:
+        """JSON sent to websocket clients, built on first call and shared by all clients"""
+        if self.__serialized is None:
+            message = {
+                "type": self.type,
+                "content": json.dumps(self.content.to_dict(), cls=DefaultJsonEncoder)
+            }
+            self.__serialized = json.dumps(message).encode('utf-8')
+        return self.__serialized
+
+    def serialize_binary(self) -> bytes:
+        """
+        Header followed by the payload: JPEG for image messages, UTF-8 JSON of the content for validation.
+        Built on first call and shared by all clients
+        """
+        if self.__serialized_binary is None:
+            header = self.BINARY_HEADER.pack(self.type, self.seq & 0xFFFFFFFF, self.timestamp)
+            self.__serialized_binary = header + self.content.to_bytes()
+        return self.__serialized_binary
 
 Base = declarative_base()
 
 class ValidationLog(Base):
     __tablename__ = "validation_logs"
+    __table_args__ = (
+        # date-filtered counts and statistics are answered from the index alone (SQLite appends rowid to it)
+        Index("ix_validation_logs_timestamp_result", "timestamp", "sticker_present", "sticker_matches_design"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, index=True)
     seq_number = Column(Integer)
     sticker_present = Column(Boolean)
-    acc_image = Column(String, nullable=True) #b64 encoded image
+    acc_image = Column(String, nullable=True) #b64 encoded image, only in rows written before ValidationImage
+    image_hash = Column(String(64), nullable=True, index=True)
     sticker_matches_design = Column(Boolean, nullable=True)
     sticker_position_x = Column(Float, nullable=True)
     sticker_position_y = Column(Float, nullable=True)
@@ -259,7 +329,7 @@ class ValidationLog(Base):
     sticker_size_height = Column(Float, nullable=True)
     sticker_rotation = Column(Float, nullable=True)
 
-    def to_dict(self):
+    def to_dict(self, image: str | None = None, has_legacy_image: bool = False):
         """Convert ValidationLog to a format suitable for API response"""
         return {
             "Id": self.id,
@@ -267,7 +337,8 @@ class ValidationLog(Base):
             "SeqNumber": self.seq_number,
             "StickerPresent": self.sticker_present,
             "StickerMatchesDesign": self.sticker_matches_design,
-            "Image": self.acc_image,
+            "Image": image,
+            "HasImage": self.image_hash is not None or has_legacy_image,
             "StickerPosition": {
                 "x": self.sticker_position_x,
                 "y": self.sticker_position_y
@@ -279,32 +350,136 @@ class ValidationLog(Base):
             "StickerRotation": self.sticker_rotation
         }
 
-    @classmethod
-    def paginate(cls, db, start_date=None, end_date=None, page=1, page_size=100):
-        """Class method to paginate validation logs with filtering"""
-        query = db.query(cls)
+    @staticmethod
+    def encode_cursor(timestamp: datetime, log_id: int) -> str:
+        return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{log_id}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[datetime, int]:
+        """Raises ValueError for malformed cursors"""
+        try:
+            timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(timestamp), int(log_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
 
+    @classmethod
+    def filter_dates(cls, query, start_date=None, end_date=None):
         if start_date:
             query = query.filter(cls.timestamp >= start_date)
-
         if end_date:
             query = query.filter(cls.timestamp <= end_date)
+        return query
 
-        total_count = query.count()
-        query = query.order_by(cls.timestamp.desc())
-        query = query.offset((page - 1) * page_size).limit(page_size)
+    @classmethod
+    def approximate_count(cls, db, start_date=None, end_date=None) -> int:
+        """
+        Number of ids between the first and the last log in the date range, found with two index seeks.
+        Logs are appended in timestamp order, so only deleted logs make the estimate too high.
+        """
+        first_id = cls.filter_dates(db.query(cls.id), start_date, end_date) \
+            .order_by(cls.timestamp.asc(), cls.id.asc()).limit(1).scalar()
+        last_id = cls.filter_dates(db.query(cls.id), start_date, end_date) \
+            .order_by(cls.timestamp.desc(), cls.id.desc()).limit(1).scalar()
+        if first_id is None or last_id is None:
+            return 0
+        return abs(last_id - first_id) + 1
 
-        results = query.all()
-        logs = [log.to_dict() for log in results]
+    @classmethod
+    def paginate(cls, db, start_date=None, end_date=None, page=1, page_size=100, include_images=False,
+                 cursor: str | None = None, total: str = "exact"):
+        """
+        Class method to paginate validation logs with filtering, newest first.
+        With cursor (NextCursor of the previous page) the page is found by an index seek on (timestamp, id)
+        instead of skipping (page - 1) * page_size rows, so deep pages are as fast as the first one.
+        total is "exact", "approximate" (see approximate_count) or "none".
+        Images are loaded only with include_images, otherwise clients get them from /validation/logs/{id}/image
+        """
+        # legacy base64 images are only tested for presence, not loaded
+        query = db.query(cls, cls.acc_image.isnot(None))
+        if not include_images:
+            query = query.options(defer(cls.acc_image))
+        query = cls.filter_dates(query, start_date, end_date)
+
+        if total == "exact":
+            total_count = cls.filter_dates(db.query(func.count(cls.id)), start_date, end_date).scalar()
+        elif total == "approximate":
+            total_count = cls.approximate_count(db, start_date, end_date)
+        else:
+            total_count = None
+
+        query = query.order_by(cls.timestamp.desc(), cls.id.desc())
+        if cursor:
+            query = query.filter(tuple_(cls.timestamp, cls.id) < tuple_(*cls.decode_cursor(cursor)))
+        else:
+            query = query.offset((page - 1) * page_size)
+
+        results = query.limit(page_size).all()
+        if include_images:
+            images = ValidationImage.load_b64(db, [log.image_hash for log, _ in results if log.image_hash])
+            logs = [log.to_dict(images.get(log.image_hash, log.acc_image), has_legacy_image)
+                    for log, has_legacy_image in results]
+        else:
+            logs = [log.to_dict(has_legacy_image=has_legacy_image) for log, has_legacy_image in results]
+
+        next_cursor = None
+        if len(results) == page_size:
+            last_log = results[-1][0]
+            next_cursor = cls.encode_cursor(last_log.timestamp, last_log.id)
 
         return {
             "Total": total_count,
             "Page": page,
             "PageSize": page_size,
-            "Pages": (total_count + page_size - 1) // page_size,
+            "Pages": None if total_count is None else (total_count + page_size - 1) // page_size,
+            "NextCursor": next_cursor,
             "Logs": logs
         }
 
+
+class ValidationImage(Base):
+    """PNG images of rejected accumulators, stored once per content hash"""
+    __tablename__ = "validation_images"
+
+    hash = Column(String(64), primary_key=True)  # sha256 of data
+    data = Column(LargeBinary, nullable=False)
+
+    @classmethod
+    def load_b64(cls, db, hashes: list[str]) -> dict[str, str]:
+        if not hashes:
+            return {}
+        rows = db.query(cls.hash, cls.data).filter(cls.hash.in_(set(hashes))).all()
+        return {image_hash: base64.b64encode(data).decode('utf-8') for image_hash, data in rows}
+
+
+class ValidationStatsRollup:
+    """Validation counts of logs with timestamp in [bucket_start, bucket_start + BUCKET_SIZE)"""
+    BUCKET_SIZE: timedelta
+
+    bucket_start = Column(DateTime, primary_key=True)
+    total_count = Column(Integer, nullable=False, default=0)
+    missing_sticker_count = Column(Integer, nullable=False, default=0)
+    incorrect_design_count = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def bucket_of(cls, timestamp: datetime) -> datetime:
+        return datetime.min + (timestamp - datetime.min) // cls.BUCKET_SIZE * cls.BUCKET_SIZE
+
+
+class ValidationStatsMinute(ValidationStatsRollup, Base):
+    __tablename__ = "validation_stats_minute"
+    BUCKET_SIZE = timedelta(minutes=1)
+
+
+class ValidationStatsHour(ValidationStatsRollup, Base):
+    __tablename__ = "validation_stats_hour"
+    BUCKET_SIZE = timedelta(hours=1)
+
+
+# finest first
+STATS_ROLLUPS = (ValidationStatsMinute, ValidationStatsHour)
+
+
 class ContextManagement(ABC):
     @abstractmethod
     def get_context(self) -> dict:
@@ -1,8 +1,9 @@
-import gc
 import logging
 import multiprocessing
+import signal
 import time
-from multiprocessing import Process, Queue
+from concurrent.futures import ThreadPoolExecutor, Future
+from multiprocessing import Process, Queue, RawValue
 from queue import Empty
 
 from Camera.CameraInterface import CameraInterface
@@ -10,22 +11,34 @@ from Camera.IPCamera import IPCamera
 from Camera.VideoFileCamera import VideoFileCamera
 from algorithms.ShapeDetector import ShapeDetector
 from algorithms.ShapeProcessor import ShapeProcessor
-from algorithms.StickerValidator import StickerValidator, combined_validation_results
+from algorithms.StickerValidator import StickerValidator, ValidationAggregator
+from backend.settings import Settings, invalidate_settings
 from model.model import DetectionContext, StreamingMessage, ImageStreamingMessageContent, \
     ValidationStreamingMessageContent, StreamingMessageType, StickerValidationParams, ContextManagement, IPCMessage, \
-    IPCMessageType
+    IPCMessageType, StickerValidationResult
+from utils.bounded_queue import BoundedQueue
 from utils.downscale import downscale
+from utils.frame_ring import FrameRing
+from utils.stream_demand import StreamDemand, is_streamed
 
 logger = logging.getLogger(__name__)
 
+GATE_KEYFRAME_INTERVAL = 10
+# a validation log batch failing this many flushes is written row by row, at most this many batches wait for writing
+LOG_FLUSH_RETRIES = 3
+LOG_PENDING_BATCHES = 20
+
 
 # frames -> BW masks of prop
 class ShapeDetectorProcess(Process, ContextManagement):
-    def __init__(self, input_queue: Queue, shape_queue: Queue, websocket_queue: Queue, camera_type,
+    def __init__(self, input_queue: Queue, shape_queue: BoundedQueue, websocket_queue: BoundedQueue, camera_type,
                  shape_detector: ShapeDetector,
-                 settings, pipe_connection):
+                 settings, pipe_connection, frame_ring: FrameRing | None = None,
+                 stream_demand: StreamDemand | None = None):
         Process.__init__(self, daemon=True)
         self.detector = shape_detector
+        self.__frame_ring = frame_ring
+        self.__stream_demand = stream_demand
         self.__camera_type = camera_type
         self.settings = settings
         self.__shape_queue = shape_queue
@@ -34,11 +47,15 @@ class ShapeDetectorProcess(Process, ContextManagement):
         self.__input_queue = input_queue
         self.__pipe = pipe_connection
         self.process_name = "detector"
+        # written by this process only, read by the API
+        self.frames_read = RawValue('q', 0)
+        self.frames_skipped = RawValue('q', 0)
 
     def get_context(self) -> dict:
         """Return current process context for saving"""
         return {
             "frame_count": self.__frame_count,
+            "frames_skipped": self.frames_skipped.value,
         }
 
     def restore_context(self, context: dict):
@@ -47,11 +64,19 @@ class ShapeDetectorProcess(Process, ContextManagement):
             pass
             #self.__frame_count = context["frame_count"]
 
+    def apply_settings(self, settings: Settings):
+        """Background and frame rate change in place, camera settings need a restart"""
+        self.settings = settings
+        self.detector.apply_settings(settings)
+
     def __handle_ipc_message(self, message: IPCMessage):
         if message.message_type == IPCMessageType.GET_CONTEXT:
             context_data = self.get_context()
             response = IPCMessage.create_context_response(self.process_name, context_data)
             self.__pipe.send(response)
+        elif message.message_type == IPCMessageType.SETTINGS:
+            self.apply_settings(Settings.from_dict(message.content))
+            self.__pipe.send(IPCMessage(IPCMessageType.SETTINGS, self.process_name, {"status": "success"}))
         elif message.message_type == IPCMessageType.STOP:
             raise InterruptedError("Stop command received")
 
@@ -65,8 +90,6 @@ class ShapeDetectorProcess(Process, ContextManagement):
 
         self.__camera.connect()
 
-        frame_period = 1.0 / self.settings.processing.fps
-
         while True:
             try:
 
@@ -94,22 +117,41 @@ class ShapeDetectorProcess(Process, ContextManagement):
                 image = downscale(image, self.settings.processing.downscale_width,
                                   self.settings.processing.downscale_height)
                 context = DetectionContext(image=image)
-                context = self.detector.detect(context)
-
-                self.__shape_queue.put_nowait(context)
-                self.__ws_queue.put_nowait(
-                    StreamingMessage(StreamingMessageType.RAW, ImageStreamingMessageContent(context.image)))
-
-                if context.shape is not None:
-                    self.__ws_queue.put_nowait(
-                        StreamingMessage(StreamingMessageType.SHAPE, ImageStreamingMessageContent(context.shape)))
 
-                if self.__frame_count % 200 == 0:
-                    gc.collect()
+                # frames with nothing on the detection line are not detected and not passed on,
+                # except for every GATE_KEYFRAME_INTERVAL-th one that keeps the background model learning
+                line_occupied = self.detector.is_line_occupied(image)
+                if line_occupied or self.__frame_count % GATE_KEYFRAME_INTERVAL == 0:
+                    context = self.detector.detect(context)
+                else:
+                    self.detector.skip_frame()
+
+                self.frames_read.value = self.__frame_count
+                if not line_occupied:
+                    self.frames_skipped.value += 1
+                    if self.frames_skipped.value % 1000 == 0:
+                        logger.info(f"{self.name} skipped {self.frames_skipped.value} of {self.__frame_count} frames "
+                                    f"with empty detection line")
+
+                if is_streamed(self.__stream_demand, StreamingMessageType.RAW):
+                    self.__ws_queue.put(
+                        StreamingMessage(StreamingMessageType.RAW, ImageStreamingMessageContent(context.image),
+                                         self.__frame_count))
+
+                if context.shape is not None and is_streamed(self.__stream_demand, StreamingMessageType.SHAPE):
+                    self.__ws_queue.put(
+                        StreamingMessage(StreamingMessageType.SHAPE, ImageStreamingMessageContent(context.shape),
+                                         self.__frame_count))
+
+                if line_occupied:
+                    if self.__frame_ring is not None:
+                        context = self.__frame_ring.put(context)
+                    self.__shape_queue.put(context)
 
                 elapsed_time = time.time() - start_time
                 # print(elapsed_time)
 
+                frame_period = 1.0 / self.settings.processing.fps
                 if elapsed_time < frame_period:
                     time.sleep(frame_period - elapsed_time)
 
@@ -122,10 +164,13 @@ class ShapeDetectorProcess(Process, ContextManagement):
 
 # BW masks of prop -> aligned and cropped images
 class ShapeProcessorProcess(Process, ContextManagement):
-    def __init__(self, mask_queue: Queue, image_queue: Queue, websocket_queue: Queue, shape_processor: ShapeProcessor,
-                 pipe_connection):
+    def __init__(self, mask_queue: BoundedQueue, image_queue: BoundedQueue, websocket_queue: BoundedQueue, shape_processor: ShapeProcessor,
+                 pipe_connection, frame_ring: FrameRing | None = None, stream_demand: StreamDemand | None = None):
         Process.__init__(self, daemon=True)
         self.shape_processor = shape_processor
+        self.__frame_ring = frame_ring
+        self.__stream_demand = stream_demand
+        self.__stale_frames = 0
         self.__mask_queue = mask_queue
         self.__image_queue = image_queue
         self.__ws_queue = websocket_queue
@@ -137,7 +182,8 @@ class ShapeProcessorProcess(Process, ContextManagement):
         return {
             "objects_processed": self.shape_processor.objects_processed,
             "last_contour_center_x": self.shape_processor.last_contour_center_x,
-            "last_detected_at": self.shape_processor.last_detected_at
+            "last_detected_at": self.shape_processor.last_detected_at,
+            "stale_frames": self.__stale_frames
         }
 
     def restore_context(self, context: dict):
@@ -149,11 +195,20 @@ class ShapeProcessorProcess(Process, ContextManagement):
         if "last_detected_at" in context:
             self.shape_processor.last_detected_at = context["last_detected_at"]
 
+    def __on_stale_frame(self):
+        # the detector reused the frame ring slot before this frame was processed
+        self.__stale_frames += 1
+        if self.__stale_frames % 100 == 1:
+            logger.warning(f"{self.name} skipped {self.__stale_frames} frames overwritten in frame ring")
+
     def __handle_ipc_message(self, message: IPCMessage):
         if message.message_type == IPCMessageType.GET_CONTEXT:
             context_data = self.get_context()
             response = IPCMessage.create_context_response(self.process_name, context_data)
             self.__pipe.send(response)
+        elif message.message_type == IPCMessageType.SETTINGS:
+            self.shape_processor.apply_settings(Settings.from_dict(message.content))
+            self.__pipe.send(IPCMessage(IPCMessageType.SETTINGS, self.process_name, {"status": "success"}))
         elif message.message_type == IPCMessageType.STOP:
             raise InterruptedError("Stop command received")
 
@@ -169,17 +224,31 @@ class ShapeProcessorProcess(Process, ContextManagement):
                         self.__handle_ipc_message(ipc_message)
                         continue
 
-                context = self.__mask_queue.get()
+                try:
+                    # time out to answer IPC messages while no frames arrive
+                    context = self.__mask_queue.get(timeout=1)
+                except Empty:
+                    continue
 
                 if context is None:
                     raise InterruptedError
 
+                if self.__frame_ring is not None and not self.__frame_ring.attach(context):
+                    self.__on_stale_frame()
+                    continue
+
                 context = self.shape_processor.process(context)
 
+                if self.__frame_ring is not None and not self.__frame_ring.detach(context):
+                    self.__on_stale_frame()
+                    continue
+
                 if context.processed_image is not None:
-                    self.__image_queue.put_nowait(context)
-                    self.__ws_queue.put_nowait(StreamingMessage(StreamingMessageType.PROCESSED,
-                                                                ImageStreamingMessageContent(context.processed_image)))
+                    self.__image_queue.put(context)
+                    if is_streamed(self.__stream_demand, StreamingMessageType.PROCESSED):
+                        self.__ws_queue.put(StreamingMessage(StreamingMessageType.PROCESSED,
+                                                             ImageStreamingMessageContent(context.processed_image),
+                                                             context.seq_number))
 
 
             except (KeyboardInterrupt, InterruptedError):
@@ -189,29 +258,31 @@ class ShapeProcessorProcess(Process, ContextManagement):
                 logger.error(f"{self.name} exception: ", e)
 
 
-# aligned and cropped images -> validation results for prop
+def validator_process_name(worker_index: int) -> str:
+    # the first worker keeps the name used before validation was split across workers
+    return "validator" if worker_index == 0 else f"validator_{worker_index}"
+
+
+# aligned and cropped images -> validation results of single frames
 class StickerValidatorProcess(Process, ContextManagement):
-    def __init__(self, image_queue: Queue, validation_results_queue: Queue, websocket_queue: Queue,
-                 validator: StickerValidator, pipe_connection):
+    def __init__(self, image_queue: BoundedQueue, validated_queue: BoundedQueue, validator: StickerValidator,
+                 pipe_connection, frame_counter, worker_index: int = 0):
         Process.__init__(self, daemon=True)
         self.validator = validator
         self.__input_queue = image_queue
-        self.__results_queue = validation_results_queue
-        self.__ws_queue = websocket_queue
+        self.__validated_queue = validated_queue
+        self.__frame_counter = frame_counter
         self.__pipe = pipe_connection
-        self.process_name = "validator"
+        self.process_name = validator_process_name(worker_index)
 
     def get_context(self) -> dict:
         """Return current process context for saving"""
         return {
-            "last_processed_acc_number": self.validator._StickerValidator__last_processed_acc_number,
             "validation_parameters": self.validator.get_parameters()
         }
 
     def restore_context(self, context: dict):
         """Restore process context from saved state"""
-        if "last_processed_acc_number" in context:
-            self.validator._StickerValidator__last_processed_acc_number = context["last_processed_acc_number"]
         if "validation_parameters" in context and context["validation_parameters"]:
             self.validator.set_parameters(context["validation_parameters"])
 
@@ -225,22 +296,44 @@ class StickerValidatorProcess(Process, ContextManagement):
     def __handle_ipc_message(self, message: IPCMessage):
         if message.message_type == IPCMessageType.GET_CONTEXT:
             context = self.get_context()
-            self.__pipe.send(IPCMessage.create_context_response("validator", context))
+            self.__pipe.send(IPCMessage.create_context_response(self.process_name, context))
 
         elif message.message_type == IPCMessageType.PARAMS:
             if message.content["action"] == "get":
                 params = self.get_validator_parameters()
-                self.__pipe.send(IPCMessage(IPCMessageType.PARAMS, "validator", params.to_dict()))
+                self.__pipe.send(IPCMessage(IPCMessageType.PARAMS, self.process_name, params.to_dict()))
 
             elif message.content["action"] == "set":
                 params_dict = message.content["params"]
                 sticker_params = StickerValidationParams.from_dict(params_dict)
                 self.set_validator_parameters(sticker_params)
-                self.__pipe.send(IPCMessage(IPCMessageType.PARAMS, "validator", {"status": "success"}))
+                self.__pipe.send(IPCMessage(IPCMessageType.PARAMS, self.process_name, {"status": "success"}))
+
+        elif message.message_type == IPCMessageType.SETTINGS:
+            # the validator reads tolerances through get_settings, the saved file is reloaded on the next frame
+            invalidate_settings()
+            self.__pipe.send(IPCMessage(IPCMessageType.SETTINGS, self.process_name, {"status": "success"}))
 
         elif message.message_type == IPCMessageType.STOP:
             raise InterruptedError("Stop command received")
 
+    def __take_frame(self) -> tuple[int, DetectionContext | None]:
+        """
+        Take next frame and number it. Taking and numbering happen under one lock shared by all workers,
+        so frame indices follow the queue order and the aggregator can restore it.
+        """
+        lock = self.__frame_counter.get_lock()
+        if not lock.acquire(timeout=1):
+            raise Empty
+        try:
+            context = self.__input_queue.get(timeout=1)
+            frame_index = self.__frame_counter.value
+            if context is not None:
+                self.__frame_counter.value += 1
+            return frame_index, context
+        finally:
+            lock.release()
+
     def run(self):
         logger.info(f"{self.name} starting")
 
@@ -254,22 +347,99 @@ class StickerValidatorProcess(Process, ContextManagement):
                         continue
 
                 try:
-                    context = self.__input_queue.get(timeout=1)
+                    frame_index, context = self.__take_frame()
+                except Empty:
+                    continue
+
+                if context is None:
+                    # pass the stop sentinel on to other workers
+                    self.__input_queue.put(None)
+                    raise InterruptedError
+
+                try:
+                    context = self.validator.validate_frame(context)
+                    self.__validated_queue.put((frame_index, context.validation_results))
+                except Exception:
+                    # the aggregator waits for every frame index, so failed frames are reported too
+                    self.__validated_queue.put((frame_index, None))
+                    raise
+            except (KeyboardInterrupt, InterruptedError):
+                logger.info(f"{self.name} exiting")
+                return
+            except Exception as e:
+                logger.error(f"{self.name} exception: ", e)
 
-                    if context is None:
-                        raise InterruptedError
 
-                    _ = self.validator.validate(context)
-                except Empty:
-                    self.validator.process_combined_validation()
+# validation results of single frames -> validation results for prop
+class ValidationAggregatorProcess(Process, ContextManagement):
+    def __init__(self, validated_queue: BoundedQueue, validation_results_queue: BoundedQueue,
+                 websocket_queue: BoundedQueue, frame_counter, pipe_connection, frame_timeout: float = 5.0,
+                 stream_demand: StreamDemand | None = None):
+        Process.__init__(self, daemon=True)
+        self.__stream_demand = stream_demand
+        self.__validated_queue = validated_queue
+        self.__results_queue = validation_results_queue
+        self.__ws_queue = websocket_queue
+        self.__frame_counter = frame_counter
+        self.__pipe = pipe_connection
+        self.process_name = "aggregator"
+        self.aggregator = ValidationAggregator(frame_timeout)
+
+    def get_context(self) -> dict:
+        """Return current process context for saving"""
+        return {
+            "last_processed_acc_number": self.aggregator.last_processed_acc_number,
+        }
+
+    def restore_context(self, context: dict):
+        """Restore process context from saved state"""
+        if "last_processed_acc_number" in context:
+            self.aggregator.last_processed_acc_number = context["last_processed_acc_number"]
+
+    def __handle_ipc_message(self, message: IPCMessage):
+        if message.message_type == IPCMessageType.GET_CONTEXT:
+            context = self.get_context()
+            self.__pipe.send(IPCMessage.create_context_response(self.process_name, context))
+
+        elif message.message_type == IPCMessageType.SETTINGS:
+            settings = Settings.from_dict(message.content)
+            self.aggregator.frame_timeout = settings.processing.validation_frame_timeout
+            self.__pipe.send(IPCMessage(IPCMessageType.SETTINGS, self.process_name, {"status": "success"}))
+
+        elif message.message_type == IPCMessageType.STOP:
+            raise InterruptedError("Stop command received")
+
+    def __emit(self, combined_results: list[StickerValidationResult]):
+        for combined_result in combined_results:
+            self.__results_queue.put(combined_result)
+            if is_streamed(self.__stream_demand, StreamingMessageType.VALIDATION):
+                self.__ws_queue.put(StreamingMessage(StreamingMessageType.VALIDATION,
+                                                     ValidationStreamingMessageContent(combined_result),
+                                                     combined_result.seq_number))
+
+    def run(self):
+        logger.info(f"{self.name} starting")
+
+        while True:
+            try:
+                if self.__pipe.poll():
+                    ipc_message = self.__pipe.recv()
+                    if isinstance(ipc_message, IPCMessage) and ipc_message.recipient == self.process_name:
+                        self.__handle_ipc_message(ipc_message)
+                        continue
 
                 try:
-                    combined_result = combined_validation_results.get_nowait()
-                    self.__results_queue.put_nowait(combined_result)
-                    self.__ws_queue.put_nowait(StreamingMessage(StreamingMessageType.VALIDATION,
-                                                                ValidationStreamingMessageContent(combined_result)))
+                    item = self.__validated_queue.get(timeout=1)
+
+                    if item is None:
+                        raise InterruptedError
+
+                    self.__emit(self.aggregator.add(*item))
                 except Empty:
-                    pass
+                    self.__emit(self.aggregator.expire())
+                    # same as a single validator: combine the accumulator once nothing is left to validate
+                    if self.aggregator.next_frame_index == self.__frame_counter.value:
+                        self.__emit(self.aggregator.flush())
             except (KeyboardInterrupt, InterruptedError):
                 logger.info(f"{self.name} exiting")
                 return
@@ -277,61 +447,175 @@ class StickerValidatorProcess(Process, ContextManagement):
                 logger.error(f"{self.name} exception: ", e)
 
 
+def encode_log_image(image) -> tuple[str, bytes]:
+    """PNG of the image and its sha256, images are stored once per hash"""
+    import cv2
+    import hashlib
+
+    _, encoded_img = cv2.imencode('.png', image)
+    data = encoded_img.tobytes()
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def validation_log_row(validation_results: StickerValidationResult, image_hash: str | None) -> dict:
+    return dict(
+        timestamp=validation_results.detected_at,
+        seq_number=validation_results.seq_number,
+        sticker_present=validation_results.sticker_present,
+        sticker_matches_design=validation_results.sticker_matches_design,
+        image_hash=image_hash,
+        sticker_position_x=validation_results.sticker_position[
+            0] if validation_results.sticker_position else None,
+        sticker_position_y=validation_results.sticker_position[
+            1] if validation_results.sticker_position else None,
+        sticker_size_width=validation_results.sticker_size[
+            0] if validation_results.sticker_size else None,
+        sticker_size_height=validation_results.sticker_size[
+            1] if validation_results.sticker_size else None,
+        sticker_rotation=validation_results.sticker_rotation
+    )
+
+
 class ValidationResultsLogger(Process):
-    def __init__(self, results_queue: Queue):
+    """
+    Writes validation results to the database in batches: rows are inserted with one statement and one commit
+    when batch_size results are collected or flush_interval seconds passed since the first of them.
+    Images are PNG encoded on a thread pool while the batch is collected.
+    Statistics rollups are updated in the same transaction as the rows.
+    Rows are kept until their commit succeeds, and the batch is written before the process exits.
+    A batch failing LOG_FLUSH_RETRIES times is written row by row and the failing rows are dropped, so one bad row
+    does not hold back the rows after it. At most LOG_PENDING_BATCHES batches are kept, the oldest rows are dropped.
+    """
+
+    def __init__(self, results_queue: BoundedQueue, batch_size: int = 50, flush_interval: float = 1.0):
         Process.__init__(self, daemon=True)
         self.__results_queue = results_queue
+        self.batch_size = max(batch_size, 1)
+        self.max_pending = self.batch_size * LOG_PENDING_BATCHES
+        self.flush_interval = flush_interval
         self.session = None
+        self.dropped = 0
+        self.__encoder: ThreadPoolExecutor | None = None
+        self.__pending: list[tuple[StickerValidationResult, Future | None]] = []
+        self.__first_pending_at: float = 0
+        self.__failed_flushes = 0
 
     def initialize_db(self):
         from backend.db import get_db_session
         self.session = get_db_session()
 
+    def add(self, validation_results: StickerValidationResult):
+        acc_image = None
+        if (validation_results.sticker_present is False or validation_results.sticker_matches_design is False) and validation_results.sticker_image is not None:
+            acc_image = self.__encoder.submit(encode_log_image, validation_results.sticker_image)
+
+        if not self.__pending:
+            self.__first_pending_at = time.monotonic()
+        if len(self.__pending) >= self.max_pending:
+            self.__pending.pop(0)
+            self.__drop()
+        self.__pending.append((validation_results, acc_image))
+
+    def __drop(self):
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            logger.error(f"{self.name} dropped {self.dropped} validation logs so far")
+
+    @staticmethod
+    def __block_terminate():
+        # SIGTERM must reach the main thread, otherwise it is handled only when the blocking get returns
+        if hasattr(signal, "pthread_sigmask"):
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+
+    @staticmethod
+    def __on_terminate(signum, frame):
+        # second SIGTERM kills the process if writing the last batch hangs
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # not InterruptedError: selectors swallow it, so a blocking get would never return
+        raise SystemExit("Terminated")
+
+    def __flush_due_in(self) -> float | None:
+        if not self.__pending:
+            return None
+        return max(self.__first_pending_at + self.flush_interval - time.monotonic(), 0)
+
+    def __write(self, pending: list[tuple[StickerValidationResult, Future | None]]):
+        from sqlalchemy import insert
+        from backend.db import store_images, update_stats_rollups
+        from model.model import ValidationLog
+
+        images = dict(acc_image.result() for _, acc_image in pending if acc_image)
+        rows = [validation_log_row(validation_results, acc_image.result()[0] if acc_image else None)
+                for validation_results, acc_image in pending]
+        store_images(self.session, images)
+        self.session.execute(insert(ValidationLog), rows)
+        update_stats_rollups(self.session, rows)
+        self.session.commit()
+
+    def flush(self):
+        if not self.__pending:
+            return
+
+        try:
+            self.__write(self.__pending)
+            self.__pending = []
+            self.__failed_flushes = 0
+            return
+        except Exception as e:
+            self.session.rollback()
+            self.__failed_flushes += 1
+            if self.__failed_flushes < LOG_FLUSH_RETRIES:
+                # rows stay pending and are written with the next flush
+                logger.error(f"{self.name} failed to write {len(self.__pending)} validation logs: {str(e)}")
+                self.__first_pending_at = time.monotonic()
+                return
+            logger.error(f"{self.name} failed to write {len(self.__pending)} validation logs "
+                         f"{self.__failed_flushes} times, writing them one by one: {str(e)}")
+
+        for entry in self.__pending:
+            try:
+                self.__write([entry])
+            except Exception as e:
+                self.session.rollback()
+                logger.error(f"{self.name} dropped validation log #{entry[0].seq_number}: {str(e)}")
+                self.__drop()
+        self.__pending = []
+        self.__failed_flushes = 0
+
     def run(self):
         logger.info(f"{self.name} starting")
+        # restart terminates processes, results collected so far are written before exit
+        signal.signal(signal.SIGTERM, self.__on_terminate)
+        self.__encoder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="log_image_encoder",
+                                            initializer=self.__block_terminate)
         self.initialize_db()
 
         while True:
             try:
-                validation_results = self.__results_queue.get()
+                try:
+                    timeout = self.__flush_due_in()
+                    validation_results = self.__results_queue.get(timeout=timeout if timeout is not None else 1)
+                except Empty:
+                    if self.__flush_due_in() == 0:
+                        self.flush()
+                    continue
+
                 # logger.info("get context from results queue: %s", context)
                 if validation_results is None:
                     raise InterruptedError
 
-                if validation_results is not None:
-                    from model.model import ValidationLog
-                    import cv2
-                    import base64
-
-                    acc_image_base64 = None
-                    if (validation_results.sticker_present is False or validation_results.sticker_matches_design is False) and validation_results.sticker_image is not None:
-                        _, encoded_img = cv2.imencode('.png', validation_results.sticker_image)
-                        acc_image_base64 = base64.b64encode(encoded_img.tobytes()).decode('utf-8')
-
-                    validation_log = ValidationLog(
-                        timestamp=validation_results.detected_at,
-                        seq_number=validation_results.seq_number,
-                        sticker_present=validation_results.sticker_present,
-                        sticker_matches_design=validation_results.sticker_matches_design,
-                        acc_image=acc_image_base64,
-                        sticker_position_x=validation_results.sticker_position[
-                            0] if validation_results.sticker_position else None,
-                        sticker_position_y=validation_results.sticker_position[
-                            1] if validation_results.sticker_position else None,
-                        sticker_size_width=validation_results.sticker_size[
-                            0] if validation_results.sticker_size else None,
-                        sticker_size_height=validation_results.sticker_size[
-                            1] if validation_results.sticker_size else None,
-                        sticker_rotation=validation_results.sticker_rotation
-                    )
-
-                    self.session.add(validation_log)
-                    self.session.commit()
+                self.add(validation_results)
+                if len(self.__pending) >= self.batch_size or self.__flush_due_in() == 0:
+                    self.flush()
 
-            except (KeyboardInterrupt, InterruptedError):
+            except (KeyboardInterrupt, InterruptedError, SystemExit):
                 logger.info(f"{self.name} exiting")
                 if self.session:
+                    # the batch may have been interrupted in the middle of a commit
+                    self.session.rollback()
+                    self.flush()
                     self.session.close()
+                self.__encoder.shutdown()
                 return
             except Exception as e:
                 logger.error(f"{self.name} exception: {str(e)}")
@@ -0,0 +1,89 @@
+import unittest
+from queue import Full
+from unittest import mock
+
+from utils.bounded_queue import BoundedQueue, BLOCK, DROP_OLDEST, DROP_NEWEST
+
+
+def drain(queue: BoundedQueue, count: int) -> list:
+    return [queue.get(timeout=1) for _ in range(count)]
+
+
+class BoundedQueueTest(unittest.TestCase):
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            BoundedQueue("queue", 2, "drop_random")
+
+    def test_block(self):
+        queue = BoundedQueue("queue", 2, BLOCK)
+        queue.put(1)
+        queue.put(2)
+        with self.assertRaises(Full):
+            queue.put(3, timeout=0.1)
+        self.assertEqual(queue.qsize(), 2)
+
+        self.assertEqual(drain(queue, 2), [1, 2])
+        self.assertEqual(queue.stats()["Dropped"], 0)
+        self.assertEqual(queue.stats()["HighWaterMark"], 2)
+
+    def test_drop_newest(self):
+        queue = BoundedQueue("queue", 2, DROP_NEWEST)
+        for item in range(5):
+            queue.put(item)
+
+        self.assertEqual(drain(queue, 2), [0, 1])
+        self.assertTrue(queue.empty())
+        stats = queue.stats()
+        self.assertEqual((stats["Size"], stats["Dropped"], stats["HighWaterMark"]), (0, 3, 2))
+
+    def test_drop_oldest(self):
+        queue = BoundedQueue("queue", 2, DROP_OLDEST)
+        # the queue is full before its feeder thread flushed, so the first drops also wait for it
+        for item in range(5):
+            queue.put(item)
+
+        self.assertEqual(drain(queue, 2), [3, 4])
+        self.assertTrue(queue.empty())
+        stats = queue.stats()
+        self.assertEqual((stats["Size"], stats["Dropped"], stats["HighWaterMark"]), (0, 3, 2))
+
+    def test_stop_sentinel_put(self):
+        for policy in [BLOCK, DROP_OLDEST, DROP_NEWEST]:
+            queue = BoundedQueue("queue", 2, policy)
+            queue.put(1)
+            queue.put(2)
+            queue.put(None)
+            self.assertEqual(drain(queue, 2), [2, None])
+
+    def test_stop_sentinel_queued(self):
+        queue = BoundedQueue("queue", 2, DROP_OLDEST)
+        queue.put(None)
+        queue.put(1)
+        queue.put(2)
+
+        self.assertEqual(drain(queue, 2), [1, None])
+        self.assertEqual(queue.stats()["Dropped"], 1)
+        self.assertEqual(queue.qsize(), 0)
+
+
+    def test_consumer_takes_item_before_put_returns(self):
+        for policy in [BLOCK, DROP_OLDEST, DROP_NEWEST]:
+            queue = BoundedQueue("queue", 2, policy)
+            inner = queue._BoundedQueue__queue
+            put, consumed = inner.put, []
+
+            def put_and_consume(item, *args, **kwargs):
+                put(item, *args, **kwargs)
+                consumed.append(queue.get(timeout=1))
+
+            with mock.patch.object(inner, "put", put_and_consume):
+                for item in range(3):
+                    queue.put(item)
+
+            self.assertEqual(consumed, [0, 1, 2])
+            stats = queue.stats()
+            self.assertEqual((stats["Size"], stats["Dropped"], stats["HighWaterMark"]), (0, 0, 1), policy)
+
+
+if __name__ == "__main__":
+    unittest.main()
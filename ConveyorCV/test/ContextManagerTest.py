@@ -0,0 +1,38 @@
+import threading
+import unittest
+from multiprocessing import Pipe
+
+from backend.context_manager import ContextManager
+from model.model import IPCMessage, IPCMessageType
+
+
+def acknowledge(pipe):
+    """Answers a settings message like a pipeline process"""
+    message = pipe.recv()
+    pipe.send(IPCMessage(IPCMessageType.SETTINGS, message.recipient, {"success": True}))
+
+
+class ContextManagerTest(unittest.TestCase):
+    def test_apply_settings(self):
+        manager = ContextManager()
+        pipes = {}
+        for name in ["detector", "processor", "silent", "closed"]:
+            manager_end, pipes[name] = Pipe()
+            manager.register_process(name, manager_end)
+            if name == "closed":
+                manager_end.close()
+
+        threads = [threading.Thread(target=acknowledge, args=(pipes[name],)) for name in ["detector", "processor"]]
+        for thread in threads:
+            thread.start()
+        failed = manager.apply_settings({"Processing": {"Fps": 10}}, timeout=0.5)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(failed), ["closed", "silent"])
+        message = pipes["silent"].recv()
+        self.assertEqual((message.message_type, message.content), (IPCMessageType.SETTINGS, {"Processing": {"Fps": 10}}))
+
+
+if __name__ == "__main__":
+    unittest.main()
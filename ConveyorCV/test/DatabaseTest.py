@@ -0,0 +1,251 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from sqlalchemy import insert
+
+import backend.db as db
+from backend.settings import Settings
+from model.model import ValidationLog, ValidationImage, STATS_ROLLUPS
+
+
+class DatabaseTest(unittest.TestCase):
+    """Runs against a temporary SQLite database, the process-wide engine is pointed at it"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        settings = Settings(database_url=f"sqlite:///{os.path.join(self.directory.name, 'logs.db')}")
+        self.settings_patch = mock.patch("backend.db.get_settings", return_value=settings)
+        self.settings_patch.start()
+        self.session = db.get_db_session()
+
+    def tearDown(self):
+        self.session.close()
+        db.get_engine().dispose()
+        self.settings_patch.stop()
+        self.directory.cleanup()
+
+    def add_logs(self, count: int, start: datetime = datetime(2024, 1, 1), **columns):
+        # three logs per second, so pages have to break ties of equal timestamps by id
+        self.session.execute(insert(ValidationLog), [
+            dict(timestamp=start + timedelta(seconds=i // 3), seq_number=i, sticker_present=True,
+                 sticker_matches_design=True, **columns)
+            for i in range(count)
+        ])
+        self.session.commit()
+
+    def test_store_images(self):
+        db.store_images(self.session, {"a": b"first", "b": b"second"})
+        self.session.commit()
+        # stored images are not inserted again
+        db.store_images(self.session, {"a": b"first", "c": b"third"})
+        self.session.commit()
+        self.assertEqual(sorted(h for (h,) in self.session.query(ValidationImage.hash)), ["a", "b", "c"])
+
+    def test_delete_unreferenced_images(self):
+        db.store_images(self.session, {"a": b"first", "b": b"second"})
+        self.add_logs(1, image_hash="a")
+
+        db.delete_unreferenced_images(self.session, {"a", "b"})
+        self.session.commit()
+        self.assertEqual([h for (h,) in self.session.query(ValidationImage.hash)], ["a"])
+
+    def test_delete_log_with_shared_image(self):
+        db.store_images(self.session, {"a": b"image"})
+        self.add_logs(2, image_hash="a")
+        first_id, second_id = [log_id for (log_id,) in self.session.query(ValidationLog.id).order_by(ValidationLog.id)]
+
+        self.assertTrue(db.delete_validation_log_by_id(first_id)["success"])
+        # the other log still references the image
+        self.assertEqual(db.get_validation_log_image(second_id), b"image")
+        self.assertIsNone(db.get_validation_log_image(first_id))
+
+        self.assertTrue(db.delete_validation_log_by_id(second_id)["success"])
+        self.assertEqual(self.session.query(ValidationImage).count(), 0)
+
+    def test_cursor_walk(self):
+        self.add_logs(3000)
+        ids, timestamps, cursor = [], [], None
+        while True:
+            page = ValidationLog.paginate(self.session, page_size=137, cursor=cursor, total="none")
+            ids += [log["Id"] for log in page["Logs"]]
+            timestamps += [log["Timestamp"] for log in page["Logs"]]
+            cursor = page["NextCursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(len(ids), 3000)
+        self.assertEqual(len(set(ids)), 3000)
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+
+    def test_cursor_walk_date_range(self):
+        self.add_logs(300)
+        start, end = datetime(2024, 1, 1, 0, 0, 10), datetime(2024, 1, 1, 0, 0, 40)
+        offset_ids = [log["Id"] for log in ValidationLog.paginate(self.session, start, end, page_size=1000)["Logs"]]
+
+        ids, cursor = [], None
+        while True:
+            page = ValidationLog.paginate(self.session, start, end, page_size=7, cursor=cursor)
+            self.assertEqual(page["Total"], 93)
+            ids += [log["Id"] for log in page["Logs"]]
+            cursor = page["NextCursor"]
+            if cursor is None:
+                break
+        self.assertEqual(ids, offset_ids)
+
+    def test_malformed_cursor(self):
+        self.add_logs(10)
+        for cursor in ["not base64!", "bm8gc2VwYXJhdG9y", ValidationLog.encode_cursor(datetime(2024, 1, 1), 1)[:-4]]:
+            with self.assertRaises(ValueError):
+                ValidationLog.paginate(self.session, cursor=cursor)
+
+        cursor = ValidationLog.encode_cursor(datetime(2024, 1, 1, 0, 0, 1), 5)
+        self.assertEqual(ValidationLog.decode_cursor(cursor), (datetime(2024, 1, 1, 0, 0, 1), 5))
+
+    def test_approximate_count(self):
+        self.add_logs(300)
+        start, end = datetime(2024, 1, 1, 0, 0, 10), datetime(2024, 1, 1, 0, 0, 40)
+        self.assertEqual(ValidationLog.approximate_count(self.session), 300)
+        self.assertEqual(ValidationLog.approximate_count(self.session, start, end), 93)
+        self.assertEqual(ValidationLog.approximate_count(self.session, datetime(2025, 1, 1)), 0)
+
+        # deleted logs inside the range are still counted
+        self.session.query(ValidationLog).filter(ValidationLog.seq_number == 50).delete()
+        self.session.commit()
+        self.assertEqual(ValidationLog.paginate(self.session, start, end, total="exact")["Total"], 92)
+        self.assertEqual(ValidationLog.paginate(self.session, start, end, total="approximate")["Total"], 93)
+
+    def add_random_logs(self, count: int, seed: int = 0) -> list[dict]:
+        rng = random.Random(seed)
+        start = datetime(2024, 1, 1)
+        logs = [dict(timestamp=start + timedelta(seconds=rng.uniform(0, 3 * 24 * 3600)), seq_number=i,
+                     sticker_present=rng.random() > 0.2, sticker_matches_design=rng.choice([True, False, None]))
+                for i in range(count)]
+        self.session.execute(insert(ValidationLog), logs)
+        db.update_stats_rollups(self.session, logs)
+        self.session.commit()
+        return logs
+
+    def test_stats_match_brute_force(self):
+        logs = self.add_random_logs(5000)
+        rng = random.Random(1)
+
+        def random_time():
+            if rng.random() < 0.1:
+                return None
+            # whole hours and minutes often, so ranges align with rollup buckets
+            unit = rng.choice([3600, 60, 1, 0.001])
+            return datetime(2024, 1, 1) + timedelta(seconds=unit * rng.randint(0, int(3 * 24 * 3600 / unit)))
+
+        for _ in range(300):
+            start, end = random_time(), random_time()
+            if start is not None and end is not None and start > end:
+                start, end = end, start
+            selected = [log for log in logs
+                        if (start is None or log["timestamp"] >= start) and (end is None or log["timestamp"] <= end)]
+            expected = db.counts_to_dict(
+                len(selected),
+                sum(not log["sticker_present"] for log in selected),
+                sum(log["sticker_present"] and log["sticker_matches_design"] is False for log in selected))
+
+            stats = db.get_validation_stats(start, end)
+            self.assertEqual({key: stats[key] for key in expected}, expected, (start, end))
+
+    def test_stats_buckets_match_brute_force(self):
+        logs = self.add_random_logs(2000)
+        start, end = datetime(2024, 1, 1, 5, 17, 23), datetime(2024, 1, 2, 19, 3, 1)
+        for bucket, size in [("minute", timedelta(minutes=1)), ("hour", timedelta(hours=1)),
+                             ("shift", timedelta(hours=8)), ("day", timedelta(days=1))]:
+            expected = {}
+            for log in logs:
+                if start <= log["timestamp"] <= end:
+                    bucket_start = datetime.min + (log["timestamp"] - datetime.min) // size * size
+                    expected[bucket_start] = expected.get(bucket_start, 0) + 1
+
+            stats = db.get_validation_stats(start, end, bucket)
+            self.assertEqual({b["Start"]: b["TotalCount"] for b in stats["Buckets"]}, expected, bucket)
+
+    def test_stats_aware_dates(self):
+        self.add_random_logs(500)
+        start, end = datetime(2024, 1, 1, 10, 30), datetime(2024, 1, 2, 7, 15)
+        expected = db.get_validation_stats(start, end, "hour")
+
+        # the same instants with an offset, stored timestamps are naive local time
+        offset = timezone(timedelta(hours=3, minutes=30))
+        stats = db.get_validation_stats(start.astimezone(offset), end.astimezone(offset), "hour")
+        self.assertEqual(stats["TotalCount"], expected["TotalCount"])
+        self.assertEqual(stats["Buckets"], expected["Buckets"])
+
+    def test_stats_buckets_sqlite_only(self):
+        self.add_random_logs(100)
+        with mock.patch("backend.db.stats_rollups_enabled", return_value=False):
+            self.assertEqual(db.get_validation_stats()["TotalCount"], 100)
+            with self.assertRaises(ValueError):
+                db.get_validation_stats(bucket="hour")
+
+    def test_ensure_stats_rollups(self):
+        logs = self.add_random_logs(500)
+        expected = db.get_validation_stats()
+        for rollup in STATS_ROLLUPS:
+            self.session.query(rollup).delete()
+        self.session.commit()
+
+        # logs without rollups are filled once, at API startup
+        self.assertTrue(db.ensure_stats_rollups())
+        self.assertFalse(db.ensure_stats_rollups())
+        self.assertEqual(db.get_validation_stats(), expected)
+        self.assertEqual(sum(r.total_count for r in self.session.query(STATS_ROLLUPS[0])), len(logs))
+
+    def test_engine_reused(self):
+        engine = db.get_engine()
+        self.assertIs(db.get_engine(), engine)
+        session = db.get_db_session()
+        try:
+            self.assertIs(session.get_bind(), engine)
+        finally:
+            session.close()
+
+    def test_engine_per_process_and_settings(self):
+        engine = db.get_engine()
+
+        # a forked process does not use the engine of its parent, nor disposes it
+        with mock.patch("backend.db.os.getpid", return_value=os.getpid() + 1):
+            child_engine = db.get_engine()
+        self.assertIsNot(child_engine, engine)
+        child_engine.dispose()
+
+        settings = Settings(database_url=db.get_settings().database_url)
+        settings.database.busy_timeout = 1.5
+        with mock.patch("backend.db.get_settings", return_value=settings):
+            self.assertIsNot(db.get_engine(), engine)
+            self.assertIs(db.get_engine(), db.get_engine())
+
+    def test_sqlite_pragmas(self):
+        settings = Settings(database_url=db.get_settings().database_url)
+        settings.database.busy_timeout = 2.5
+        with mock.patch("backend.db.get_settings", return_value=settings):
+            # every pooled connection is configured, not only the first one
+            with db.get_engine().connect() as first, db.get_engine().connect() as second:
+                for connection in [first, second]:
+                    self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                    self.assertEqual(connection.exec_driver_sql("PRAGMA busy_timeout").scalar(), 2500)
+                    # NORMAL
+                    self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)
+
+    def test_schema_initialized_once(self):
+        with mock.patch.object(db, "_engine", None), mock.patch.object(db, "_engine_key", None), \
+                mock.patch.object(db, "_session_factory", None), \
+                mock.patch("backend.db.init_schema", wraps=db.init_schema) as init:
+            engine = db.get_engine()
+            for _ in range(3):
+                db.get_db_session().close()
+                db.get_engine()
+            engine.dispose()
+        init.assert_called_once_with(engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import pickle
+import unittest
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from model.model import DetectionContext
+from utils.frame_ring import FrameRing
+
+WIDTH, HEIGHT = 64, 48
+
+
+def make_context(value: int) -> DetectionContext:
+    context = DetectionContext(image=np.full((HEIGHT, WIDTH, 3), value, np.uint8))
+    context.shape = np.full((HEIGHT, WIDTH), value + 1, np.uint8)
+    return context
+
+
+class FrameRingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRing(WIDTH, HEIGHT, slots=3)
+        # what a downstream process gets when the ring is passed to it
+        self.reader = pickle.loads(pickle.dumps(self.ring))
+
+    def tearDown(self):
+        self.reader.close()
+        self.ring.close()
+
+    def test_round_trip(self):
+        context = self.ring.put(make_context(10))
+        self.assertIsNone(context.image)
+        self.assertIsNone(context.shape)
+        self.assertIsNotNone(context.frame_slot)
+
+        context = pickle.loads(pickle.dumps(context))
+        self.assertTrue(self.reader.materialize(context))
+        self.assertIsNone(context.frame_slot)
+        np.testing.assert_array_equal(context.image, make_context(10).image)
+        np.testing.assert_array_equal(context.shape, make_context(10).shape)
+
+        # materialized frames are copies, reusing the slot does not change them
+        for value in range(3):
+            self.ring.put(make_context(value))
+        np.testing.assert_array_equal(context.image, make_context(10).image)
+
+    def test_not_fitting_context(self):
+        context = DetectionContext(image=np.zeros((HEIGHT, WIDTH + 1, 3), np.uint8))
+        context.shape = np.zeros((HEIGHT, WIDTH + 1), np.uint8)
+        self.assertIs(self.ring.put(context), context)
+        self.assertIsNone(context.frame_slot)
+        self.assertIsNotNone(context.image)
+        self.assertTrue(self.reader.materialize(context))
+
+    def test_stale_generation(self):
+        contexts = [self.ring.put(make_context(value)) for value in range(4)]
+        # four frames in three slots: the first slot is reused by the last frame
+        self.assertEqual(contexts[0].frame_slot, contexts[3].frame_slot)
+        self.assertFalse(self.reader.is_current(contexts[0]))
+        self.assertFalse(self.reader.attach(contexts[0]))
+        self.assertFalse(self.reader.materialize(contexts[0]))
+
+        for value, context in enumerate(contexts[1:], start=1):
+            self.assertTrue(self.reader.attach(context))
+            np.testing.assert_array_equal(context.image, make_context(value).image)
+
+    def test_detach(self):
+        context = self.ring.put(make_context(1))
+        self.assertTrue(self.reader.attach(context))
+        self.assertTrue(self.reader.detach(context))
+        self.assertIsNone(context.image)
+        self.assertIsNone(context.shape)
+        self.assertIsNone(context.frame_slot)
+
+        # the slot is overwritten while the context is attached
+        context = self.ring.put(make_context(2))
+        self.assertTrue(self.reader.attach(context))
+        for value in range(3):
+            self.ring.put(make_context(value))
+        self.assertFalse(self.reader.detach(context))
+
+    def test_close_releases_memory(self):
+        ring = FrameRing(WIDTH, HEIGHT, slots=2)
+        name = ring._FrameRing__shm.name
+        reader = pickle.loads(pickle.dumps(ring))
+
+        # closing an attached ring keeps the memory for the owner
+        reader.close()
+        shared_memory.SharedMemory(name=name).close()
+
+        ring.close()
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import cv2
+
+from algorithms.InvariantTM import invariant_match_template, suppress_redundant, TemplateBank
+
+
+class InvariantTMTest(unittest.TestCase):
+    template = cv2.cvtColor(cv2.imread("data/sticker_fixed.png"), cv2.COLOR_BGR2RGB)
+    bank: TemplateBank = TemplateBank(template, rot_range=[-10, 10], rot_interval=1, scale_range=[10, 25], scale_interval=4)
+
+    def match(self, obj: str, minmax: bool = True, **kwargs):
+        img = cv2.imread(obj)
+        self.assertFalse(img is None)
+
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return invariant_match_template(rgbimage=img, rgbtemplate=self.template, method="TM_CCORR_NORMED",
+                                        matched_thresh=0.5 if minmax else 0.93, rot_range=[-10, 10], rot_interval=1,
+                                        scale_range=[10, 25], scale_interval=4, rm_redundant=True, minmax=minmax,
+                                        **kwargs)
+
+    def test_template_bank_same_results(self):
+        for obj in ["data/test_acc1.png", "data/test_acc1_10deg.png", "data/test_acc2.png"]:
+            for minmax in [True, False]:
+                self.assertEqual(self.match(obj, minmax), self.match(obj, minmax, template_bank=self.bank))
+
+    def test_pyramid_search_same_best_match(self):
+        for obj in ["data/test_acc1.png", "data/test_acc1_10deg.png", "data/test_acc2.png", "data/test_acc3.png"]:
+            exhaustive = self.match(obj, template_bank=self.bank)
+            pyramid = self.match(obj, template_bank=self.bank, pyramid_levels=2)
+            self.assertEqual(exhaustive[0][:3], pyramid[0][:3])
+            self.assertAlmostEqual(exhaustive[0][3], pyramid[0][3], places=4)
+
+    def test_pyramid_search_oversized_scale(self):
+        # scales above the image size are clamped, SQDIFF and CCOEFF scores are not bounded below by 0
+        img = cv2.cvtColor(cv2.imread("data/test_acc1.png"), cv2.COLOR_BGR2RGB)
+        for method, thresh in [("TM_SQDIFF_NORMED", 1.0), ("TM_CCOEFF_NORMED", -1.0)]:
+            kwargs = dict(rgbimage=img, rgbtemplate=self.template, method=method, matched_thresh=thresh,
+                          rot_range=[-10, 10], rot_interval=5, scale_range=[10, 400], scale_interval=30,
+                          rm_redundant=True, minmax=True)
+            exhaustive = invariant_match_template(**kwargs)
+            pyramid = invariant_match_template(**kwargs, pyramid_levels=2, coarse_candidates=40)
+            self.assertTrue(pyramid)
+            self.assertEqual(exhaustive[0][1:3], pyramid[0][1:3])
+
+    def test_workers_same_results(self):
+        for minmax in [True, False]:
+            self.assertEqual(self.match("data/test_acc1.png", minmax, template_bank=self.bank),
+                             self.match("data/test_acc1.png", minmax, template_bank=self.bank, workers=4))
+        self.assertEqual(self.match("data/test_acc2.png", template_bank=self.bank, pyramid_levels=2),
+                         self.match("data/test_acc2.png", template_bank=self.bank, pyramid_levels=2, workers=4))
+
+    def test_suppress_redundant(self):
+        points = [[(100, 100), 0, 10, 0.9], [(105, 102), 1, 10, 0.8], [(150, 100), 0, 20, 0.7],
+                  [(125, 100), 0, 10, 0.6], [(100, 130), 0, 10, 0.5]]
+        # template 30x20 at 10% is 3x2 px, at 20% 6x4 px
+        self.assertEqual(suppress_redundant(points, 30, 20), points)
+        # template 300x200 at 10% is 30x20 px, at 20% 60x40 px
+        self.assertEqual(suppress_redundant(points, 300, 200), [points[0], points[4]])
+        self.assertEqual(suppress_redundant([], 300, 200), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
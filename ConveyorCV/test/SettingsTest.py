@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pydantic import ValidationError
+
+import backend.settings as settings_module
+from backend.settings import (Settings, is_hot_setting, settings_requiring_restart, get_settings, invalidate_settings,
+                              save_settings, SETTINGS_CHECK_INTERVAL)
+
+
+class SettingsTest(unittest.TestCase):
+    def test_round_trip(self):
+        settings = Settings()
+        settings.queues.shape_queue_policy = "block"
+        settings.processing.validation_frame_timeout = 2.5
+        self.assertEqual(Settings.from_dict(settings.to_dict()), settings)
+
+    def test_queue_policy(self):
+        settings = Settings.from_dict({"Queues": {"ShapeQueuePolicy": "drop_newest"}})
+        self.assertEqual(settings.queues.shape_queue_policy, "drop_newest")
+
+        with self.assertRaises(ValidationError):
+            Settings.from_dict({"Queues": {"ShapeQueuePolicy": "drop_olderst"}})
+
+    def test_detection_mode(self):
+        settings = Settings.from_dict({"Detection": {"DetectionMode": "fast", "FastDetectionScale": 0.25}})
+        self.assertEqual((settings.detection.detection_mode, settings.detection.fast_detection_scale), ("fast", 0.25))
+        self.assertEqual(Settings.from_dict({"Detection": {"FastDetectionScale": 1}}).detection.fast_detection_scale, 1)
+
+        for detection in [{"DetectionMode": "fastest"}, {"FastDetectionScale": 0}, {"FastDetectionScale": -0.5},
+                          {"FastDetectionScale": 1.5}]:
+            with self.assertRaises(ValidationError):
+                Settings.from_dict({"Detection": detection})
+
+    def test_is_hot_setting(self):
+        for name in ["bg_photo_path", "detection.detection_mode", "detection.line_gate_coverage",
+                     "validation.roi_search", "processing.fps", "processing.match_workers",
+                     "processing.validation_frame_timeout",
+                     "queues.client_deadline_seconds"]:
+            self.assertTrue(is_hot_setting(name), name)
+
+        for name in ["camera_type", "database_url", "processing.frame_ring_slots", "processing.downscale_width",
+                     "queues.shape_queue_size", "database.pool_size", "camera.video_path",
+                     # prefixes match whole names and whole blocks only
+                     "bg_photo_path_backup", "processing.fps_limit", "detections.mode"]:
+            self.assertFalse(is_hot_setting(name), name)
+
+    def test_hot_settings_only(self):
+        old, new = Settings(), Settings()
+        self.assertEqual(settings_requiring_restart(old, new), [])
+
+        new.bg_photo_path = "data/other.png"
+        new.detection.detection_line_height = 0.4
+        new.validation.rotation_tolerance_degrees = 2
+        new.processing.fps = 10
+        new.queues.client_deadline_seconds = 1
+        self.assertEqual(settings_requiring_restart(old, new), [])
+
+    def test_mixed_settings(self):
+        old, new = Settings(), Settings()
+        new.detection.detection_line_height = 0.4
+        new.processing.fps = 10
+        new.processing.frame_ring_slots = 4
+        new.camera_type = "ip"
+        self.assertEqual(sorted(settings_requiring_restart(old, new)), ["camera_type", "processing.frame_ring_slots"])
+
+    def test_nested_blocks(self):
+        old = Settings()
+        new = Settings.from_dict({
+            "Queues": {"ShapeQueueSize": 2, "WebsocketQueuePolicy": "block", "ClientDeadlineSeconds": 1},
+            "Camera": {"VideoPath": "data/other.mp4"},
+            "Database": {"PoolSize": 2},
+        })
+        self.assertEqual(sorted(settings_requiring_restart(old, new)),
+                         ["camera.video_path", "database.pool_size", "queues.shape_queue_size",
+                          "queues.websocket_queue_policy"])
+
+
+class SettingsCacheTest(unittest.TestCase):
+    """get_settings against a temporary settings file, with a controlled clock"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, "settings", "app_settings.json")
+        self.now = 1000.0
+        self.mtime = 1000.0
+        for patch in [mock.patch.object(settings_module, "_settings_file", self.file_path),
+                      mock.patch.object(settings_module, "_settings", None),
+                      mock.patch.object(settings_module, "_settings_mtime", None),
+                      mock.patch.object(settings_module, "_settings_checked_at", 0.0),
+                      mock.patch("backend.settings.time.monotonic", side_effect=lambda: self.now)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def write_fps(self, fps: int, touch: bool = True):
+        """Write settings with the given fps, with a newer modification time unless touch is False"""
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        with open(self.file_path, "w") as f:
+            json.dump({"Processing": {"Fps": fps}}, f)
+        if touch:
+            self.mtime += 10
+        os.utime(self.file_path, (self.mtime, self.mtime))
+
+    def test_reload_when_file_changes(self):
+        self.write_fps(10)
+        self.assertEqual(get_settings().processing.fps, 10)
+
+        self.write_fps(15)
+        self.now += SETTINGS_CHECK_INTERVAL
+        self.assertEqual(get_settings().processing.fps, 15)
+
+    def test_unchanged_file_not_reloaded(self):
+        self.write_fps(10)
+        get_settings()
+        with mock.patch("backend.settings.load_settings") as load_settings:
+            for _ in range(3):
+                self.now += SETTINGS_CHECK_INTERVAL
+                self.assertEqual(get_settings().processing.fps, 10)
+        load_settings.assert_not_called()
+
+    def test_check_interval(self):
+        self.write_fps(10)
+        get_settings()
+
+        # the file is not looked at again until the interval has passed
+        self.write_fps(15)
+        self.now += SETTINGS_CHECK_INTERVAL / 2
+        with mock.patch("backend.settings.os.stat") as stat:
+            self.assertEqual(get_settings().processing.fps, 10)
+        stat.assert_not_called()
+
+        self.now += SETTINGS_CHECK_INTERVAL / 2
+        self.assertEqual(get_settings().processing.fps, 15)
+
+    def test_invalidate_settings(self):
+        self.write_fps(10)
+        get_settings()
+
+        # same modification time, e.g. saved by another process within the file system's resolution
+        self.write_fps(15, touch=False)
+        self.now += SETTINGS_CHECK_INTERVAL
+        self.assertEqual(get_settings().processing.fps, 10)
+
+        invalidate_settings()
+        self.assertEqual(get_settings().processing.fps, 15)
+
+    def test_save_settings(self):
+        self.write_fps(10)
+        get_settings()
+
+        settings = Settings()
+        settings.processing.fps = 25
+        save_settings(settings)
+        self.assertEqual(settings_module._settings_mtime, os.stat(self.file_path).st_mtime)
+
+        # the saved file is not loaded again by the process that saved it
+        with mock.patch("backend.settings.load_settings") as load_settings:
+            self.now += SETTINGS_CHECK_INTERVAL
+            self.assertEqual(get_settings().processing.fps, 25)
+        load_settings.assert_not_called()
+
+    def test_copies(self):
+        self.write_fps(10)
+        get_settings().processing.fps = 99
+        self.assertEqual(get_settings().processing.fps, 10)
+
+        settings = Settings()
+        save_settings(settings)
+        settings.processing.fps = 77
+        self.assertEqual(get_settings().processing.fps, 20)
+        self.assertIsNot(get_settings(), get_settings())
+
+
+if __name__ == "__main__":
+    unittest.main()
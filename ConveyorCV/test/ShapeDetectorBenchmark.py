@@ -0,0 +1,95 @@
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from algorithms.ShapeDetector import ShapeDetector, FULL_DETECTION, FAST_DETECTION
+from backend.settings import Settings
+from model.model import DetectionContext
+
+BACKGROUND = "data/frame_empty_1280x720.png"
+ACCUMULATORS = ["data/test_acc1.png", "data/test_acc2.png", "data/test_acc3.png"]
+FRAMES = 40
+
+
+def make_frames(count: int, seed: int = 0) -> list[tuple[np.ndarray, tuple]]:
+    """Accumulators of random size pasted at random positions onto the empty conveyor, with sensor noise"""
+    rng = np.random.default_rng(seed)
+    background = cv2.imread(BACKGROUND)
+    accumulators = [cv2.imread(path) for path in ACCUMULATORS]
+    height, width = background.shape[:2]
+
+    frames = []
+    for i in range(count):
+        accumulator = accumulators[i % len(accumulators)]
+        scale = rng.uniform(0.45, 0.7)
+        accumulator = cv2.resize(accumulator, None, fx=scale, fy=scale)
+        h, w = accumulator.shape[:2]
+        x = int(rng.integers(-w // 2, width - w // 2))
+        y = int(rng.integers(50, height - h - 50))
+
+        frame = background.copy()
+        x0, x1 = max(x, 0), min(x + w, width)
+        frame[y:y + h, x0:x1] = accumulator[:, x0 - x:x1 - x]
+        frame = cv2.add(frame, rng.integers(0, 6, frame.shape, dtype=np.uint8))
+        frames.append((frame, (x0, y, x1, y + h)))
+    return frames
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a > 0, b > 0
+    union = np.count_nonzero(a | b)
+    return 1.0 if union == 0 else np.count_nonzero(a & b) / union
+
+
+def box_mask(shape, box) -> np.ndarray:
+    mask = np.zeros(shape[:2], np.uint8)
+    x0, y0, x1, y1 = box
+    mask[y0:y1, x0:x1] = 255
+    return mask
+
+
+def detector(mode: str, scale: float = 0.5) -> ShapeDetector:
+    settings = Settings(bg_photo_path=BACKGROUND)
+    settings.detection.detection_mode = mode
+    settings.detection.fast_detection_scale = scale
+    # a fixed background, so every mode sees the same frames the same way
+    settings.detection.background_learning_rate = 0
+    return ShapeDetector(settings)
+
+
+def run(shape_detector: ShapeDetector, frames) -> tuple[list[np.ndarray], float]:
+    """Masks and mean detect() time in ms"""
+    masks = []
+    start = time.perf_counter()
+    for frame, _ in frames:
+        masks.append(shape_detector.detect(DetectionContext(image=frame)).shape)
+    return masks, (time.perf_counter() - start) / len(frames) * 1000
+
+
+class ShapeDetectorBenchmark(unittest.TestCase):
+    """
+    Fast detection against the full path: mask IoU with the full path and with the pasted accumulator,
+    and per frame speedup. Run with output to see the table: python -m pytest -s test/ShapeDetectorBenchmark.py
+    """
+    frames = make_frames(FRAMES)
+
+    def test_fast_detection(self):
+        full_masks, full_ms = run(detector(FULL_DETECTION), self.frames)
+        full_truth_iou = np.mean([iou(m, box_mask(m.shape, box)) for m, (_, box) in zip(full_masks, self.frames)])
+        print(f"\n{'mode':<12}{'IoU full':>10}{'IoU truth':>11}{'ms':>8}{'speedup':>9}")
+        print(f"{'full':<12}{1:>10.3f}{full_truth_iou:>11.3f}{full_ms:>8.2f}{1:>9.1f}")
+
+        for scale in (0.5, 0.25):
+            masks, ms = run(detector(FAST_DETECTION, scale), self.frames)
+            full_iou = np.mean([iou(m, f) for m, f in zip(masks, full_masks)])
+            truth_iou = np.mean([iou(m, box_mask(m.shape, box)) for m, (_, box) in zip(masks, self.frames)])
+            print(f"{f'fast {scale}':<12}{full_iou:>10.3f}{truth_iou:>11.3f}{ms:>8.2f}{full_ms / ms:>9.1f}")
+
+            if scale == 0.5:
+                self.assertGreater(full_iou, 0.75)
+
+
+if __name__ == "__main__":
+    unittest.main()
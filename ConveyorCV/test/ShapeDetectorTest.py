@@ -0,0 +1,105 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from algorithms.ShapeDetector import ShapeDetector, BACKGROUND_UPDATE_INTERVAL
+from backend.settings import Settings
+from model.model import DetectionContext
+
+BACKGROUND = "data/frame_empty_1280x720.png"
+
+
+class ShapeDetectorTest(unittest.TestCase):
+    background = cv2.imread(BACKGROUND)
+    accumulator = cv2.resize(cv2.imread("data/test_acc1.png"), None, fx=0.6, fy=0.6)
+
+    def detector(self, **detection) -> ShapeDetector:
+        settings = Settings(bg_photo_path=BACKGROUND)
+        for name, value in detection.items():
+            setattr(settings.detection, name, value)
+        return ShapeDetector(settings)
+
+    def frame_with_accumulator(self, x: int, y: int) -> np.ndarray:
+        frame = self.background.copy()
+        h, w = self.accumulator.shape[:2]
+        frame[y:y + h, x:x + w] = self.accumulator
+        return frame
+
+    def test_line_gate(self):
+        detector = self.detector()
+        h = self.accumulator.shape[0]
+
+        self.assertFalse(detector.is_line_occupied(self.background))
+        self.assertTrue(detector.is_line_occupied(self.frame_with_accumulator(380, 360 - h // 2)))
+        # accumulator above the detection line
+        self.assertFalse(detector.is_line_occupied(self.frame_with_accumulator(380, 10)))
+
+    def test_line_gate_disabled(self):
+        detector = self.detector(line_gate_coverage=0)
+        self.assertTrue(detector.is_line_occupied(self.background))
+
+    def test_line_gate_fast_mode(self):
+        detector = self.detector(detection_mode="fast")
+        h = self.accumulator.shape[0]
+
+        self.assertFalse(detector.is_line_occupied(self.background))
+        self.assertTrue(detector.is_line_occupied(self.frame_with_accumulator(380, 360 - h // 2)))
+
+    def test_shapes_not_reused(self):
+        for mode in ["full", "fast"]:
+            detector = self.detector(detection_mode=mode, background_learning_rate=0)
+            frame = self.frame_with_accumulator(380, 200)
+
+            shape = detector.detect(DetectionContext(image=frame)).shape
+            expected = shape.copy()
+            self.assertTrue(expected.any())
+            # scratch buffers are reused for the next frame, the shape handed on must stay intact
+            detector.detect(DetectionContext(image=self.background))
+            np.testing.assert_array_equal(shape, expected)
+            np.testing.assert_array_equal(detector.detect(DetectionContext(image=frame)).shape, expected)
+
+    def test_background_follows_brightness(self):
+        detector = self.detector(background_learning_rate=0.1)
+        frame = cv2.add(self.background, 20)
+        target = cv2.morphologyEx(frame, cv2.MORPH_CLOSE, detector.kernel, iterations=3).astype(np.float32)
+        self.assertGreater(cv2.absdiff(detector.image_conveyor_empty.astype(np.float32), target).mean(), 15)
+
+        for _ in range(BACKGROUND_UPDATE_INTERVAL * 10):
+            context = detector.detect(DetectionContext(image=frame))
+            # the shift is below the diff threshold, it is absorbed instead of detected
+            self.assertFalse(context.shape.any())
+        self.assertLess(cv2.absdiff(detector.image_conveyor_empty.astype(np.float32), target).mean(), 1)
+
+    def test_background_keeps_foreground(self):
+        detector = self.detector(background_learning_rate=0.5)
+        before = detector.image_conveyor_empty.copy()
+        frame = cv2.add(self.frame_with_accumulator(380, 200), 20)
+
+        for _ in range(BACKGROUND_UPDATE_INTERVAL):
+            context = detector.detect(DetectionContext(image=frame))
+        # the background is blended at the end of the last detection, with its threshold and shape
+        foreground = cv2.bitwise_or(detector._ShapeDetector__buffers["thresh"], context.shape) > 0
+        self.assertTrue(foreground.any())
+
+        changed = (detector.image_conveyor_empty != before).any(axis=2)
+        self.assertFalse(changed[foreground].any())
+        self.assertGreater(changed[~foreground].mean(), 0.9)
+
+    def test_background_counts_skipped_frames(self):
+        detected, gated = self.detector(background_learning_rate=0.1), self.detector(background_learning_rate=0.1)
+        frame = cv2.add(self.background, 20)
+
+        for _ in range(BACKGROUND_UPDATE_INTERVAL):
+            detected.detect(DetectionContext(image=frame))
+        # frames skipped by the line gate adapt the background as if they were detected
+        for _ in range(BACKGROUND_UPDATE_INTERVAL - 1):
+            gated.skip_frame()
+        gated.detect(DetectionContext(image=frame))
+
+        self.assertFalse(np.array_equal(detected.image_conveyor_empty, self.detector().image_conveyor_empty))
+        np.testing.assert_array_equal(gated.image_conveyor_empty, detected.image_conveyor_empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
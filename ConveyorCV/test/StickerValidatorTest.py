@@ -2,11 +2,13 @@ import logging
 import logging.config
 import os
 import unittest
+from unittest import mock
 
 import cv2
 import numpy as np
 
-from algorithms.StickerValidator import StickerValidator
+from algorithms.StickerValidator import StickerValidator, fit_window
+from backend.settings import get_settings
 from utils.param_persistence import get_sticker_parameters
 from model.model import DetectionContext, StickerValidationResult, StickerValidationParams
 from utils.env import TEST_PRINT_EN
@@ -208,6 +210,67 @@ class StickerValidatorTest(unittest.TestCase):
     def test_no_sticker_present(self):
         self.assert_accum(obj="data/test_acc3.png", expect_present=False)
 
+    def test_fit_window(self):
+        # large enough windows are kept as is
+        self.assertEqual(fit_window(10, 80, 50, 100), (10, 80))
+        # small windows grow to the right, or to the left at the image border
+        self.assertEqual(fit_window(10, 20, 50, 100), (10, 60))
+        self.assertEqual(fit_window(90, 95, 50, 100), (50, 100))
+        # an image smaller than the template is searched whole
+        self.assertEqual(fit_window(5, 10, 50, 30), (0, 30))
+
+    def test_search_window(self):
+        x0, y0, x1, y1 = self.sv.search_window(847, 462, 10)
+        self.assertTrue(0 <= x0 < x1 <= 847 and 0 <= y0 < y1 <= 462)
+        self.assertLess((x1 - x0) * (y1 - y0), 847 * 462)
+
+        # tolerance beyond the image is clamped at the borders
+        self.assertEqual(self.sv.search_window(847, 462, 100), (0, 0, 847, 462))
+        # a window smaller than the largest template grows, up to the whole image
+        self.assertEqual(self.sv.search_window(100, 50, 0), (0, 0, 100, 50))
+        x0, y0, x1, y1 = self.sv.search_window(2000, 1000, 0)
+        design_height, design_width = self.sv.get_parameters().sticker_design.shape[:2]
+        self.assertGreaterEqual(x1 - x0, int(design_width * 0.22))
+        self.assertGreaterEqual(y1 - y0, int(design_height * 0.22))
+
+    @staticmethod
+    def validate_full_and_roi(center: tuple[float, float], image_path: str) -> list[StickerValidationResult]:
+        """Validates the image with full and ROI search, expecting a sticker like the one on test_acc1.png at center"""
+        sv = StickerValidator(StickerValidationParams(sticker_design=get_sticker_parameters().sticker_design,
+                                                      sticker_center=center, acc_size=(847.0, 462.0),
+                                                      sticker_size=(628.0, 234.0), sticker_rotation=-1.0))
+        results = []
+        for roi_search in [False, True]:
+            settings = get_settings()
+            settings.validation.roi_search = roi_search
+            with mock.patch("algorithms.StickerValidator.get_settings", return_value=settings):
+                cx = DetectionContext(cv2.imread("data/frame_empty_1280x720.png"))
+                cx.processed_image = cv2.imread(image_path)
+                results.append(sv.validate_frame(cx).validation_results)
+        return results
+
+    def assert_same_match(self, full: StickerValidationResult, roi: StickerValidationResult):
+        self.assertIsNotNone(full.sticker_position)
+        self.assertEqual(full.sticker_position, roi.sticker_position)
+        self.assertEqual(full.sticker_rotation, roi.sticker_rotation)
+        self.assertEqual(full.sticker_size, roi.sticker_size)
+        self.assertEqual(full.sticker_matches_design, roi.sticker_matches_design)
+
+    def test_roi_search_same_match(self):
+        # the sticker on test_acc1.png is at (443, 245), inside the search window
+        full, roi = self.validate_full_and_roi((443.0, 245.0), "data/test_acc1.png")
+        self.assert_same_match(full, roi)
+        self.assertTrue(roi.sticker_matches_design)
+
+    def test_roi_search_rejects_misplaced_sticker(self):
+        # the sticker is outside position tolerance and crosses the search window border, so the window holds
+        # partial matches of smaller templates that are not the best match in the whole image
+        for center in [(200.0, 245.0), (331.0, 230.0), (443.0, 120.0)]:
+            full, roi = self.validate_full_and_roi(center, "data/test_acc1.png")
+            self.assert_same_match(full, roi)
+            self.assertEqual(roi.sticker_position, (443.27, 244.93))
+            self.assertFalse(roi.sticker_matches_design)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from multiprocessing import Pipe
+from unittest import mock
+
+import numpy as np
+
+from model.model import DetectionContext, StreamingMessageType, ImageStreamingMessageContent
+from processes import ShapeProcessorProcess
+from utils.bounded_queue import BoundedQueue
+from utils.stream_demand import StreamDemand, is_streamed
+
+
+class StreamDemandTest(unittest.TestCase):
+    def test_subscribers(self):
+        demand = StreamDemand()
+        self.assertFalse(any(demand.is_wanted(message_type) for message_type in StreamingMessageType))
+
+        demand.subscribe()
+        demand.subscribe([StreamingMessageType.VALIDATION])
+        self.assertEqual(demand.subscribers(StreamingMessageType.VALIDATION), 2)
+        self.assertEqual(demand.subscribers(StreamingMessageType.RAW), 1)
+
+        demand.unsubscribe()
+        self.assertFalse(demand.is_wanted(StreamingMessageType.RAW))
+        self.assertTrue(demand.is_wanted(StreamingMessageType.VALIDATION))
+        # unbalanced unsubscribes do not go below zero
+        demand.unsubscribe()
+        demand.unsubscribe()
+        demand.subscribe([StreamingMessageType.RAW])
+        self.assertTrue(demand.is_wanted(StreamingMessageType.RAW))
+
+    def test_is_streamed(self):
+        demand = StreamDemand()
+        self.assertFalse(is_streamed(demand, StreamingMessageType.PROCESSED))
+        demand.subscribe([StreamingMessageType.PROCESSED])
+        self.assertTrue(is_streamed(demand, StreamingMessageType.PROCESSED))
+        # processes created without demand tracking stream everything
+        self.assertTrue(is_streamed(None, StreamingMessageType.PROCESSED))
+
+    def run_processor(self, demand: StreamDemand) -> tuple[BoundedQueue, mock.Mock]:
+        """Runs ShapeProcessorProcess in this process on one frame, returns the websocket queue and the encoder"""
+        mask_queue, image_queue, ws_queue = BoundedQueue("mask"), BoundedQueue("image"), BoundedQueue("websocket")
+        context = DetectionContext(image=np.zeros((8, 8, 3), np.uint8))
+        context.processed_image = context.image
+        mask_queue.put(context)
+        mask_queue.put(None)
+
+        shape_processor = mock.Mock()
+        shape_processor.process.side_effect = lambda c: c
+        parent_pipe, child_pipe = Pipe()
+        process = ShapeProcessorProcess(mask_queue, image_queue, ws_queue, shape_processor, child_pipe,
+                                        stream_demand=demand)
+        with mock.patch("processes.ImageStreamingMessageContent", wraps=ImageStreamingMessageContent) as encoder:
+            process.run()
+
+        self.assertEqual(image_queue.qsize(), 1)
+        return ws_queue, encoder
+
+    def test_not_encoded_without_subscribers(self):
+        demand = StreamDemand()
+        demand.subscribe([StreamingMessageType.RAW, StreamingMessageType.VALIDATION])
+        ws_queue, encoder = self.run_processor(demand)
+        encoder.assert_not_called()
+        self.assertTrue(ws_queue.empty())
+
+    def test_encoded_with_subscribers(self):
+        demand = StreamDemand()
+        demand.subscribe([StreamingMessageType.PROCESSED])
+        ws_queue, encoder = self.run_processor(demand)
+        encoder.assert_called_once()
+        self.assertEqual(ws_queue.get(timeout=1).type, StreamingMessageType.PROCESSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import json
+import struct
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from model.model import (StreamingMessage, StreamingMessageType, ImageStreamingMessageContent,
+                         ValidationStreamingMessageContent, StickerValidationResult)
+
+# what the /example viewer reads: type (uint8), seq number (uint32), timestamp in ms (int64), little-endian
+HEADER_SIZE = 13
+
+
+def unpack_binary(data: bytes) -> tuple[int, int, int, bytes]:
+    message_type, seq, timestamp = struct.unpack_from("<BIq", data)
+    return message_type, seq, timestamp, data[HEADER_SIZE:]
+
+
+class StreamingMessageTest(unittest.TestCase):
+    def test_serialized_once(self):
+        message = StreamingMessage(StreamingMessageType.RAW, ImageStreamingMessageContent(np.zeros((4, 4), np.uint8)))
+        with mock.patch.object(message.content, "to_dict", wraps=message.content.to_dict) as to_dict, \
+                mock.patch.object(message.content, "to_bytes", wraps=message.content.to_bytes) as to_bytes:
+            serialized = message.serialize()
+            binary = message.serialize_binary()
+            # every client gets the bytes built for the first one
+            for _ in range(3):
+                self.assertIs(message.serialize(), serialized)
+                self.assertIs(message.serialize_binary(), binary)
+        self.assertEqual(to_dict.call_count, 1)
+        self.assertEqual(to_bytes.call_count, 1)
+
+        self.assertEqual(json.loads(serialized), {"type": StreamingMessageType.RAW,
+                                                  "content": json.dumps(message.content.to_dict())})
+
+    def test_binary_header_layout(self):
+        self.assertEqual(StreamingMessage.BINARY_HEADER.size, HEADER_SIZE)
+
+        message = StreamingMessage(StreamingMessageType.SHAPE, ImageStreamingMessageContent(np.zeros((4, 4), np.uint8)), 7)
+        message.timestamp = 1_700_000_000_123
+        self.assertEqual(message.serialize_binary()[:HEADER_SIZE],
+                         bytes([2]) + (7).to_bytes(4, "little") + (1_700_000_000_123).to_bytes(8, "little"))
+
+        # the seq number wraps at 32 bits instead of failing to pack
+        message = StreamingMessage(StreamingMessageType.RAW, ImageStreamingMessageContent(np.zeros((4, 4), np.uint8)),
+                                   2 ** 32 + 5)
+        self.assertEqual(unpack_binary(message.serialize_binary())[1], 5)
+
+    def test_binary_image_round_trip(self):
+        image = np.zeros((48, 64, 3), np.uint8)
+        image[:, 32:] = 255
+        message = StreamingMessage(StreamingMessageType.RAW, ImageStreamingMessageContent(image), 42)
+
+        message_type, seq, timestamp, payload = unpack_binary(message.serialize_binary())
+        self.assertEqual((message_type, seq, timestamp), (StreamingMessageType.RAW, 42, message.timestamp))
+        # the payload is the JPEG itself, not base64
+        self.assertEqual(payload, message.content.jpeg)
+        decoded = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(decoded.shape, image.shape)
+        self.assertLess(cv2.absdiff(decoded, image).mean(), 5)
+
+    def test_binary_validation_round_trip(self):
+        result = StickerValidationResult(sticker_present=True, sticker_matches_design=False, sticker_position=(10, 20),
+                                         sticker_size=(30.5, 40), sticker_rotation=-1.5, seq_number=9,
+                                         detected_at=datetime(2024, 1, 2, 3, 4, 5))
+        message = StreamingMessage(StreamingMessageType.VALIDATION, ValidationStreamingMessageContent(result), 9)
+
+        message_type, seq, timestamp, payload = unpack_binary(message.serialize_binary())
+        self.assertEqual((message_type, seq, timestamp), (StreamingMessageType.VALIDATION, 9, message.timestamp))
+        self.assertEqual(json.loads(payload.decode("utf-8")), {"ValidationResult": {
+            "Image": None,
+            "Timestamp": "2024-01-02T03:04:05",
+            "SeqNumber": 9,
+            "StickerPresent": True,
+            "StickerMatchesDesign": False,
+            "StickerSize": {"Width": 30.5, "Height": 40.0},
+            "StickerPosition": {"X": 10.0, "Y": 20.0},
+            "StickerRotation": -1.5,
+        }})
+
+
+if __name__ == "__main__":
+    unittest.main()
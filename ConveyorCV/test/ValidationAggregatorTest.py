@@ -0,0 +1,121 @@
+import unittest
+from multiprocessing import Pipe, Value
+
+from algorithms.StickerValidator import ValidationAggregator
+from backend.settings import Settings
+from model.model import StickerValidationResult, IPCMessage, IPCMessageType
+from processes import ValidationAggregatorProcess
+from utils.bounded_queue import BoundedQueue
+
+
+def frame_result(seq_number: int, rotation: float) -> StickerValidationResult:
+    return StickerValidationResult(sticker_present=True, sticker_matches_design=True, sticker_position=(10, 20),
+                                   sticker_size=(5, 5), sticker_rotation=rotation, seq_number=seq_number)
+
+
+class ValidationAggregatorTest(unittest.TestCase):
+    def test_out_of_order_frames(self):
+        aggregator = ValidationAggregator()
+
+        self.assertEqual(aggregator.add(1, frame_result(1, 2)), [])
+        self.assertEqual(aggregator.add(3, frame_result(2, 4)), [])
+        self.assertEqual(aggregator.add(0, frame_result(1, 1)), [])
+
+        combined = aggregator.add(2, frame_result(1, 3))
+        self.assertEqual([(r.seq_number, r.sticker_rotation) for r in combined], [(1, 2)])
+
+        combined = aggregator.flush()
+        self.assertEqual([(r.seq_number, r.sticker_rotation) for r in combined], [(2, 4)])
+        self.assertEqual(aggregator.flush(), [])
+
+    def test_failed_frame_does_not_block(self):
+        aggregator = ValidationAggregator()
+
+        self.assertEqual(aggregator.add(1, frame_result(1, 1)), [])
+        self.assertEqual(aggregator.add(0, None), [])
+        self.assertEqual(aggregator.next_frame_index, 2)
+
+    def test_missing_frame_expires(self):
+        aggregator = ValidationAggregator(frame_timeout=0)
+
+        aggregator.add(2, frame_result(1, 1))
+        self.assertEqual(aggregator.next_frame_index, 0)
+
+        aggregator.expire()
+        self.assertEqual(aggregator.next_frame_index, 3)
+        self.assertEqual(aggregator.skipped_frames, 2)
+        # its accumulator is not combined yet, so the late frame still counts
+        self.assertEqual(aggregator.add(0, frame_result(1, 5)), [])
+        self.assertEqual([r.sticker_rotation for r in aggregator.flush()], [3])
+
+    def test_late_frames(self):
+        aggregator = ValidationAggregator(frame_timeout=0)
+        aggregator.add(1, frame_result(1, 1))
+        aggregator.expire()
+
+        # the accumulator of the late frame is still collected, the frame is combined with it
+        self.assertEqual(aggregator.add(0, frame_result(1, 3)), [])
+        self.assertEqual(aggregator.late_frames, 0)
+        aggregator.add(3, frame_result(2, 4))
+        aggregator.expire()
+        self.assertEqual([(r.seq_number, r.sticker_rotation) for r in aggregator.flush()], [(2, 4)])
+
+        # too late for its accumulator, counted instead
+        self.assertEqual(aggregator.add(2, frame_result(1, 5)), [])
+        self.assertEqual(aggregator.late_frames, 1)
+
+    def test_late_frame_of_combined_accumulator(self):
+        aggregator = ValidationAggregator(frame_timeout=0)
+        aggregator.add(1, frame_result(1, 1))
+        aggregator.expire()
+        self.assertEqual(len(aggregator.flush()), 1)
+
+        self.assertEqual(aggregator.add(0, frame_result(1, 3)), [])
+        self.assertEqual(aggregator.late_frames, 1)
+        self.assertEqual(aggregator.flush(), [])
+
+
+class ValidationAggregatorProcessTest(unittest.TestCase):
+    """The process is run in this one, messages are sent before the stop sentinel"""
+
+    def setUp(self):
+        self.validated_queue = BoundedQueue("validated_queue")
+        self.results_queue = BoundedQueue("results_queue")
+        self.parent_pipe, child_pipe = Pipe()
+        self.process = ValidationAggregatorProcess(self.validated_queue, self.results_queue,
+                                                   BoundedQueue("websocket_queue"), Value('q', 0), child_pipe)
+
+    def run_process(self, *messages: IPCMessage) -> list[IPCMessage]:
+        for message in messages:
+            self.parent_pipe.send(message)
+        self.validated_queue.put(None)
+        self.process.run()
+        responses = []
+        while self.parent_pipe.poll(1):
+            responses.append(self.parent_pipe.recv())
+        return responses
+
+    def test_context_round_trip(self):
+        self.process.aggregator.add(0, frame_result(7, 1))
+        (response,) = self.run_process(IPCMessage.create_get_context(self.process.process_name))
+        self.assertEqual(response.message_type, IPCMessageType.CONTEXT)
+        self.assertEqual(response.content, {"last_processed_acc_number": 7})
+
+        restarted = ValidationAggregatorProcess(self.validated_queue, self.results_queue,
+                                                BoundedQueue("websocket_queue"), Value('q', 0), Pipe()[1])
+        restarted.restore_context(response.content)
+        # the first accumulator after a restart continues the numbering of the previous run
+        self.assertEqual(restarted.aggregator.add(0, frame_result(7, 2)), [])
+        self.assertEqual([r.seq_number for r in restarted.aggregator.add(1, frame_result(8, 3))], [7])
+
+    def test_settings(self):
+        settings = Settings()
+        settings.processing.validation_frame_timeout = 0.5
+        (response,) = self.run_process(IPCMessage(IPCMessageType.SETTINGS, self.process.process_name,
+                                                  settings.to_dict()))
+        self.assertEqual(response.message_type, IPCMessageType.SETTINGS)
+        self.assertEqual(self.process.aggregator.frame_timeout, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
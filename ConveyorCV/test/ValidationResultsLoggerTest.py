@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from backend.db import init_schema
+from model.model import StickerValidationResult, ValidationLog, ValidationStatsMinute
+from processes import ValidationResultsLogger, LOG_FLUSH_RETRIES
+from utils.bounded_queue import BoundedQueue
+
+
+def result(seq_number: int, **kwargs) -> StickerValidationResult:
+    kwargs.setdefault("sticker_matches_design", True)
+    return StickerValidationResult(sticker_present=True, seq_number=seq_number,
+                                   detected_at=datetime(2024, 1, 1, 12, 0, seq_number % 60), **kwargs)
+
+
+class ValidationResultsLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'logs.db')}")
+        init_schema(self.engine)
+
+        self.logger = ValidationResultsLogger(BoundedQueue("results_queue"), batch_size=10)
+        self.logger.session = Session(bind=self.engine)
+        self.encoder = ThreadPoolExecutor(max_workers=1)
+        self.logger._ValidationResultsLogger__encoder = self.encoder
+
+    def tearDown(self):
+        self.logger.session.close()
+        self.encoder.shutdown()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def logged(self) -> list[int]:
+        return sorted(seq for (seq,) in self.logger.session.query(ValidationLog.seq_number))
+
+    def test_batch(self):
+        for seq_number in range(5):
+            self.logger.add(result(seq_number))
+        # failed validations keep their image
+        self.logger.add(result(5, sticker_matches_design=False, sticker_image=np.zeros((8, 8, 3), np.uint8)))
+        self.logger.flush()
+
+        self.assertEqual(self.logged(), list(range(6)))
+        self.assertIsNotNone(self.logger.session.query(ValidationLog.image_hash).filter(
+            ValidationLog.seq_number == 5).scalar())
+        self.assertEqual(sum(r.total_count for r in self.logger.session.query(ValidationStatsMinute)), 6)
+
+    def test_failing_rows_dropped(self):
+        for seq_number in range(4):
+            self.logger.add(result(seq_number))
+        # an image the encoder fails on and a timestamp the database rejects, both on every attempt
+        self.logger.add(result(4, sticker_matches_design=False, sticker_image=np.zeros((0, 0), np.uint8)))
+        bad_timestamp = result(5)
+        bad_timestamp.detected_at = "yesterday"
+        self.logger.add(bad_timestamp)
+        self.logger.add(result(6))
+
+        for _ in range(LOG_FLUSH_RETRIES - 1):
+            self.logger.flush()
+            self.assertEqual(self.logged(), [])
+
+        self.logger.flush()
+        self.assertEqual(self.logged(), [0, 1, 2, 3, 6])
+        self.assertEqual(self.logger.dropped, 2)
+        self.assertEqual(sum(r.total_count for r in self.logger.session.query(ValidationStatsMinute)), 5)
+
+        # later batches are written as usual
+        self.logger.add(result(7))
+        self.logger.flush()
+        self.assertEqual(self.logged(), [0, 1, 2, 3, 6, 7])
+
+    def test_pending_bounded(self):
+        bad_timestamp = result(0)
+        bad_timestamp.detected_at = "yesterday"
+        self.logger.add(bad_timestamp)
+        for seq_number in range(1, self.logger.max_pending + 5):
+            self.logger.add(result(seq_number))
+
+        # the oldest rows, the failing one among them, made room for new ones
+        self.assertEqual(self.logger.dropped, 5)
+        self.logger.flush()
+        self.assertEqual(self.logged(), list(range(5, self.logger.max_pending + 5)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import unittest
+
+import cv2
+import numpy as np
+
+from backend.websocket_manager import WebSocketManager, parse_subscriptions, BINARY_PROTOCOL
+from model.model import StreamingMessage, StreamingMessageType, ImageStreamingMessageContent
+from utils.stream_demand import StreamDemand
+
+
+class FakeWebSocket:
+    """Records sent frames, or never completes sends and closes when stalled"""
+
+    def __init__(self, stalled: bool = False):
+        self.client = None
+        self.stalled = stalled
+        self.sent: list[bytes] = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.closed = True
+
+
+def image_message(width: int) -> StreamingMessage:
+    image = np.zeros((width // 2, width, 3), np.uint8)
+    return StreamingMessage(StreamingMessageType.RAW, ImageStreamingMessageContent(image))
+
+
+def subscription_message(*subscriptions: dict) -> str:
+    return json.dumps({"Subscriptions": list(subscriptions)})
+
+
+class WebSocketManagerTest(unittest.IsolatedAsyncioTestCase):
+    def test_parse_subscriptions(self):
+        subscriptions = parse_subscriptions(subscription_message({"Type": 4}, {"Type": 1, "MaxFps": 5, "MaxWidth": 640}))
+        self.assertEqual(list(subscriptions), [StreamingMessageType.VALIDATION, StreamingMessageType.RAW])
+        self.assertEqual(subscriptions[StreamingMessageType.VALIDATION].max_fps, 0)
+        self.assertEqual(subscriptions[StreamingMessageType.RAW].max_fps, 5)
+        self.assertEqual(subscriptions[StreamingMessageType.RAW].max_width, 640)
+        self.assertEqual(parse_subscriptions(subscription_message()), {})
+
+        # keep-alive and other messages are not subscriptions
+        self.assertIsNone(parse_subscriptions("ping"))
+        self.assertIsNone(parse_subscriptions("[1, 2]"))
+        self.assertIsNone(parse_subscriptions('{"Ping": 1}'))
+
+        with self.assertRaises(ValueError):
+            parse_subscriptions(subscription_message({"Type": 99}))
+        with self.assertRaises(KeyError):
+            parse_subscriptions(subscription_message({"MaxFps": 5}))
+
+    async def test_handle_client_message(self):
+        demand = StreamDemand()
+        manager = WebSocketManager(demand)
+        ws = FakeWebSocket()
+        await manager.connect(ws)
+        self.assertTrue(all(demand.is_wanted(message_type) for message_type in StreamingMessageType))
+
+        manager.handle_client_message(ws, subscription_message({"Type": 4}))
+        self.assertEqual(list(manager.clients[ws].subscriptions), [StreamingMessageType.VALIDATION])
+        self.assertTrue(demand.is_wanted(StreamingMessageType.VALIDATION))
+        self.assertFalse(demand.is_wanted(StreamingMessageType.RAW))
+
+        # invalid and keep-alive messages leave the subscription as is
+        manager.handle_client_message(ws, subscription_message({"Type": 99}))
+        manager.handle_client_message(ws, "ping")
+        self.assertEqual(list(manager.clients[ws].subscriptions), [StreamingMessageType.VALIDATION])
+
+        manager.disconnect(ws)
+        self.assertFalse(demand.is_wanted(StreamingMessageType.VALIDATION))
+
+    async def test_resized_stream(self):
+        manager = WebSocketManager()
+        small, full = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(small, BINARY_PROTOCOL)
+        await manager.connect(full, BINARY_PROTOCOL)
+        manager.handle_client_message(small, subscription_message({"Type": 1, "MaxWidth": 64}))
+
+        message = image_message(256)
+        await manager.broadcast_message(message)
+        for _ in range(100):
+            if small.sent and full.sent:
+                break
+            await asyncio.sleep(0.01)
+
+        header_size = StreamingMessage.BINARY_HEADER.size
+        widths = [cv2.imdecode(np.frombuffer(ws.sent[0][header_size:], np.uint8), cv2.IMREAD_UNCHANGED).shape[1]
+                  for ws in (small, full)]
+        self.assertEqual(widths, [64, 256])
+        self.assertFalse(message.needs_resize(64))
+
+    async def test_stalled_client_evicted_without_waiting(self):
+        manager = WebSocketManager(client_deadline_seconds=0.5)
+        stalled, healthy = FakeWebSocket(stalled=True), FakeWebSocket()
+        await manager.connect(stalled)
+        await manager.connect(healthy)
+
+        await manager.broadcast_message(image_message(64))
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(healthy.sent), 1)
+
+        # the stalled client is past its deadline before its sender task times out
+        manager.clients[stalled].sending_since -= 1
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await manager.broadcast_message(image_message(64))
+        self.assertLess(loop.time() - start, 0.1)
+        self.assertNotIn(stalled, manager.clients)
+        self.assertFalse(stalled.closed)
+
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(healthy.sent), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import time
+from multiprocessing import Queue, Value
+from queue import Empty, Full
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+# a full queue can look empty until its feeder thread flushes, drop_oldest waits this long before retrying
+DROP_RETRY_DELAY = 0.001
+
+
+class BoundedQueue:
+    """
+    multiprocessing.Queue with a size limit and an overflow policy:
+    block - producer waits for free space, drop_oldest - oldest item is discarded, drop_newest - new item is discarded.
+    Size, dropped items and high-water mark are counted in shared memory, so any process can report them
+    (Queue.qsize() is not available on macOS).
+    """
+
+    def __init__(self, name: str, maxsize: int = 0, policy: str = BLOCK):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown queue overflow policy: {policy}")
+
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.__queue = Queue(maxsize)
+        self.__size = Value('i', 0)
+        self.__dropped = Value('q', 0)
+        self.__high_water_mark = Value('i', 0)
+
+    def __reserve(self):
+        # counted before the item is queued, a consumer can take it as soon as it is in the queue.
+        # Reservations of items that end up dropped or timed out count too, a full queue never holds more than maxsize
+        with self.__size.get_lock():
+            self.__size.value += 1
+            size = min(self.__size.value, self.maxsize) if self.maxsize > 0 else self.__size.value
+            if size > self.__high_water_mark.value:
+                self.__high_water_mark.value = size
+
+    def __on_get(self):
+        with self.__size.get_lock():
+            self.__size.value -= 1
+
+    def __on_drop(self):
+        with self.__dropped.get_lock():
+            self.__dropped.value += 1
+
+    def put(self, item, block: bool = True, timeout: float | None = None):
+        # stop sentinels must never be lost, so they always make room for themselves
+        policy = DROP_OLDEST if item is None else self.policy
+
+        self.__reserve()
+        if policy == BLOCK:
+            try:
+                self.__queue.put(item, block, timeout)
+            except Full:
+                self.__on_get()
+                raise
+        elif policy == DROP_NEWEST:
+            try:
+                self.__queue.put_nowait(item)
+            except Full:
+                self.__on_get()
+                self.__on_drop()
+                return
+        else:
+            while True:
+                try:
+                    self.__queue.put_nowait(item)
+                    break
+                except Full:
+                    try:
+                        dropped = self.__queue.get_nowait()
+                    except Empty:
+                        time.sleep(DROP_RETRY_DELAY)
+                        continue
+                    if dropped is None and item is not None:
+                        # a queued stop sentinel is kept, the new item is dropped instead
+                        self.__queue.put(None)
+                        self.__on_get()
+                        self.__on_drop()
+                        return
+                    self.__on_get()
+                    self.__on_drop()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        item = self.__queue.get(block, timeout)
+        self.__on_get()
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self) -> bool:
+        return self.__queue.empty()
+
+    def qsize(self) -> int:
+        return self.__size.value
+
+    def stats(self) -> dict:
+        return {
+            "Name": self.name,
+            "Size": self.__size.value,
+            "MaxSize": self.maxsize,
+            "Policy": self.policy,
+            "Dropped": self.__dropped.value,
+            "HighWaterMark": self.__high_water_mark.value
+        }
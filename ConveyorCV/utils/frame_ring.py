@@ -0,0 +1,154 @@
+import logging
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from model.model import DetectionContext
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRing:
+    """
+    Fixed-size frame slots in shared memory.
+    The detector process copies every frame and its mask into the next slot, so queues carry only the slot index
+    and downstream processes map the slot without unpickling the image. Slots are reused round-robin; every slot
+    keeps the number of the frame it holds, so a reader that fell behind by a full ring detects the overwrite.
+    """
+
+    def __init__(self, width: int, height: int, slots: int):
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.__frame_number = 0
+        self.__owner = True
+
+        size = self.__header_size() + slots * self.__slot_size()
+        self.__shm = shared_memory.SharedMemory(create=True, size=size)
+        self.__map()
+        self.__generations[:] = 0
+        logger.info(f"Frame ring {self.__shm.name} created: {slots} slots of {width}x{height}, {size / 2 ** 20:.1f} MiB")
+
+    def __header_size(self) -> int:
+        return self.slots * np.dtype(np.int64).itemsize
+
+    def __slot_size(self) -> int:
+        return self.height * self.width * 4  # BGR image + mask
+
+    def __map(self):
+        buffer = self.__shm.buf
+        images_offset = self.__header_size()
+        masks_offset = images_offset + self.slots * self.height * self.width * 3
+        self.__generations = np.ndarray((self.slots,), dtype=np.int64, buffer=buffer)
+        self.__images = np.ndarray((self.slots, self.height, self.width, 3), dtype=np.uint8, buffer=buffer,
+                                   offset=images_offset)
+        self.__masks = np.ndarray((self.slots, self.height, self.width), dtype=np.uint8, buffer=buffer,
+                                  offset=masks_offset)
+
+    def __getstate__(self):
+        return {
+            "name": self.__shm.name,
+            "width": self.width,
+            "height": self.height,
+            "slots": self.slots,
+        }
+
+    def __setstate__(self, state):
+        self.width = state["width"]
+        self.height = state["height"]
+        self.slots = state["slots"]
+        self.__frame_number = 0
+        self.__owner = False
+        # the process that created the ring unlinks it, attached processes must not
+        if sys.version_info >= (3, 13):
+            self.__shm = shared_memory.SharedMemory(name=state["name"], track=False)
+        else:
+            # older versions always register the segment, with the resource tracker shared with the creating
+            # process that is a no-op and the creator's unlink still unregisters it once
+            self.__shm = shared_memory.SharedMemory(name=state["name"])
+        self.__map()
+
+    def fits(self, context: DetectionContext) -> bool:
+        return (context.image is not None and context.image.shape == (self.height, self.width, 3)
+                and context.shape is not None and context.shape.shape == (self.height, self.width))
+
+    def put(self, context: DetectionContext) -> DetectionContext:
+        """
+        Copy image and mask of the context to the next slot and replace them with the slot reference.
+        Contexts that do not fit the slot size are left as they are.
+        """
+        if not self.fits(context):
+            return context
+
+        self.__frame_number += 1
+        slot = self.__frame_number % self.slots
+
+        self.__generations[slot] = -1
+        np.copyto(self.__images[slot], context.image)
+        np.copyto(self.__masks[slot], context.shape)
+        self.__generations[slot] = self.__frame_number
+
+        context.image = None
+        context.shape = None
+        context.frame_slot = slot
+        context.frame_generation = self.__frame_number
+        return context
+
+    def is_current(self, context: DetectionContext) -> bool:
+        """Check that the slot referenced by the context still holds its frame"""
+        if context.frame_slot is None:
+            return True
+        return int(self.__generations[context.frame_slot]) == context.frame_generation
+
+    def attach(self, context: DetectionContext) -> bool:
+        """
+        Map image and mask of the referenced slot into the context without copying.
+        Returns False if the slot was already overwritten by a newer frame.
+        """
+        if context.frame_slot is None:
+            return True
+        if not self.is_current(context):
+            return False
+
+        context.image = self.__images[context.frame_slot]
+        context.shape = self.__masks[context.frame_slot]
+        return True
+
+    def detach(self, context: DetectionContext) -> bool:
+        """
+        Drop the slot views from the context before it is passed on.
+        Returns False if the slot was overwritten while the context was attached, so results computed from it are unreliable.
+        """
+        if context.frame_slot is None:
+            return True
+
+        context.image = None
+        context.shape = None
+        current = self.is_current(context)
+        context.frame_slot = None
+        return current
+
+    def materialize(self, context: DetectionContext) -> bool:
+        """Replace the slot reference with copies of image and mask, so the context outlives the ring"""
+        if context.frame_slot is None:
+            return True
+        if not self.attach(context):
+            return False
+
+        context.image = context.image.copy()
+        context.shape = context.shape.copy()
+        current = self.is_current(context)
+        context.frame_slot = None
+        return current
+
+    def close(self):
+        """Release the mapping, and the shared memory itself if this process created it"""
+        del self.__generations, self.__images, self.__masks
+        try:
+            self.__shm.close()
+        except BufferError:
+            logger.warning(f"Frame ring {self.__shm.name} is still referenced, leaving it mapped")
+        if self.__owner:
+            self.__shm.unlink()
+            logger.info(f"Frame ring {self.__shm.name} released")
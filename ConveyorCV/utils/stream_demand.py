@@ -0,0 +1,34 @@
+from multiprocessing import Array
+
+from model.model import StreamingMessageType
+
+
+class StreamDemand:
+    """
+    Number of websocket subscribers for every streaming message type, shared between processes.
+    Pipeline processes check it before encoding frames, so nothing is encoded while nobody watches.
+    """
+
+    def __init__(self):
+        self.__subscribers = Array('i', max(StreamingMessageType) + 1)
+
+    def subscribe(self, message_types=tuple(StreamingMessageType)):
+        with self.__subscribers.get_lock():
+            for message_type in message_types:
+                self.__subscribers[message_type] += 1
+
+    def unsubscribe(self, message_types=tuple(StreamingMessageType)):
+        with self.__subscribers.get_lock():
+            for message_type in message_types:
+                self.__subscribers[message_type] = max(self.__subscribers[message_type] - 1, 0)
+
+    def subscribers(self, message_type: StreamingMessageType) -> int:
+        return self.__subscribers[message_type]
+
+    def is_wanted(self, message_type: StreamingMessageType) -> bool:
+        return self.__subscribers[message_type] > 0
+
+
+def is_streamed(stream_demand: StreamDemand | None, message_type: StreamingMessageType) -> bool:
+    """Processes created without demand tracking stream everything"""
+    return stream_demand is None or stream_demand.is_wanted(message_type)
@@ -42,7 +42,8 @@ namespace ConveyorCV_frontend.Models
         bool? StickerMatchesDesign,
         PointF? StickerPosition,
         SizeF? StickerSize,
-        double? StickerRotation
+        double? StickerRotation,
+        bool HasImage = false // image is fetched separately from /validation/logs/{id}/image
     )
     {
         public bool IsItemValid => StickerPresent && StickerMatchesDesign!.Value; // todo: is it okay to hold logic here?
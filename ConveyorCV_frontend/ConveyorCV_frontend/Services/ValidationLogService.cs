@@ -64,6 +64,26 @@ namespace ConveyorCV_frontend.Services
             }
         }
         
+        public async Task<byte[]?> GetLogImageAsync(int logId)
+        {
+            try
+            {
+                var response = await _httpClient.GetAsync($"http://{_baseUrl}/validation/logs/{logId}/image");
+                if (response.StatusCode == System.Net.HttpStatusCode.NotFound)
+                    return null;
+                response.EnsureSuccessStatusCode();
+
+                return await response.Content.ReadAsByteArrayAsync();
+            }
+            catch (Exception ex)
+            {
+                Debug.WriteLine(ex.Message);
+                ErrorOccurred?.Invoke(ex.Message);
+
+                return null;
+            }
+        }
+
         public async Task<bool> DeleteLogAsync(int logId)
         {
             try
@@ -221,7 +221,10 @@ namespace ConveyorCV_frontend.ViewModels
         {
             var vm = new StickerValidationResultViewModel();
             var defaultImg = "R0lGODlhAQABAAAAACH5BAEKAAEALAAAAAABAAEAAAICTAEAOw==";
-            vm.LastResult = new(log.Image ?? defaultImg, 
+            var image = log.Image;
+            if (image is null && log.HasImage)
+                image = (await _logService.GetLogImageAsync(log.Id))?.ToEncodedString();
+            vm.LastResult = new(image ?? defaultImg, 
                 log.Timestamp, 
                 log.SeqNumber, 
                 log.StickerPresent, 